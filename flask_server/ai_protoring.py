@@ -1,31 +1,123 @@
-import cv2
-import math
-import json
-from face_detector import FaceMeshDetector
-from utils import get_eye_center, detect_pupil
+import numpy as np
+from face_detector import (FaceMeshDetector, LEFT_EYE, RIGHT_EYE, LEFT_IRIS, RIGHT_IRIS, LEFT_EYE_CORNERS,
+                           RIGHT_EYE_CORNERS, LIPS, NOSE)
+from contextlib import contextmanager
+from frame import as_frame
+from annotation_writer import write_annotated_image
+from gaze import landmark_gaze, contour_gaze
 import os
 
-def analyze_image(image_path, model, output_dir):
+# Landmarks the analysis needs, fetched from the face mesh in this order
+PROCTORING_LANDMARKS = (LEFT_EYE + RIGHT_EYE + LIPS + NOSE + LEFT_EYE_CORNERS + RIGHT_EYE_CORNERS
+                        + [LEFT_IRIS[0], RIGHT_IRIS[0]])
+LEFT_EYE_POINTS = slice(0, len(LEFT_EYE))
+RIGHT_EYE_POINTS = slice(LEFT_EYE_POINTS.stop, LEFT_EYE_POINTS.stop + len(RIGHT_EYE))
+MOUTH_UPPER, MOUTH_LOWER = RIGHT_EYE_POINTS.stop, RIGHT_EYE_POINTS.stop + 1
+NOSE_TIP = MOUTH_LOWER + 1
+EYE_CORNER_POINTS = slice(NOSE_TIP + 1, NOSE_TIP + 5)
+IRIS_CENTER_POINTS = slice(EYE_CORNER_POINTS.stop, EYE_CORNER_POINTS.stop + 2)
+
+def analyze_image(frame, model, output_dir, face_mesh_pool=None, annotation_writer=None, gaze_mode="landmarks",
+                  face_detector=None, motion_gate=None, return_annotations=False):
     """
     Analyze an image to detect mobile phones, people, and face features.
     
     Args:
-        image_path (str): Path to the image file.
+        frame (Frame or str): The image, or a path to the image file.
         model: Object detection model.
         output_dir (str): Directory where output images and results will be saved.
+        face_mesh_pool (FaceMeshPool): Pool to borrow the face mesh detector from.
+        annotation_writer (AnnotationWriter): Background writer for the annotated image. When not
+                                              given, the image is written to output_dir before returning.
+        gaze_mode (str): "landmarks" to estimate the gaze from the iris landmarks, "contour"
+                         to search each eye crop for the pupil.
+        face_detector (FaceMeshDetector): Detector owned by the caller, such as the tracking
+                                          detector of a proctoring session. Used instead of the pool.
+        motion_gate (MotionGate): Change detector of the submission the frame belongs to. Frames
+                                  nearly identical to the last analyzed one reuse its result.
+        return_annotations (bool): Also return the drawing instructions of the annotated image.
     
     Returns:
-        dict: JSON-compatible dictionary with analysis results.
+        dict: JSON-compatible dictionary with analysis results, or a tuple of it and the
+              drawing instructions when return_annotations is set.
     """
+    frame = as_frame(frame)
+
+    if motion_gate is not None:
+        previous = motion_gate.reuse(frame)
+        if previous is not None:
+            # Nothing moved, draw the previous findings on this frame instead of running the models
+            json_result, annotations = previous
+            submit_annotations(frame, annotations, output_dir, annotation_writer)
+            return (dict(json_result), annotations) if return_annotations else dict(json_result)
     
-    # Load the image from the given path
-    img = cv2.imread(image_path)
-    image_name = os.path.basename(image_path)  # Extract the image file name
+    # Use the model to detect objects in the already decoded, letterboxed image
+    results = model(frame.letterboxed()[0])
+    return analyze_detections(frame, results[0], model.names, output_dir, face_mesh_pool,
+                              annotation_writer, gaze_mode, face_detector, motion_gate, return_annotations)
+
+def analyze_images(frames, model, output_dir, batch_size=16, face_mesh_pool=None, annotation_writer=None,
+                   gaze_mode="landmarks"):
+    """
+    Analyze several images, running object detection as one batched model call per chunk.
+    
+    Args:
+        frames (list): Images as Frame objects or paths to the image files.
+        model: Object detection model.
+        output_dir (str): Directory where output images and results will be saved.
+        batch_size (int): Maximum number of images passed to the model in a single call.
+        face_mesh_pool (FaceMeshPool): Pool to borrow the face mesh detector from.
+        annotation_writer (AnnotationWriter): Background writer for the annotated image. When not
+                                              given, the image is written to output_dir before returning.
+        gaze_mode (str): "landmarks" to estimate the gaze from the iris landmarks, "contour"
+                         to search each eye crop for the pupil.
     
-    # Use the model to detect objects in the image
-    results = model(image_path)
-    detected_objects = results[0].boxes.data.numpy()  # Detected object details
-    object_names = model.names  # Mapping of class IDs to object names
+    Returns:
+        list: One dictionary per image, in the order of frames, shaped like the
+              result of analyze_image.
+    """
+    frames = [as_frame(frame) for frame in frames]
+    json_results = []
+    for start in range(0, len(frames), batch_size):
+        chunk = frames[start:start + batch_size]
+        # A single forward pass for the whole chunk instead of one per image
+        results = model([frame.letterboxed()[0] for frame in chunk], batch=len(chunk))
+        for frame, result in zip(chunk, results):
+            json_results.append(analyze_detections(frame, result, model.names, output_dir, face_mesh_pool,
+                                                     annotation_writer, gaze_mode))
+    return json_results
+
+def analyze_detections(frame, result, object_names, output_dir, face_mesh_pool=None, annotation_writer=None,
+                       gaze_mode="landmarks", face_detector=None, motion_gate=None, return_annotations=False):
+    """
+    Analyze face features of an image whose objects have already been detected.
+    
+    Args:
+        frame (Frame): The image.
+        result: Object detection result for the letterboxed image.
+        object_names (dict): Mapping of class IDs to object names.
+        output_dir (str): Directory where output images and results will be saved.
+        face_mesh_pool (FaceMeshPool): Pool to borrow the face mesh detector from.
+        annotation_writer (AnnotationWriter): Background writer for the annotated image. When not
+                                              given, the image is written to output_dir before returning.
+        gaze_mode (str): "landmarks" to estimate the gaze from the iris landmarks, "contour"
+                         to search each eye crop for the pupil.
+        face_detector (FaceMeshDetector): Detector owned by the caller, such as the tracking
+                                          detector of a proctoring session. Used instead of the pool.
+        motion_gate (MotionGate): Change detector that records this frame as analyzed.
+        return_annotations (bool): Also return the drawing instructions of the annotated image.
+    
+    Returns:
+        dict: JSON-compatible dictionary with analysis results, or a tuple of it and the
+              drawing instructions when return_annotations is set.
+    """
+    
+    img = frame.bgr  # Decoded image, only read during analysis
+    # Drawing instructions, rendered later by the annotation writer
+    annotations = []
+    
+    # Detected object details, mapped back to original image coordinates
+    detected_objects = frame.unletterbox(result.boxes.data.numpy())
 
     # Initialize counts for detected phones and persons
     phone_count = 0
@@ -38,23 +130,23 @@ def analyze_image(image_path, model, output_dir):
 
         if object_names[class_id] == 'cell phone':
             phone_count += 1
-            # Draw bounding box and label for detected phone
-            cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 1)
-            cv2.putText(img, 'phone', (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+            # Bounding box and label for detected phone
+            annotations.append(("rectangle", (x1, y1), (x2, y2), (0, 255, 0), 1))
+            annotations.append(("text", 'phone', (x1, y1 - 10), (0, 255, 0), 2))
         
         elif object_names[class_id] == 'person':
             person_count += 1
-            # Draw bounding box and label for detected person
-            cv2.rectangle(img, (x1, y1), (x2, y2), (255, 0, 0), 1)
-            cv2.putText(img, 'person', (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+            # Bounding box and label for detected person
+            annotations.append(("rectangle", (x1, y1), (x2, y2), (255, 0, 0), 1))
+            annotations.append(("text", 'person', (x1, y1 - 10), (255, 0, 0), 2))
 
     # Conditions based on detected people
     extra_person = person_count > 1  # More than one person
     no_person = person_count == 0  # No person detected
 
-    # Initialize face mesh detector
-    face_detector = FaceMeshDetector()
-    img, faces = face_detector.findFaceMesh(img)
+    # Borrow a face mesh detector, or build a single use one when no pool is given
+    with borrow_face_detector(face_mesh_pool, face_detector) as detector:
+        img, faces = detector.findFaceMesh(img, imgRGB=frame.rgb, landmarks=PROCTORING_LANDMARKS)
     
     # Initialize result dictionary
     json_result = {
@@ -66,63 +158,95 @@ def analyze_image(image_path, model, output_dir):
     }
 
     # If faces are detected, proceed with further analysis
-    if faces:
+    if len(faces):
         face = faces[0]  # Assume first detected face for analysis
-        nose_tip = face[1]  # Coordinates of the nose tip
+        nose_tip = face[NOSE_TIP].tolist()  # Coordinates of the nose tip
 
-        # Define key face points for eyes and mouth
-        left_eye_points = [face[i] for i in [33, 133, 160, 159, 158, 144, 145, 153]]
-        right_eye_points = [face[i] for i in [362, 385, 387, 386, 374, 373, 390, 249]]
-        mouth_upper = face[13]
-        mouth_lower = face[14]
+        # Key face points for eyes and mouth
+        left_eye_points = face[LEFT_EYE_POINTS]
+        right_eye_points = face[RIGHT_EYE_POINTS]
+        mouth_upper = face[MOUTH_UPPER].tolist()
+        mouth_lower = face[MOUTH_LOWER].tolist()
 
         # Calculate center of eyes
         # left_eye_center = get_eye_center(left_eye_points)
         # right_eye_center = get_eye_center(right_eye_points)
 
-        # Detect pupils in eye images
-        left_eye_img = img[min([p[1] for p in left_eye_points]):max([p[1] for p in left_eye_points]),
-                           min([p[0] for p in left_eye_points]):max([p[0] for p in left_eye_points])]
-        right_eye_img = img[min([p[1] for p in right_eye_points]):max([p[1] for p in right_eye_points]),
-                            min([p[0] for p in right_eye_points]):max([p[0] for p in right_eye_points])]
-
-        left_pupil = detect_pupil(left_eye_img)
-        right_pupil = detect_pupil(right_eye_img)
+        if gaze_mode == "contour":
+            gaze_direction, pupils = contour_gaze(img, left_eye_points, right_eye_points)
+        else:
+            # The refined face mesh already located both irises, compare them to the eye corners
+            gaze_direction, _ = landmark_gaze(face[EYE_CORNER_POINTS].reshape(2, 2, 2), face[IRIS_CENTER_POINTS])
+            pupils = face[IRIS_CENTER_POINTS].tolist()
 
         # Mark detected pupils on the image
-        if left_pupil:
-            cv2.circle(left_eye_img, left_pupil, 3, (0, 0, 255), -1)
-        if right_pupil:
-            cv2.circle(right_eye_img, right_pupil, 3, (0, 0, 255), -1)
+        for pupil in pupils:
+            annotations.append(("circle", tuple(pupil), 3, (0, 0, 255), -1))
 
         # Calculate mouth length to determine if it is open
-        mouth_length = math.hypot(mouth_lower[0] - mouth_upper[0], mouth_lower[1] - mouth_upper[1])
+        mouth_length = float(np.hypot(*(face[MOUTH_LOWER] - face[MOUTH_UPPER])))
         json_result["mouth_open"] = mouth_length > 5
 
-        # Determine gaze direction based on pupil position
-        gaze_direction = "center"
-        if left_pupil and right_pupil:
-            if left_pupil[0] < left_eye_img.shape[1] // 2 and right_pupil[0] < right_eye_img.shape[1] // 2:
-                gaze_direction = "left"
-            elif left_pupil[0] > left_eye_img.shape[1] // 2 and right_pupil[0] > right_eye_img.shape[1] // 2:
-                gaze_direction = "right"
-
         json_result["eye_gaze"] = gaze_direction
 
-        # Draw annotations for mouth, eyes, and nose
-        cv2.rectangle(img, (min(mouth_upper[0], mouth_lower[0]), min(mouth_upper[1], mouth_lower[1]) - 10),
-                      (max(mouth_upper[0], mouth_lower[0]), max(mouth_upper[1], mouth_lower[1]) + 10), (0, 255, 0), 1)
-        cv2.putText(img, f"MOUTH {'OPEN' if json_result['mouth_open'] else 'CLOSED'}",
-                    (mouth_upper[0], mouth_upper[1] - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+        # Annotations for mouth, eyes, and nose
+        annotations.append(("rectangle", (min(mouth_upper[0], mouth_lower[0]), min(mouth_upper[1], mouth_lower[1]) - 10),
+                            (max(mouth_upper[0], mouth_lower[0]), max(mouth_upper[1], mouth_lower[1]) + 10), (0, 255, 0), 1))
+        annotations.append(("text", f"MOUTH {'OPEN' if json_result['mouth_open'] else 'CLOSED'}",
+                            (mouth_upper[0], mouth_upper[1] - 20), (0, 255, 0), 2))
 
-        cv2.putText(img, f"EYE GAZE {gaze_direction.upper()}",
-                    (left_eye_points[0][0], left_eye_points[0][1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
+        annotations.append(("text", f"EYE GAZE {gaze_direction.upper()}",
+                            (int(left_eye_points[0, 0]), int(left_eye_points[0, 1]) - 10), (255, 0, 0), 1))
 
-        # Draw nose tip
-        cv2.circle(img, (nose_tip[0], nose_tip[1]), 2, (0, 255, 255), -1)
-        cv2.putText(img, "NOSE", (nose_tip[0] + 10, nose_tip[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
+        # Nose tip
+        annotations.append(("circle", (nose_tip[0], nose_tip[1]), 2, (0, 255, 255), -1))
+        annotations.append(("text", "NOSE", (nose_tip[0] + 10, nose_tip[1] - 10), (0, 255, 255), 2))
 
-    # Save the annotated image to the output directory
-    cv2.imwrite(os.path.join(output_dir, f"result_{image_name}"), img)
-    print(os.path.join(output_dir, f"result_{image_name}"))
-    return json_result
+    if motion_gate is not None:
+        motion_gate.update(frame, (dict(json_result), annotations))
+    submit_annotations(frame, annotations, output_dir, annotation_writer)
+    return (json_result, annotations) if return_annotations else json_result
+
+def submit_annotations(frame, annotations, output_dir, annotation_writer=None):
+    """
+    Write the annotated image of an analyzed frame as result_<frame name>.
+    
+    Args:
+        frame (Frame): The analyzed image.
+        annotations (list): Drawing instructions, see annotation_writer.draw_annotations.
+        output_dir (str): Directory the image is written to when there is no annotation writer.
+        annotation_writer (AnnotationWriter): Background writer for the annotated image.
+    """
+    # Hand the annotated image over to the background writer, or write it right away without one
+    if annotation_writer is not None:
+        annotation_writer.submit(frame, annotations)
+    else:
+        write_annotated_image(frame, annotations, os.path.join(output_dir, f"result_{frame.name}"))
+
+@contextmanager
+def borrow_face_detector(face_mesh_pool=None, face_detector=None):
+    """
+    Provide a face mesh detector for a single analysis.
+    
+    Args:
+        face_mesh_pool (FaceMeshPool): Pool to borrow the detector from. When not given,
+                                       a detector is created and closed after use.
+        face_detector (FaceMeshDetector): Detector owned by the caller, yielded as is.
+    
+    Yields:
+        FaceMeshDetector: Detector to run on the image.
+    """
+    if face_detector is not None:
+        yield face_detector
+        return
+
+    if face_mesh_pool is not None:
+        with face_mesh_pool.borrow() as face_detector:
+            yield face_detector
+        return
+
+    face_detector = FaceMeshDetector(staticMode=True)
+    try:
+        yield face_detector
+    finally:
+        face_detector.close()
@@ -0,0 +1,171 @@
+import cv2
+import logging
+import os
+import queue
+import threading
+
+# Encoder parameters for the supported output formats
+IMAGE_FORMATS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+    "png": (".png", None),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def draw_annotations(img, annotations):
+    """
+    Draws annotations collected during analysis onto an image.
+
+    :param img: BGR image to draw on. It is modified in place.
+    :param annotations: List of ("rectangle", pt1, pt2, color, thickness),
+                        ("text", text, org, color, thickness) or
+                        ("circle", center, radius, color, thickness) tuples.
+    :return: The annotated image.
+    """
+    for kind, *args in annotations:
+        if kind == "rectangle":
+            pt1, pt2, color, thickness = args
+            cv2.rectangle(img, pt1, pt2, color, thickness)
+        elif kind == "text":
+            text, org, color, thickness = args
+            cv2.putText(img, text, org, cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, thickness)
+        elif kind == "circle":
+            center, radius, color, thickness = args
+            cv2.circle(img, center, radius, color, thickness)
+    return img
+
+
+def write_annotated_image(frame, annotations, path, image_format=None, quality=90, thumbnail_width=None):
+    """
+    Renders the annotations onto a copy of the frame and writes it to disk.
+
+    :param frame: The analyzed Frame.
+    :param annotations: Annotations to draw, see draw_annotations.
+    :param path: Output file path. The file name is kept whatever the format, so with an explicit
+                 image_format a result_<name>.jpg file can hold WebP or PNG bytes. The Node server
+                 looks the file up by that name, and browsers go by the content, not the extension.
+    :param image_format: One of IMAGE_FORMATS, or None to pick the format from the path extension.
+    :param quality: Encoder quality for JPEG and WebP output.
+    :param thumbnail_width: When given, the image is shrunk to this width before encoding.
+    """
+    img = draw_annotations(frame.bgr.copy(), annotations)
+
+    if thumbnail_width and img.shape[1] > thumbnail_width:
+        height = round(img.shape[0] * thumbnail_width / img.shape[1])
+        img = cv2.resize(img, (thumbnail_width, height), interpolation=cv2.INTER_AREA)
+
+    if image_format is None:
+        extension, quality_flag = os.path.splitext(path)[1] or ".jpg", cv2.IMWRITE_JPEG_QUALITY
+    else:
+        extension, quality_flag = IMAGE_FORMATS[image_format]
+    params = [quality_flag, quality] if quality_flag is not None else []
+
+    success, encoded = cv2.imencode(extension, img, params)
+    if not success:
+        raise RuntimeError(f"Could not encode {path}")
+    with open(path, "wb") as f:
+        f.write(encoded.tobytes())
+    logger.info(f"Annotated image written to {path}")
+
+
+class AnnotationWriter:
+    def __init__(self, output_dir, mode="full", image_format=None, quality=90, thumbnail_width=320, max_queue=64):
+        """
+        Renders and writes annotated proctoring images on a background thread.
+
+        :param output_dir: Directory the annotated images are written to.
+        :param mode: "full" writes full size images, "thumbnail" writes images shrunk to
+                     thumbnail_width and "off" skips annotated output entirely.
+        :param image_format: One of IMAGE_FORMATS, or None to follow the image file extension. The
+                             file keeps the result_<frame name> name either way, see write_annotated_image.
+        :param quality: Encoder quality for JPEG and WebP output.
+        :param thumbnail_width: Width of the images written in thumbnail mode.
+        :param max_queue: Maximum number of images waiting to be written. Requests block
+                          when the queue is full instead of dropping evidence.
+        """
+        if mode not in ("full", "thumbnail", "off"):
+            raise ValueError(f"Unknown annotation mode: {mode}")
+        if image_format is not None and image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown annotation image format: {image_format}")
+
+        self.output_dir = output_dir
+        self.mode = mode
+        self.image_format = image_format
+        self.quality = quality
+        self.thumbnail_width = thumbnail_width if mode == "thumbnail" else None
+
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._written = 0
+        self._failed = 0
+        self._pid = None
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so a forked worker process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, frame, annotations):
+        """
+        Queues an annotated image of the frame to be written as result_<frame name>.
+
+        :param frame: The analyzed Frame.
+        :param annotations: Annotations to draw, see draw_annotations.
+        """
+        if self.mode == "off":
+            return
+        self._ensure_thread()
+        self._queue.put((frame, annotations))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                frame, annotations = item
+                path = os.path.join(self.output_dir, f"result_{frame.name}")
+                write_annotated_image(frame, annotations, path, self.image_format, self.quality,
+                                      self.thumbnail_width)
+                with self._lock:
+                    self._written += 1
+            except Exception as e:
+                logger.error(f"Failed to write annotated image: {e}")
+                with self._lock:
+                    self._failed += 1
+            finally:
+                self._queue.task_done()
+
+    def queue_depth(self):
+        """Number of images waiting to be written."""
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "queue_depth": self.queue_depth(),
+                "written": self._written,
+                "failed": self._failed,
+            }
+
+    def flush(self):
+        """Blocks until every queued image has been written."""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        """Writes the remaining images and stops the writer thread."""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._thread.join()
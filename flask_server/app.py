@@ -1,16 +1,40 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
 from extract_face_encodings import extract_face_encodings
-from verify_face import verify_face
+from verify_face import verify_face, identify_faces, FACE_MATCH_THRESHOLD
 import numpy as np
-from ultralytics import YOLO
-from ai_protoring import analyze_image
+from ai_protoring import analyze_image, analyze_images, submit_annotations
+from gaze import GAZE_MODES
 import joblib
-from cheating_detection import predict_cheating_probability
+from cheating_detection import CheatingPredictor
 from otp_utils import generate_otp, send_otp
 from send_email import send_verification_email, send_password_reset_mail
+from batch_scheduler import BatchedModel
+from face_detector import FaceMeshPool
+from frame import Frame
+from annotation_writer import AnnotationWriter
+from face_gallery import FaceGallery, student_id_bytes
+from face_locator import FaceLocator
+from spoof_detector import SPOOF_CHECK_MODES
+from face_pipeline import result_cache
+from face_encoding_codec import encode_encoding, decode_encoding, EncodingCache
+from proctoring_sessions import ProctoringSessionManager
+from functools import partial
+from motion_gate import MotionGate, MotionGateCache
+from cheating_accumulator import CheatingAccumulator
+from model_manager import ModelManager
+from model_backends import load_yolo, artifact_path
+from cascade_detector import CascadeDetector
+from inference_pool import InferencePool, PRIORITY_CLASSES, JobExpired, JobPreempted
+from inference_worker import load_worker, frame_source, warm_up_yolo
+import atexit
+import json
+import tempfile
+import time
+import uuid
+from werkzeug.utils import secure_filename
 
 # from send_verification_email import send_verification_email
 
@@ -25,13 +49,311 @@ allowed_origin = os.getenv('ALLOWED_ORIGIN')
 # Configure CORS to allow only the specified origin
 CORS(app, resources={r"/*": {"origins": allowed_origin}})
 
+# Models are loaded lazily, eagerly with a warm-up, or before forking workers, see ModelManager
+model_manager = ModelManager(mode=os.getenv('MODEL_LOAD_MODE', 'eager'))
+
+# Each YOLO model runs on PyTorch, ONNX Runtime or OpenVINO, in FP32 or INT8, see export_models.py
+spoof_model_config = {
+    "weights": "./models/yolo_custom_model.pt",
+    "backend": os.getenv('SPOOF_MODEL_BACKEND', 'pytorch'),
+    "precision": os.getenv('SPOOF_MODEL_PRECISION', 'fp32'),
+}
+object_model_config = {
+    "weights": "./models/yolov8x.pt",
+    "backend": os.getenv('OBJECT_MODEL_BACKEND', 'pytorch'),
+    "precision": os.getenv('OBJECT_MODEL_PRECISION', 'fp32'),
+}
+# Small model that screens proctoring frames before the large one, see CascadeDetector
+cascade_enabled = os.getenv('CASCADE_ENABLED', 'false').lower() == 'true'
+cascade_model_config = {
+    "weights": os.getenv('CASCADE_MODEL', './models/yolov8n.pt'),
+    "backend": os.getenv('CASCADE_MODEL_BACKEND', 'pytorch'),
+    "precision": os.getenv('CASCADE_MODEL_PRECISION', 'fp32'),
+}
+cascade_args = dict(
+    cheap_size=int(os.getenv('CASCADE_IMAGE_SIZE', 320)),
+    band=(float(os.getenv('CASCADE_BAND_LOW', 0.15)), float(os.getenv('CASCADE_BAND_HIGH', 0.6))),
+    audit_rate=float(os.getenv('CASCADE_AUDIT_RATE', 0.02)),
+)
+for yolo_config in (spoof_model_config, object_model_config, cascade_model_config):
+    # Rejects unknown backends and precisions at startup rather than on the first request
+    artifact_path(**yolo_config)
+
+# Face checks and frame analysis run on worker processes with their own models, 0 keeps them in this process
+inference_workers = int(os.getenv('INFERENCE_WORKERS', 0))
+# The workers hold the YOLO models then, this process only loads them if a streaming session needs them
+yolo_on_demand = inference_workers > 0
+
 # Load the pre-trained model for detecting fake images
 # model = load_model("./models/face_antispoofing_model.keras")
-model= YOLO("./models/yolo_custom_model.pt")
-model_yolo = YOLO("./models/yolov8x.pt")
-loaded_model = joblib.load("./models/cheating_detection_model.pkl")
+model = model_manager.register("spoof", lambda: load_yolo(**spoof_model_config), warm_up_yolo,
+                               on_demand=yolo_on_demand)
+model_yolo = model_manager.register("object", lambda: load_yolo(**object_model_config), warm_up_yolo,
+                                    on_demand=yolo_on_demand)
+object_detector = model_yolo
+if cascade_enabled:
+    model_cascade = model_manager.register("cascade", lambda: load_yolo(**cascade_model_config),
+                                           partial(warm_up_yolo, imgsz=cascade_args["cheap_size"]),
+                                           on_demand=yolo_on_demand)
+    object_detector = CascadeDetector(model_cascade, model_yolo, **cascade_args)
+# Compiled into NumPy operations once, and seeded when results have to be reproducible
+cheating_seed = os.getenv('CHEATING_RANDOM_SEED')
+cheating_predictor = model_manager.register(
+    "cheating",
+    lambda: CheatingPredictor(joblib.load("./models/cheating_detection_model.pkl"),
+                              seed=int(cheating_seed) if cheating_seed else None),
+    lambda predictor: predictor.predict([[1, 0, 0, 0, 0, 0]]),
+)
+
+# Concurrent requests are gathered into small batches before running the YOLO models
+batch_max_size = int(os.getenv('BATCH_MAX_SIZE', 8))
+batch_max_wait_ms = float(os.getenv('BATCH_MAX_WAIT_MS', 5))
+spoof_model = BatchedModel(model, max_batch_size=batch_max_size, max_wait_ms=batch_max_wait_ms)
+object_model = BatchedModel(object_detector, max_batch_size=batch_max_size, max_wait_ms=batch_max_wait_ms)
+
+# Long-lived face mesh graphs shared by the request threads
+face_mesh_pool = FaceMeshPool(maxSize=int(os.getenv('FACE_MESH_POOL_SIZE', 4)))
+atexit.register(face_mesh_pool.close)
+
+# How faces are found before computing face_recognition encodings
+face_locator = FaceLocator(
+    strategy=os.getenv('FACE_DETECTION_STRATEGY', 'full'),
+    max_side=int(os.getenv('FACE_DETECTION_MAX_SIDE', 800)),
+    upsample=int(os.getenv('FACE_DETECTION_UPSAMPLE', 1)),
+)
+
+# Anti-spoof check on the whole image, or on a crop of the face found for the encoding
+spoof_mode = os.getenv('SPOOF_CHECK_MODE', 'full')
+if spoof_mode not in SPOOF_CHECK_MODES:
+    raise ValueError(f"Unknown spoof check mode: {spoof_mode}")
+if spoof_mode == "crop" and face_locator.reuses_face_box:
+    raise ValueError("The crop spoof check mode needs the face first, it cannot reuse the anti-spoof face box")
+
+# Enrolled faces of every student, used to catch one person registering several accounts
+face_gallery = FaceGallery(os.getenv('FACE_GALLERY_DIR', './face_gallery'),
+                           approximate=os.getenv('FACE_GALLERY_APPROXIMATE', 'false').lower() == 'true')
+
+# Known face encodings of recently verified students, so repeat logins can send only the student id
+encoding_cache = EncodingCache(max_size=int(os.getenv('ENCODING_CACHE_SIZE', 10000)))
 
 protoring_output_dir = os.getenv('PROCTORING_OUTPUT_DIR')
+analyze_batch_size = int(os.getenv('ANALYZE_BATCH_SIZE', 16))
+
+# Gaze from the iris landmarks of the face mesh, or the older pupil contour search
+gaze_mode = os.getenv('GAZE_MODE', 'landmarks')
+if gaze_mode not in GAZE_MODES:
+    raise ValueError(f"Unknown gaze mode: {gaze_mode}")
+
+# Annotated proctoring images are rendered and written off the request thread
+annotation_writer = AnnotationWriter(
+    protoring_output_dir,
+    mode=os.getenv('ANNOTATION_MODE', 'full'),
+    image_format=os.getenv('ANNOTATION_FORMAT') or None,
+    quality=int(os.getenv('ANNOTATION_QUALITY', 90)),
+    thumbnail_width=int(os.getenv('ANNOTATION_THUMBNAIL_WIDTH', 320)),
+    max_queue=int(os.getenv('ANNOTATION_QUEUE_SIZE', 64)),
+)
+atexit.register(annotation_writer.close)
+
+def warm_up_face_mesh():
+    with face_mesh_pool.borrow() as detector:
+        detector.findFaceMesh(np.zeros((480, 640, 3), dtype=np.uint8))
+
+model_manager.register_warmup("face_mesh", warm_up_face_mesh)
+model_manager.register_warmup("face_recognition", face_locator.warm_up)
+model_manager.start()
+
+inference_pool = None
+if inference_workers > 0:
+    inference_pool = InferencePool(
+        load_worker,
+        initargs=({
+            "spoof_model": spoof_model_config,
+            "object_model": object_model_config,
+            "cascade": dict(cascade_args, model=cascade_model_config) if cascade_enabled else None,
+            "threads": int(os.getenv('INFERENCE_WORKER_THREADS', 0)) or max(1, os.cpu_count() // inference_workers),
+            "face_mesh_pool_size": face_mesh_pool.maxSize,
+            "spoof_mode": spoof_mode,
+            "face_detection": {"strategy": face_locator.strategy, "max_side": face_locator.max_side,
+                               "upsample": face_locator.upsample},
+            "gaze_mode": gaze_mode,
+            "output_dir": protoring_output_dir,
+            "annotation": {"mode": annotation_writer.mode, "image_format": annotation_writer.image_format,
+                           "quality": annotation_writer.quality, "thumbnail_width": annotation_writer.thumbnail_width,
+                           "max_queue": annotation_writer.max_queue},
+            "analyze_batch_size": analyze_batch_size,
+        },),
+        workers=inference_workers,
+        max_queue=int(os.getenv('INFERENCE_QUEUE_SIZE', 32)),
+        job_timeout=float(os.getenv('INFERENCE_JOB_TIMEOUT', 120)) or None,
+    )
+    atexit.register(inference_pool.close)
+
+@app.before_request
+def start_model_manager():
+    # Forked workers start their own warm-up on their first request
+    model_manager.start()
+    # Started on the first request, so the reloader process of debug mode does not start workers too
+    if inference_pool is not None:
+        inference_pool.start()
+
+# Frames of a submission that barely changed since its last analyzed frame reuse that result
+motion_gate_args = dict(
+    threshold=float(os.getenv('MOTION_GATE_THRESHOLD', 2.0)),
+    full_every=int(os.getenv('MOTION_GATE_FULL_EVERY', 10)),
+)
+motion_gate_enabled = os.getenv('MOTION_GATE_ENABLED', 'false').lower() == 'true'
+motion_gates = MotionGateCache(idle_timeout=float(os.getenv('SESSION_IDLE_TIMEOUT', 300)), **motion_gate_args)
+
+# Cheating features of each submission, counted as its frames are analyzed
+cheating_accumulator = CheatingAccumulator(
+    idle_timeout=float(os.getenv('CHEATING_FEATURES_TTL', 6 * 3600)),
+    snapshot_path=os.getenv('CHEATING_FEATURES_SNAPSHOT') or None,
+    snapshot_interval=float(os.getenv('CHEATING_FEATURES_SNAPSHOT_INTERVAL', 30)),
+)
+atexit.register(cheating_accumulator.snapshot)
+
+# Streaming proctoring, one session per quiz submission with a face mesh detector in tracking mode
+proctoring_sessions = ProctoringSessionManager(
+    partial(analyze_image, model=object_model, output_dir=protoring_output_dir,
+            annotation_writer=annotation_writer, gaze_mode=gaze_mode),
+    max_queue=int(os.getenv('SESSION_MAX_QUEUE', 4)),
+    idle_timeout=float(os.getenv('SESSION_IDLE_TIMEOUT', 300)),
+    max_sessions=int(os.getenv('SESSION_MAX_SESSIONS', 256)),
+    motion_gate_factory=partial(MotionGate, **motion_gate_args) if motion_gate_enabled else None,
+    on_result=cheating_accumulator.add,
+    # Sessions live in one process, a second web process must not accept them
+    lock_path=os.getenv('SESSION_LOCK_FILE') or os.path.join(tempfile.gettempdir(), "proctoring_sessions.lock"),
+)
+# Registered after the writer, so sessions flush their last frames into it before it closes
+atexit.register(proctoring_sessions.close_all)
+
+@app.before_request
+def claim_proctoring_sessions():
+    # Claimed by each process as it starts serving, not at import, as gunicorn --preload forks after the import
+    proctoring_sessions.claim()
+    if request.path.startswith('/proctoring-sessions') and not proctoring_sessions.owner:
+        return jsonify(success=False, error="Streaming proctoring sessions are served by another web process, "
+                                            "run the server as a single process to use them"), 503
+
+def request_params():
+    """
+    Parameters of the request, read from the JSON body, or from form fields and the
+    query string when the image is uploaded as multipart or raw bytes.
+    """
+    if request.is_json:
+        return request.get_json()
+    params = request.args.to_dict()
+    params.update(request.form.to_dict())
+    return params
+
+def request_frame(params):
+    """
+    The image sent with the request as a Frame, or None when there is none.
+
+    The image is taken from an uploaded 'image' file, a raw image request body, or the
+    image_path parameter, in that order. Uploaded images are decoded straight from memory.
+    """
+    upload = request.files.get('image')
+    if upload:
+        return Frame.from_bytes(upload.read(), name=upload_name(upload.filename))
+
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        return Frame.from_bytes(request.get_data(), name=upload_name(request.headers.get('X-Image-Name')))
+
+    image_path = params.get('image_path')
+    if image_path:
+        return Frame.from_path(image_path)
+    return None
+
+def upload_name(filename):
+    """A file name that is safe to use for output files, generated when the client sent none."""
+    name = secure_filename(filename or '')
+    return name or f"{uuid.uuid4().hex}.jpg"
+
+def cheating_features(submission_id, features):
+    """
+    The cheating features to score for a submission.
+
+    The features the client sent are used, unless this process analyzed at least as many of
+    the submission's images. With several web processes each one only sees part of the
+    frames, so partial counts must not replace the client's complete ones.
+    """
+    accumulated = cheating_accumulator.features(str(submission_id)) if submission_id else None
+    if accumulated is None:
+        return features
+    client_images = features[0] if isinstance(features, list) and features else None
+    if isinstance(client_images, (int, float)) and not isinstance(client_images, bool) \
+            and client_images > accumulated[0]:
+        return features
+    return accumulated
+
+def valid_features(features):
+    return isinstance(features, list) and len(features) == 6 and \
+        all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in features)
+
+def request_schedule(default_priority):
+    """
+    The priority class and deadline of the request.
+
+    The X-Priority header names one of PRIORITY_CLASSES and X-Deadline is the unix time in
+    milliseconds after which the result is of no use, as sent by the Node server.
+
+    :param default_priority: Priority class of the endpoint, used when the header is absent.
+    :return: A dictionary with the priority and the deadline as a unix time in seconds, or None.
+    :raises ValueError: When a header is invalid.
+    """
+    priority = request.headers.get('X-Priority', default_priority)
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"X-Priority must be one of {', '.join(PRIORITY_CLASSES)}")
+    deadline = request.headers.get('X-Deadline')
+    try:
+        deadline = float(deadline) / 1000 if deadline else None
+    except ValueError:
+        raise ValueError("X-Deadline must be a unix time in milliseconds")
+    return {"priority": priority, "deadline": deadline}
+
+def deadline_passed(schedule):
+    return schedule["deadline"] is not None and time.time() >= schedule["deadline"]
+
+def inference_busy(error="Server is busy, retry later"):
+    """Refuses a request the inference workers have no room for, telling the client when to retry."""
+    response = jsonify(success=False, error=error)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(inference_pool.retry_after())
+    return response
+
+def inference_dropped(error):
+    """The response to a job dropped before it ran, because it expired or made room for a more urgent one."""
+    if isinstance(error, JobPreempted):
+        return inference_busy(str(error))
+    return jsonify(success=False, error=str(error)), 504
+
+def analyze_on_worker(frame, motion_gate=None, schedule=None):
+    """
+    Analyzes a frame on an inference worker, or reuses the previous result of its submission.
+
+    :param schedule: Priority class and deadline of the job, see request_schedule.
+    :return: The analysis result, or None when the workers are too busy to take the frame.
+    """
+    if motion_gate is not None:
+        previous = motion_gate.reuse(frame)
+        if previous is not None:
+            json_result, annotations = previous
+            submit_annotations(frame, annotations, protoring_output_dir, annotation_writer)
+            return dict(json_result)
+
+    analyzed = inference_pool.run('analyze_image', frame_source(frame), **(schedule or {}))
+    if analyzed is None:
+        return None
+    json_result, annotations = analyzed
+    if motion_gate is not None:
+        motion_gate.update(frame, (dict(json_result), annotations))
+    return json_result
+
+def frame_missing(frame):
+    """True when no image was sent or the given image path does not exist."""
+    return frame is None or (frame.path is not None and not os.path.exists(frame.path))
 
 @app.route('/')
 def home():
@@ -40,18 +362,51 @@ def home():
 @app.route('/register-face', methods=['POST'])
 def register_face():
     try:
-        # Get the image path from the request
-        data = request.json
-        image_path = data.get('image_path')
-        if not image_path:
+        # Get the image from the request
+        data = request_params()
+        frame = request_frame(data)
+        if frame is None:
             return jsonify(error="No image path provided")
+
+        # With a student id, the face must not already belong to another student
+        student_id = data.get('student_id')
+        if student_id:
+            try:
+                student_id = student_id_bytes(student_id).decode()
+            except ValueError as e:
+                return jsonify(success=False, error=str(e)), 400
         
-        success, result = extract_face_encodings(image_path,model)
+        # Part of a student's sign up, so it goes ahead of queued proctoring frames
+        try:
+            schedule = request_schedule('interactive')
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+        if inference_pool is not None:
+            try:
+                checked = inference_pool.run('register_face', frame_source(frame), **schedule)
+            except (JobExpired, JobPreempted) as e:
+                return inference_dropped(e)
+            if checked is None:
+                return inference_busy()
+            success, result = checked
+        elif deadline_passed(schedule):
+            return inference_dropped(JobExpired("Deadline passed before the face was checked"))
+        else:
+            success, result = extract_face_encodings(frame,spoof_model,face_locator,spoof_mode)
         
         if not success:
             return jsonify(success=False,error=result)
 
-        return jsonify(success=True,encoding=result)
+        if student_id:
+            # Checked and added under the gallery lock, which the other web workers take too
+            duplicate = face_gallery.add_unless_duplicate(student_id, result, FACE_MATCH_THRESHOLD)
+            if duplicate:
+                return jsonify(success=False, error="Face already registered to another account",
+                               duplicate_of=duplicate[0])
+            # Later verifications must compare against the new template
+            encoding_cache.put(student_id, np.array(result))
+
+        return jsonify(success=True,encoding=encode_encoding(result, data.get('encoding_format', 'list')))
 
     except Exception as e:
         return jsonify(success=False,error=str(e)), 500
@@ -59,16 +414,47 @@ def register_face():
 @app.route('/verify-face', methods=['POST'])
 def verify_face_api():
     try:
-        data = request.json
-        image_path = data.get('image_path')
-        known_face_encoding = data.get('known_face_encoding')
-        if not image_path or not known_face_encoding:
+        data = request_params()
+        frame = request_frame(data)
+        student_id = data.get('student_id')
+        known_face_encoding = (data.get('known_face_encoding') or request.headers.get('X-Known-Face-Encoding')
+                               or (request.files['known_face_encoding'].read()
+                                   if 'known_face_encoding' in request.files else None))
+
+        if known_face_encoding:
+            # A list, a JSON list string, base64 float32 or raw float32 bytes
+            try:
+                known_face_encoding = decode_encoding(known_face_encoding)
+            except ValueError as e:
+                return jsonify(success=False, error=f"Invalid known face encoding: {str(e)}"), 400
+            if student_id:
+                encoding_cache.put(student_id, known_face_encoding)
+        elif student_id:
+            known_face_encoding = encoding_cache.get(student_id)
+            if known_face_encoding is None:
+                return jsonify(success=False, cache_miss=True,
+                               error="Known face encoding not cached, send it with the request"), 400
+
+        if frame is None or known_face_encoding is None:
             return jsonify(error="Image path or known face encoding not provided"), 400
         
-        # Convert the known face encoding from list to numpy array
-        known_face_encoding = np.array([float(num) for num in known_face_encoding])
-        
-        success, result = verify_face(image_path, known_face_encoding,model)
+        # A student is waiting on this to log in, so it goes ahead of queued proctoring frames
+        try:
+            schedule = request_schedule('interactive')
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+        if inference_pool is not None:
+            try:
+                checked = inference_pool.run('verify_face', frame_source(frame), known_face_encoding, **schedule)
+            except (JobExpired, JobPreempted) as e:
+                return inference_dropped(e)
+            if checked is None:
+                return inference_busy()
+            success, result = checked
+        elif deadline_passed(schedule):
+            return inference_dropped(JobExpired("Deadline passed before the face was checked"))
+        else:
+            success, result = verify_face(frame, known_face_encoding,spoof_model,face_locator,spoof_mode)
 
         if not success:
             return jsonify(success=False,error=result)
@@ -78,6 +464,110 @@ def verify_face_api():
     except Exception as e:
         return jsonify(success=False,error=str(e)), 500
 
+@app.route('/take-attendance', methods=['POST'])
+def take_attendance_api():
+    try:
+        data = request_params()
+        frame = request_frame(data)
+        roster = data.get('roster')
+        if isinstance(roster, str):
+            # Sent as a form field next to an uploaded image
+            try:
+                roster = json.loads(roster)
+            except ValueError:
+                return jsonify(success=False, error="The roster must be a JSON list"), 400
+        if frame is None or not roster:
+            return jsonify(error="Image path or roster not provided"), 400
+
+        # Each entry is a student id, with a known face encoding unless it was cached at registration or login
+        students = []
+        if not isinstance(roster, list):
+            return jsonify(success=False, error="The roster must be a JSON list"), 400
+        for entry in roster:
+            if not isinstance(entry, dict):
+                return jsonify(success=False, error="Roster entries must be objects with a student id"), 400
+            student_id = entry.get('student_id')
+            if not student_id:
+                return jsonify(success=False, error="Roster entry without a student id"), 400
+            known_face_encoding = entry.get('known_face_encoding')
+            if known_face_encoding:
+                try:
+                    known_face_encoding = decode_encoding(known_face_encoding)
+                except ValueError as e:
+                    return jsonify(success=False, error=f"Invalid known face encoding of {student_id}: {str(e)}"), 400
+                encoding_cache.put(student_id, known_face_encoding)
+            else:
+                known_face_encoding = encoding_cache.get(student_id)
+            students.append((student_id, known_face_encoding))
+
+        # A teacher is waiting on the result, so it goes ahead of queued proctoring frames
+        try:
+            schedule = request_schedule('interactive')
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+        if inference_pool is not None:
+            try:
+                checked = inference_pool.run('identify_faces', frame_source(frame), students, **schedule)
+            except (JobExpired, JobPreempted) as e:
+                return inference_dropped(e)
+            if checked is None:
+                return inference_busy()
+            success, result = checked
+        elif deadline_passed(schedule):
+            return inference_dropped(JobExpired("Deadline passed before the faces were checked"))
+        else:
+            success, result = identify_faces(frame, students, spoof_model, face_locator)
+
+        if not success:
+            return jsonify(success=False, error=result)
+
+        return jsonify(success=True, data=result)
+
+    except Exception as e:
+        return jsonify(success=False, error=str(e)), 500
+
+@app.route('/face-gallery', methods=['POST'])
+def face_gallery_add_api():
+    try:
+        data = request.json
+        student_id = data.get('student_id')
+        encoding = data.get('encoding')
+        if not student_id or not encoding:
+            return jsonify(error="Student id or face encoding not provided"), 400
+
+        face_gallery.add(student_id, decode_encoding(encoding))
+        return jsonify(success=True, message="Face added to gallery", size=len(face_gallery))
+    except ValueError as e:
+        # An id that does not fit the gallery, or an encoding that cannot be decoded
+        return jsonify(success=False, error=str(e)), 400
+    except Exception as e:
+        return jsonify(success=False, error=str(e)), 500
+
+@app.route('/face-gallery/<student_id>', methods=['DELETE'])
+def face_gallery_remove_api(student_id):
+    try:
+        encoding_cache.remove(student_id)
+        if not face_gallery.remove(student_id):
+            return jsonify(success=False, error="Student not found in gallery"), 404
+        return jsonify(success=True, message="Face removed from gallery", size=len(face_gallery))
+    except Exception as e:
+        return jsonify(success=False, error=str(e)), 500
+
+@app.route('/face-gallery/query', methods=['POST'])
+def face_gallery_query_api():
+    try:
+        data = request.json
+        encoding = data.get('encoding')
+        if not encoding:
+            return jsonify(error="Face encoding not provided"), 400
+
+        matches = face_gallery.query(decode_encoding(encoding), k=int(data.get('k', 5)),
+                                     threshold=data.get('threshold', FACE_MATCH_THRESHOLD))
+        return jsonify(success=True, data=[{"student_id": student_id, "distance": distance}
+                                           for student_id, distance in matches])
+    except Exception as e:
+        return jsonify(success=False, error=str(e)), 500
+
 @app.route('/generate-otp', methods=['POST'])
 def generate_otp_api():
     try:
@@ -122,38 +612,234 @@ def send_verification_mail():
 @app.route('/analyze-image', methods=['POST'])
 def analyze_image_api():
     try:
-        data = request.json
-        image_path = data.get('image_path')
+        data = request_params()
+        frame = request_frame(data)
 
-        if not image_path or not os.path.exists(image_path):
+        if frame_missing(frame):
             return jsonify(error="Image path not provided or does not exist"), 400
 
+        # Frames sent with their submission id can reuse the result of the previous frame
+        submission_id = data.get('submission_id')
+        motion_gate = motion_gates.get(str(submission_id)) if submission_id and motion_gate_enabled else None
+
+        # Proctoring evidence, analyzed after any waiting login and dropped once its deadline passes
+        try:
+            schedule = request_schedule('background')
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+
         # Call the analyze_image function
         try:
-            result_json = analyze_image(image_path, model=model_yolo, output_dir=protoring_output_dir)
+            if inference_pool is not None:
+                try:
+                    result_json = analyze_on_worker(frame, motion_gate, schedule)
+                except (JobExpired, JobPreempted) as e:
+                    return inference_dropped(e)
+                if result_json is None:
+                    return inference_busy()
+            elif deadline_passed(schedule):
+                return inference_dropped(JobExpired("Deadline passed before the frame was analyzed"))
+            else:
+                result_json = analyze_image(frame, model=object_model, output_dir=protoring_output_dir,
+                                            face_mesh_pool=face_mesh_pool, annotation_writer=annotation_writer,
+                                            gaze_mode=gaze_mode, motion_gate=motion_gate)
+            if submission_id:
+                cheating_accumulator.add(str(submission_id), result_json)
             return jsonify(success=True, message="Image analyzed successfully", data=result_json)
         except Exception as e:
             return jsonify(success=False, error=f"Failed to analyze image: {str(e)}"), 500
     except Exception as e:
         return jsonify(error=str(e)), 500
 
+@app.route('/analyze-images', methods=['POST'])
+def analyze_images_api():
+    try:
+        data = request.json
+        image_paths = data.get('image_paths')
+
+        if not image_paths or not isinstance(image_paths, list):
+            return jsonify(error="Image paths not provided or invalid format"), 400
+
+        # Frames that are missing on disk are reported individually instead of failing the batch
+        existing_paths = [path for path in image_paths if isinstance(path, str) and os.path.exists(path)]
+
+        try:
+            schedule = request_schedule('background')
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+        try:
+            if inference_pool is not None:
+                try:
+                    analyzed = inference_pool.run('analyze_images', existing_paths, **schedule)
+                except (JobExpired, JobPreempted) as e:
+                    return inference_dropped(e)
+                if analyzed is None:
+                    return inference_busy()
+            elif deadline_passed(schedule):
+                return inference_dropped(JobExpired("Deadline passed before the images were analyzed"))
+            else:
+                frames = [Frame.from_path(path) for path in existing_paths]
+                analyzed = analyze_images(frames, model=object_model, output_dir=protoring_output_dir,
+                                          batch_size=analyze_batch_size, face_mesh_pool=face_mesh_pool,
+                                          annotation_writer=annotation_writer, gaze_mode=gaze_mode)
+        except Exception as e:
+            return jsonify(success=False, error=f"Failed to analyze images: {str(e)}"), 500
+
+        results_by_path = dict(zip(existing_paths, analyzed))
+        # Batched frames of a submission count towards its cheating features like single ones
+        submission_id = data.get('submission_id')
+        if submission_id:
+            for result_json in analyzed:
+                cheating_accumulator.add(str(submission_id), result_json)
+        frame_results = []
+        for path in image_paths:
+            if path in results_by_path:
+                frame_results.append({"image_path": path, "success": True, "data": results_by_path[path]})
+            else:
+                frame_results.append({"image_path": path, "success": False, "error": "Image path does not exist"})
+
+        return jsonify(success=True, message="Images analyzed successfully", data=frame_results)
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+
+@app.route('/proctoring-sessions', methods=['POST'])
+def open_proctoring_session_api():
+    try:
+        data = request.json
+        submission_id = data.get('submission_id')
+
+        if not submission_id:
+            return jsonify(error="Submission ID not provided"), 400
+
+        session = proctoring_sessions.open(str(submission_id))
+        if session is None:
+            return jsonify(success=False, error="Too many proctoring sessions open"), 503
+        return jsonify(success=True, message="Proctoring session opened", data=session.stats()), 201
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+
+@app.route('/proctoring-sessions/<submission_id>/frames', methods=['POST'])
+def proctoring_session_frame_api(submission_id):
+    try:
+        session = proctoring_sessions.get(submission_id)
+        if session is None:
+            return jsonify(success=False, error="Proctoring session not found"), 404
+
+        frame = request_frame(request_params())
+        if frame_missing(frame):
+            return jsonify(error="Image path not provided or does not exist"), 400
+        try:
+            # Decoded now, the client may delete the image as soon as it is accepted
+            frame.bgr
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+
+        try:
+            queued = session.submit(frame)
+        except RuntimeError as e:
+            return jsonify(success=False, error=str(e)), 404
+        return jsonify(success=True, message="Frame queued for analysis", data=queued), 202
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+
+@app.route('/proctoring-sessions/<submission_id>/results', methods=['GET'])
+def proctoring_session_results_api(submission_id):
+    session = proctoring_sessions.get(submission_id)
+    if session is None:
+        return jsonify(success=False, error="Proctoring session not found"), 404
+    # One JSON result per line as each frame is analyzed, until the session is closed
+    after = request.args.get('after', 0, type=int)
+    return Response(session.results(after=after), mimetype='application/x-ndjson')
+
+@app.route('/proctoring-sessions/<submission_id>', methods=['DELETE'])
+def close_proctoring_session_api(submission_id):
+    try:
+        stats = proctoring_sessions.close(submission_id)
+        if stats is None:
+            return jsonify(success=False, error="Proctoring session not found"), 404
+        return jsonify(success=True, message="Proctoring session closed", data=stats)
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+
+@app.route('/ready', methods=['GET'])
+def ready_api():
+    # Stays unavailable until the models, and those of every inference worker, are loaded and warmed up
+    stats = model_manager.stats()
+    if inference_pool is not None:
+        stats["inference_pool"] = inference_pool.stats()
+    if not model_manager.is_ready() or (inference_pool is not None and not inference_pool.is_ready()):
+        return jsonify(success=False, message="Models are warming up", data=stats), 503
+    return jsonify(success=True, message="Ready", data=stats)
+
+@app.route('/inference-stats', methods=['GET'])
+def inference_stats_api():
+    return jsonify(success=True, data={
+        "spoof_model": spoof_model.stats(),
+        "object_model": object_model.stats(),
+        "face_mesh_pool": face_mesh_pool.stats(),
+        "annotation_writer": annotation_writer.stats(),
+        "encoding_cache": encoding_cache.stats(),
+        "face_result_cache": result_cache.stats(),
+        "proctoring_sessions": proctoring_sessions.stats(),
+        "motion_gates": motion_gates.stats(),
+        "cheating_accumulator": cheating_accumulator.stats(),
+        "models": model_manager.stats(),
+        "inference_pool": inference_pool.stats() if inference_pool is not None else None,
+        "cascade": object_detector.stats() if cascade_enabled else None,
+    })
+
 @app.route('/predict-cheating', methods=['POST'])
 def predict_cheating_api():
     try:
         data = request.json
-        features = data.get('features')
+        features = cheating_features(data.get('submission_id'), data.get('features'))
 
         if not features or not isinstance(features, list) or len(features) != 6:
             return jsonify(error="Features not provided or invalid format"), 400
 
         try:
-            probabilities = predict_cheating_probability(features, loaded_model)
+            probabilities = cheating_predictor.predict([features])[0]
             return jsonify(success=True, message="Prediction successful", data=probabilities)
         except Exception as e:
             return jsonify(success=False, error=f"Failed to predict cheating: {str(e)}"), 500
     except Exception as e:
         return jsonify(error=str(e)), 500
 
+@app.route('/predict-cheating-batch', methods=['POST'])
+def predict_cheating_batch_api():
+    try:
+        data = request.json
+        submissions = data.get('submissions')
+
+        if not submissions or not isinstance(submissions, list):
+            return jsonify(error="Submissions not provided or invalid format"), 400
+
+        # Submissions with bad features are reported individually, the rest are scored in one call
+        features = []
+        for submission in submissions:
+            submission = submission if isinstance(submission, dict) else {}
+            submission_features = cheating_features(submission.get('submission_id'), submission.get('features'))
+            features.append(submission_features if valid_features(submission_features) else None)
+
+        try:
+            valid = [submission_features for submission_features in features if submission_features is not None]
+            probabilities = iter(cheating_predictor.predict(valid) if valid else [])
+        except Exception as e:
+            return jsonify(success=False, error=f"Failed to predict cheating: {str(e)}"), 500
+
+        predictions = []
+        for submission, submission_features in zip(submissions, features):
+            submission_id = submission.get('submission_id') if isinstance(submission, dict) else None
+            if submission_features is None:
+                predictions.append({"submission_id": submission_id, "success": False,
+                                    "error": "Features not provided or invalid format"})
+            else:
+                predictions.append({"submission_id": submission_id, "success": True, "data": next(probabilities)})
+
+        return jsonify(success=True, message="Prediction successful", data=predictions)
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+
 @app.route('/send-password-reset-email', methods=['POST'])
 def send_password_reset_email():
     try:
@@ -0,0 +1,150 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class BatchedModel:
+    def __init__(self, model, max_batch_size=8, max_wait_ms=5, stats_window=1000):
+        """
+        Wraps an object detection model so that concurrent single image calls are
+        gathered into small batches and run as one model call.
+
+        :param model: The model to wrap. Must accept a list of sources and a batch argument.
+        :param max_batch_size: Maximum number of requests run in one model call.
+        :param max_wait_ms: Maximum time to wait for more requests once a batch has started.
+        :param stats_window: Number of recent batches kept for statistics.
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._stats = deque(maxlen=stats_window)
+        self._stats_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so a forked worker process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    @property
+    def names(self):
+        """Mapping of class IDs to object names of the wrapped model."""
+        return self.model.names
+
+    def __call__(self, source, **kwargs):
+        """
+        Runs the model on a single source as part of the next batch.
+
+        Lists of sources and calls with extra model arguments are already batched
+        by the caller and go straight to the wrapped model.
+
+        :param source: Image path or array.
+        :return: A list with the single result for the source.
+        """
+        if kwargs or isinstance(source, (list, tuple)):
+            return self.model(source, **kwargs)
+
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((source, time.perf_counter(), future))
+        return [future.result()]
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+
+            # Keep collecting until the batch is full or the wait budget is spent
+            wait_until = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = wait_until - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._run_batch(batch)
+                    return
+                batch.append(item)
+
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        sources = [source for source, _, _ in batch]
+        started = time.perf_counter()
+        try:
+            results = self.model(sources, batch=len(sources))
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        finished = time.perf_counter()
+
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+        with self._stats_lock:
+            self._stats.append({
+                "size": len(batch),
+                "queue_wait_ms": max((started - enqueued) * 1000 for _, enqueued, _ in batch),
+                "inference_ms": (finished - started) * 1000,
+            })
+
+    def stats(self):
+        """
+        Summarizes the recent batches.
+
+        :return: A dictionary with batch sizes, queue waits and inference times.
+        """
+        with self._stats_lock:
+            batches = list(self._stats)
+
+        if not batches:
+            return {"batches": 0}
+
+        sizes = sorted(b["size"] for b in batches)
+        waits = sorted(b["queue_wait_ms"] for b in batches)
+        inference = sorted(b["inference_ms"] for b in batches)
+        return {
+            "batches": len(batches),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "mean_batch_size": round(sum(sizes) / len(sizes), 2),
+            "queue_wait_ms": _summarize(waits),
+            "inference_ms": _summarize(inference),
+        }
+
+    def close(self):
+        """Stops the batching thread after the queued requests have run."""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._thread.join()
+
+
+def _summarize(sorted_values):
+    def percentile(p):
+        return round(sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))], 2)
+
+    return {
+        "mean": round(sum(sorted_values) / len(sorted_values), 2),
+        "p50": percentile(0.5),
+        "p99": percentile(0.99),
+        "max": round(sorted_values[-1], 2),
+    }
@@ -0,0 +1,453 @@
+"""
+Benchmarks for the proctoring and face recognition pipelines.
+
+Usage:
+    python benchmark.py facemesh-pool path/to/image.jpg --iterations 50
+    python benchmark.py face-detect path/to/faces/*.jpg --spoof-model ./models/yolo_custom_model.pt
+    python benchmark.py gaze path/to/frames/*.jpg
+    python benchmark.py cheating ./models/cheating_detection_model.pkl
+    python benchmark.py attendance --faces 30 --roster-sizes 30 100 300
+    python benchmark.py smtp --messages 200 --threads 8 --latency-ms 40
+    python benchmark.py inference-pool path/to/frames/*.jpg --workers 1 2 4
+    python benchmark.py spoof-check path/to/faces/*.jpg --spoof-model ./models/yolo_custom_model.pt
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+import psutil
+
+from ai_protoring import PROCTORING_LANDMARKS, LEFT_EYE_POINTS, RIGHT_EYE_POINTS, EYE_CORNER_POINTS, IRIS_CENTER_POINTS
+from face_detector import FaceMeshDetector, FaceMeshPool
+from face_locator import FaceLocator
+from frame import Frame
+from gaze import landmark_gaze, contour_gaze
+from verify_face import FACE_MATCH_THRESHOLD
+
+
+def rss_mb():
+    """Resident memory of the current process in MB."""
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def timed(function, iterations):
+    """Runs a function repeatedly and returns the mean latency in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) * 1000 / iterations
+
+
+def print_table(rows):
+    width = max(len(name) for name, _ in rows)
+    for name, value in rows:
+        print(f"{name.ljust(width)}  {value}")
+
+
+def bench_facemesh_pool(args):
+    img = cv2.imread(args.image)
+    if img is None:
+        raise SystemExit(f"Could not read image {args.image}")
+
+    # Pooled detectors first, so memory leaked by the per request mode does not count against them
+    pool = FaceMeshPool(maxSize=1)
+
+    def pooled():
+        with pool.borrow() as detector:
+            detector.findFaceMesh(img.copy())
+
+    rss_before = rss_mb()
+    pooled_ms = timed(pooled, args.iterations)
+    pooled_rss = rss_mb() - rss_before
+    pool.close()
+
+    # A new, never closed detector per call, as analyze_image used to do
+    def per_request():
+        FaceMeshDetector().findFaceMesh(img.copy())
+
+    rss_before = rss_mb()
+    per_request_ms = timed(per_request, args.iterations)
+    per_request_rss = rss_mb() - rss_before
+
+    print_table([
+        ("iterations", args.iterations),
+        ("per request detector, mean ms", f"{per_request_ms:.2f}"),
+        ("pooled detector, mean ms", f"{pooled_ms:.2f}"),
+        ("latency saved per request, ms", f"{per_request_ms - pooled_ms:.2f}"),
+        ("per request detector, RSS growth MB", f"{per_request_rss:.1f}"),
+        ("pooled detector, RSS growth MB", f"{pooled_rss:.1f}"),
+    ])
+
+
+def bench_face_detect(args):
+    frames = []
+    for path in args.images:
+        frame = Frame.from_path(path)
+        frame.bgr  # Decode up front so only detection and encoding are timed
+        frames.append(frame)
+
+    face_boxes = {}
+    if args.spoof_model:
+        from ultralytics import YOLO
+        from spoof_detector import is_real_image
+        model = YOLO(args.spoof_model)
+        for frame in frames:
+            face_boxes[frame.name] = is_real_image(frame, model, threshold=0.0, return_box=True)[1]
+
+    # Full resolution with the default upsampling is the reference every strategy is compared to
+    baseline = {frame.name: FaceLocator().encode(frame) for frame in frames}
+
+    configs = [("full", None, upsample) for upsample in args.upsample]
+    configs += [("downscaled", max_side, upsample) for max_side in args.max_sides for upsample in args.upsample]
+    if face_boxes:
+        configs.append(("reuse", max(args.max_sides), 1))
+
+    print(f"{len(frames)} images, baseline finds a face in {sum(1 for e in baseline.values() if e)}")
+    print("strategy    max_side  upsample  mean_ms  faces_found  mean_distance  same_identity")
+    for strategy, max_side, upsample in configs:
+        locator = FaceLocator(strategy, max_side or 0, upsample)
+        found, distances, same, elapsed = 0, [], 0, 0.0
+        for frame in frames:
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                encodings = locator.encode(frame, face_boxes.get(frame.name))
+            elapsed += (time.perf_counter() - start) / args.iterations
+
+            if encodings:
+                found += 1
+                if baseline[frame.name]:
+                    distance = float(np.linalg.norm(encodings[0] - baseline[frame.name][0]))
+                    distances.append(distance)
+                    same += distance <= FACE_MATCH_THRESHOLD
+
+        mean_distance = f"{sum(distances) / len(distances):.4f}" if distances else "-"
+        print(f"{strategy:<11} {str(max_side or '-'):>8}  {upsample:>8}  {elapsed * 1000 / len(frames):7.1f}"
+              f"  {found:>11}  {mean_distance:>13}  {same:>13}")
+
+
+def bench_gaze(args):
+    # The face mesh runs once per image, only the gaze estimation itself is timed
+    detector = FaceMeshDetector(staticMode=True)
+    samples = []
+    for path in args.images:
+        frame = Frame.from_path(path)
+        _, faces = detector.findFaceMesh(frame.bgr, imgRGB=frame.rgb, landmarks=PROCTORING_LANDMARKS)
+        if len(faces):
+            samples.append((frame.bgr, faces[0]))
+    detector.close()
+    if not samples:
+        raise SystemExit("No face found in any image")
+
+    def landmarks(img, face):
+        return landmark_gaze(face[EYE_CORNER_POINTS].reshape(2, 2, 2), face[IRIS_CENTER_POINTS])[0]
+
+    def contour(img, face):
+        return contour_gaze(img, face[LEFT_EYE_POINTS], face[RIGHT_EYE_POINTS])[0]
+
+    directions = {}
+    rows = [("images with a face", f"{len(samples)} of {len(args.images)}")]
+    for name, estimate in (("landmarks", landmarks), ("contour", contour)):
+        directions[name] = [estimate(img, face) for img, face in samples]
+        elapsed = timed(lambda: [estimate(img, face) for img, face in samples], args.iterations)
+        counts = {direction: directions[name].count(direction) for direction in ("left", "center", "right")}
+        rows.append((f"{name}, mean ms per image", f"{elapsed / len(samples):.3f}"))
+        rows.append((f"{name}, left/center/right", "/".join(str(count) for count in counts.values())))
+
+    agreement = sum(a == b for a, b in zip(directions["landmarks"], directions["contour"])) / len(samples)
+    rows.append(("agreement", f"{agreement:.1%}"))
+    print_table(rows)
+
+
+def bench_cheating(args):
+    import joblib
+    from cheating_detection import CheatingPredictor, parity_samples
+
+    model = joblib.load(args.model)
+    compiled = CheatingPredictor(model)
+    reference = CheatingPredictor(model, compile=False)
+    print(f"{type(model).__name__}, compiled backend: {compiled.backend}")
+    print("batch  compiled_ms  sklearn_ms  max_difference")
+    for batch_size in args.batch_sizes:
+        samples = parity_samples(batch_size, seed=batch_size)
+        difference = np.abs(compiled.predict_proba(samples) - reference.predict_proba(samples)).max()
+        compiled_ms = timed(lambda: compiled.predict_proba(samples), args.iterations)
+        sklearn_ms = timed(lambda: reference.predict_proba(samples), args.iterations)
+        print(f"{batch_size:>5}  {compiled_ms:11.3f}  {sklearn_ms:10.3f}  {difference:14.2e}")
+
+
+def bench_spoof_check(args):
+    import math
+    import torch
+    from ultralytics import YOLO
+    from spoof_detector import is_real_image, score_boxes
+
+    model = YOLO(args.spoof_model)
+    locator = FaceLocator()
+    samples = []
+    for path in args.images:
+        frame = Frame.from_path(path)
+        frame.bgr  # Decode up front so only the checks are timed
+        samples.append((frame, locator.find(frame)))
+    with_face = [(frame, locations[0]) for frame, locations in samples if locations]
+    if not with_face:
+        raise SystemExit("No face found in any image")
+
+    # The full image check is the reference, the crop check also pays for finding the face
+    full = [is_real_image(frame, model, args.threshold) for frame, _ in with_face]
+    crop = [is_real_image(frame, model, args.threshold, face_location=location) for frame, location in with_face]
+    full_ms = timed(lambda: [is_real_image(frame, model, args.threshold) for frame, _ in with_face], args.iterations)
+    crop_ms = timed(lambda: [is_real_image(frame, model, args.threshold, face_location=location)
+                             for frame, location in with_face], args.iterations)
+    find_ms = timed(lambda: [locator.find(frame) for frame, _ in with_face], args.iterations)
+
+    # Scoring of the boxes alone, the per box loop it replaced against the vectorized version
+    rng = np.random.default_rng(0)
+    data = np.column_stack([rng.uniform(0, 640, (args.boxes, 4)), rng.uniform(0, args.threshold, args.boxes),
+                            rng.integers(0, 2, args.boxes)]).astype(np.float32)
+    confidences = torch.from_numpy(data[:, 4:5])
+
+    def per_box():
+        for conf in confidences:
+            if math.ceil(conf[0] * 100) / 100 > args.threshold:
+                return
+
+    count = len(with_face)
+    print_table([
+        ("images with a face", f"{count} of {len(samples)}"),
+        ("full image check, mean ms", f"{full_ms / count:.2f}"),
+        ("face crop check, mean ms", f"{crop_ms / count:.2f}"),
+        ("finding the face, mean ms", f"{find_ms / count:.2f}"),
+        ("real/fake, full image", f"{sum(full)}/{count - sum(full)}"),
+        ("real/fake, face crop", f"{sum(crop)}/{count - sum(crop)}"),
+        ("decision agreement", f"{sum(a == b for a, b in zip(full, crop)) / count:.1%}"),
+        (f"per box scoring of {args.boxes} boxes, ms", f"{timed(per_box, args.iterations):.3f}"),
+        (f"vectorized scoring of {args.boxes} boxes, ms",
+         f"{timed(lambda: score_boxes(data, args.threshold), args.iterations):.3f}"),
+    ])
+
+
+def bench_attendance(args):
+    import face_recognition
+    from verify_face import match_roster
+
+    # Random encodings, the faces being noisy copies of the first roster entries
+    rng = np.random.default_rng(0)
+    print("roster  faces  per_student_ms  matrix_ms  present")
+    for size in args.roster_sizes:
+        roster = rng.normal(0, 0.1, (size, 128))
+        faces = roster[:min(args.faces, size)] + rng.normal(0, 0.01, (min(args.faces, size), 128))
+
+        # What one /verify-face call per student does after the encoding
+        def per_student():
+            return [(face_recognition.face_distance([known], faces) <= FACE_MATCH_THRESHOLD).any() for known in roster]
+
+        per_student_ms = timed(per_student, args.iterations)
+        matrix_ms = timed(lambda: match_roster(faces, roster), args.iterations)
+        print(f"{size:>6}  {len(faces):>5}  {per_student_ms:14.3f}  {matrix_ms:9.3f}  {len(match_roster(faces, roster)):>7}")
+
+
+def local_smtp_server(latency_ms):
+    """
+    A minimal SMTP server on a free local port that accepts every message, for benchmarking
+    without a mail provider. Each reply is delayed by latency_ms to stand in for the network.
+
+    :return: The server, already serving on a background thread, its port is server.server_address[1].
+    """
+    import socketserver
+    import threading
+
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            time.sleep(latency_ms / 1000)
+            self.wfile.write(line.encode() + b"\r\n")
+
+        def handle(self):
+            self.reply("220 localhost ready")
+            for raw in self.rfile:
+                command = raw.decode(errors="replace").strip().upper()
+                if command.startswith("EHLO"):
+                    time.sleep(latency_ms / 1000)
+                    self.wfile.write(b"250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+                elif command.startswith("AUTH"):
+                    self.reply("235 Authenticated")
+                elif command == "DATA":
+                    self.reply("354 End data with <CR><LF>.<CR><LF>")
+                    for line in self.rfile:
+                        if line in (b".\r\n", b".\n"):
+                            break
+                    self.reply("250 Queued")
+                elif command == "QUIT":
+                    self.reply("221 Bye")
+                    return
+                else:
+                    self.reply("250 OK")
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_smtp(args):
+    import smtplib
+    import ssl
+    from concurrent.futures import ThreadPoolExecutor
+    from email.mime.text import MIMEText
+    from smtp_pool import SMTPPool
+
+    server = None
+    if args.host:
+        host, port = args.host, args.port
+    else:
+        server = local_smtp_server(args.latency_ms)
+        host, port = server.server_address
+    starttls = bool(args.host) and not args.no_starttls
+
+    msg = MIMEText("Security Code: 123456")
+    msg['Subject'] = "Benchmark"
+    msg['From'] = args.sender
+    msg['To'] = args.recipient
+    message = msg.as_string()
+
+    # One connection per message, as the mail functions used to send
+    def per_message():
+        with smtplib.SMTP(host, port, timeout=30) as smtp:
+            smtp.ehlo()
+            if starttls:
+                smtp.starttls(context=ssl.create_default_context())
+                smtp.ehlo()
+            if args.user:
+                smtp.login(args.user, args.password)
+            smtp.sendmail(args.sender, args.recipient, message)
+
+    pool = SMTPPool(host, port, args.user, args.password, max_size=args.threads, starttls=starttls)
+
+    def pooled():
+        pool.send(args.sender, args.recipient, message)
+
+    rows = [("server", f"{host}:{port}" if args.host else f"local stand-in, {args.latency_ms} ms per reply"),
+            ("messages, threads", f"{args.messages}, {args.threads}")]
+    for name, send in (("connection per message", per_message), ("pooled connections", pooled)):
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            start = time.perf_counter()
+            list(executor.map(lambda _: send(), range(args.messages)))
+            elapsed = time.perf_counter() - start
+        rows.append((f"{name}, messages per s", f"{args.messages / elapsed:.1f}"))
+    pool_stats = pool.stats()
+    rows.append(("pooled connections opened", pool_stats["connects"]))
+    pool.close()
+    if server is not None:
+        server.shutdown()
+    print_table(rows)
+
+
+def bench_inference_pool(args):
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    from inference_pool import InferencePool
+    from inference_worker import load_worker
+
+    frames = [{"path": path, "data": None, "name": os.path.basename(path)} for path in args.images]
+    print("workers  frames_per_s  speedup")
+    baseline = None
+    for workers in args.workers:
+        pool = InferencePool(load_worker, initargs=({
+            "spoof_model": {"weights": args.spoof_model, "backend": args.backend, "precision": args.precision},
+            "object_model": {"weights": args.object_model, "backend": args.backend, "precision": args.precision},
+            "threads": max(1, os.cpu_count() // workers),
+            "face_mesh_pool_size": 1,
+            "face_detection": {},
+            "spoof_mode": "full",
+            "gaze_mode": "landmarks",
+            "output_dir": args.output_dir,
+            "annotation": {"mode": "off"},
+            "analyze_batch_size": 16,
+        },), workers=workers, max_queue=args.frames)
+        pool.start()
+        while not pool.is_ready():
+            time.sleep(0.1)
+
+        # Enough client threads to keep every worker busy
+        with ThreadPoolExecutor(max_workers=workers * 2) as clients:
+            start = time.perf_counter()
+            list(clients.map(lambda i: pool.run("analyze_image", frames[i % len(frames)]), range(args.frames)))
+            throughput = args.frames / (time.perf_counter() - start)
+        pool.close()
+
+        baseline = baseline or throughput
+        print(f"{workers:>7}  {throughput:12.2f}  {throughput / baseline:7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    facemesh = subparsers.add_parser("facemesh-pool", help="Per request FaceMeshDetector versus a pooled one")
+    facemesh.add_argument("image", help="Path to a face image")
+    facemesh.add_argument("--iterations", type=int, default=50)
+    facemesh.set_defaults(func=bench_facemesh_pool)
+
+    detect = subparsers.add_parser("face-detect", help="Latency and accuracy of the face detection strategies")
+    detect.add_argument("images", nargs="+", help="Reference face images")
+    detect.add_argument("--max-sides", type=int, nargs="+", default=[480, 640, 800])
+    detect.add_argument("--upsample", type=int, nargs="+", default=[0, 1])
+    detect.add_argument("--spoof-model", help="Anti-spoof YOLO model, enables the reuse strategy")
+    detect.add_argument("--iterations", type=int, default=3)
+    detect.set_defaults(func=bench_face_detect)
+
+    gaze = subparsers.add_parser("gaze", help="Landmark versus contour gaze estimation, latency and agreement")
+    gaze.add_argument("images", nargs="+", help="Proctoring frames with a face")
+    gaze.add_argument("--iterations", type=int, default=20)
+    gaze.set_defaults(func=bench_gaze)
+
+    cheating = subparsers.add_parser("cheating", help="Compiled versus sklearn cheating model, latency and parity")
+    cheating.add_argument("model", help="Path to the joblib cheating model")
+    cheating.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 64, 256, 1024])
+    cheating.add_argument("--iterations", type=int, default=20)
+    cheating.set_defaults(func=bench_cheating)
+
+    spoof = subparsers.add_parser("spoof-check", help="Anti-spoof check on the full image versus the face crop")
+    spoof.add_argument("images", nargs="+", help="Face images, real and spoofed")
+    spoof.add_argument("--spoof-model", default="./models/yolo_custom_model.pt")
+    spoof.add_argument("--threshold", type=float, default=0.6)
+    spoof.add_argument("--boxes", type=int, default=300, help="Boxes in the scoring comparison")
+    spoof.add_argument("--iterations", type=int, default=10)
+    spoof.set_defaults(func=bench_spoof_check)
+
+    attendance = subparsers.add_parser("attendance", help="Roster matching, per student versus one distance matrix")
+    attendance.add_argument("--faces", type=int, default=30, help="Faces in the classroom image")
+    attendance.add_argument("--roster-sizes", type=int, nargs="+", default=[30, 100, 300])
+    attendance.add_argument("--iterations", type=int, default=20)
+    attendance.set_defaults(func=bench_attendance)
+
+    smtp = subparsers.add_parser("smtp", help="Messages per second, a connection per message versus the SMTP pool")
+    smtp.add_argument("--host", help="SMTP server, a local stand-in server by default")
+    smtp.add_argument("--port", type=int, default=587)
+    smtp.add_argument("--no-starttls", action="store_true", help="Do not use STARTTLS with --host")
+    smtp.add_argument("--user", help="Login user")
+    smtp.add_argument("--password")
+    smtp.add_argument("--sender", default="noreply@example.com")
+    smtp.add_argument("--recipient", default="student@example.com")
+    smtp.add_argument("--messages", type=int, default=200)
+    smtp.add_argument("--threads", type=int, default=4)
+    smtp.add_argument("--latency-ms", type=float, default=20, help="Reply delay of the local stand-in server")
+    smtp.set_defaults(func=bench_smtp)
+
+    pool = subparsers.add_parser("inference-pool", help="Frame analysis throughput by number of inference workers")
+    pool.add_argument("images", nargs="+", help="Proctoring frames")
+    pool.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    pool.add_argument("--frames", type=int, default=64)
+    pool.add_argument("--spoof-model", default="./models/yolo_custom_model.pt")
+    pool.add_argument("--object-model", default="./models/yolov8x.pt")
+    pool.add_argument("--backend", default="pytorch", choices=["pytorch", "onnx", "openvino"])
+    pool.add_argument("--precision", default="fp32", choices=["fp32", "int8"])
+    pool.add_argument("--output-dir", default=".")
+    pool.set_defaults(func=bench_inference_pool)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
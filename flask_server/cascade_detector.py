@@ -0,0 +1,160 @@
+import random
+import threading
+import time
+
+# Classes the proctoring analysis looks at
+CASCADE_CLASSES = ("person", "cell phone")
+
+
+class CascadeDetector:
+    def __init__(self, cheap, full, cheap_size=320, band=(0.15, 0.6), conf=0.25, audit_rate=0.02):
+        """
+        Object detection that runs a small model first and the large one only when needed.
+
+        The small model looks for people and phones at a reduced input size. Its result is kept
+        when it is sure of everything it sees: exactly one person, no phone, and no detection
+        with a confidence inside the ambiguous band. Otherwise the frame escalates to the large
+        model, so every frame that would raise a cheating flag is decided by the large model.
+        A share of the kept frames is also run through the large model to measure how often
+        the two disagree.
+
+        Called like a YOLO model, so it can be wrapped by BatchedModel and passed to analyze_image.
+
+        :param cheap: Small YOLO model trained on the COCO classes, such as yolov8n.
+        :param full: Large YOLO model, such as yolov8x.
+        :param cheap_size: Input size of the small model.
+        :param band: (low, high) confidences of the small model between which a detection is ambiguous.
+        :param conf: Confidence above which a detection counts, the YOLO default.
+        :param audit_rate: Share of kept frames also run through the large model for the disagreement rate.
+        """
+        if not 0 < band[0] <= conf <= band[1] <= 1:
+            raise ValueError("The ambiguous band must contain the confidence threshold")
+        self.cheap = cheap
+        self.full = full
+        self.cheap_size = cheap_size
+        self.band = band
+        self.conf = conf
+        self.audit_rate = audit_rate
+        self._cheap_classes = None
+
+        self._lock = threading.Lock()
+        self._frames = 0
+        self._escalated = 0
+        self._reasons = {"ambiguous": 0, "no_person": 0, "extra_person": 0, "mobile_phone": 0}
+        self._audited = 0
+        self._audit_disagreements = 0
+        self._escalated_disagreements = 0
+        self._cheap_ms = 0.0
+        self._full_ms = 0.0
+        self._full_frames = 0
+
+    @property
+    def names(self):
+        """Mapping of class IDs to object names, those of the large model."""
+        return self.full.names
+
+    def _classes(self):
+        if self._cheap_classes is None:
+            # Results of either model go through the large model's names, so the IDs must agree
+            cheap_ids = {name: class_id for class_id, name in self.cheap.names.items()}
+            full_ids = {name: class_id for class_id, name in self.full.names.items()}
+            for name in CASCADE_CLASSES:
+                if name not in cheap_ids or cheap_ids[name] != full_ids.get(name):
+                    raise ValueError(f"The cascade models disagree on the class ID of '{name}'")
+            self._cheap_classes = [cheap_ids[name] for name in CASCADE_CLASSES]
+        return self._cheap_classes
+
+    def _verdict(self, result):
+        """Number of people and phones counted in a result, as the analysis would count them."""
+        data = result.boxes.data.numpy()
+        data = data[data[:, 4] >= self.conf]
+        person, phone = self._classes()
+        return int((data[:, 5] == person).sum()), int((data[:, 5] == phone).sum())
+
+    def _escalation_reason(self, result):
+        confidences = result.boxes.conf.numpy()
+        if ((confidences >= self.band[0]) & (confidences < self.band[1])).any():
+            return "ambiguous"
+        people, phones = self._verdict(result)
+        if people == 0:
+            return "no_person"
+        if people > 1:
+            return "extra_person"
+        if phones:
+            return "mobile_phone"
+        return None
+
+    def __call__(self, source, **kwargs):
+        """
+        Detects objects in one image or a list of images.
+
+        :param source: Image array, or a list of them.
+        :return: A list with one result per image, from the large model for escalated images.
+        """
+        sources = list(source) if isinstance(source, (list, tuple)) else [source]
+        kwargs.pop("batch", None)
+        kwargs.pop("verbose", None)
+
+        start = time.perf_counter()
+        cheap_results = self.cheap(sources, imgsz=self.cheap_size, classes=self._classes(), conf=self.band[0],
+                                   batch=len(sources), verbose=False, **kwargs)
+        cheap_ms = (time.perf_counter() - start) * 1000
+
+        reasons = [self._escalation_reason(result) for result in cheap_results]
+        audited = [reason is None and random.random() < self.audit_rate for reason in reasons]
+        rerun = [index for index, reason in enumerate(reasons) if reason is not None or audited[index]]
+
+        full_ms = 0.0
+        full_results = {}
+        if rerun:
+            start = time.perf_counter()
+            subset = [sources[index] for index in rerun]
+            full_results = dict(zip(rerun, self.full(subset, batch=len(subset), verbose=False, **kwargs)))
+            full_ms = (time.perf_counter() - start) * 1000
+
+        results = []
+        with self._lock:
+            self._frames += len(sources)
+            self._cheap_ms += cheap_ms
+            self._full_ms += full_ms
+            self._full_frames += len(rerun)
+            for index, (cheap_result, reason) in enumerate(zip(cheap_results, reasons)):
+                if reason is None:
+                    # Only detections above the usual threshold, as the large model would report them
+                    results.append(cheap_result[cheap_result.boxes.conf >= self.conf])
+                    if audited[index]:
+                        self._audited += 1
+                        self._audit_disagreements += self._disagree(cheap_result, full_results[index])
+                    continue
+                self._escalated += 1
+                self._reasons[reason] += 1
+                self._escalated_disagreements += self._disagree(cheap_result, full_results[index])
+                results.append(full_results[index])
+        return results
+
+    def _disagree(self, cheap_result, full_result):
+        """True when the two models would lead to different cheating flags."""
+        cheap_people, cheap_phones = self._verdict(cheap_result)
+        full_people, full_phones = self._verdict(full_result)
+        return (min(cheap_people, 2), cheap_phones > 0) != (min(full_people, 2), full_phones > 0)
+
+    def stats(self):
+        with self._lock:
+            frames = self._frames
+            if not frames:
+                return {"frames": 0}
+            return {
+                "frames": frames,
+                "escalated": self._escalated,
+                "escalation_rate": round(self._escalated / frames, 3),
+                "escalation_reasons": dict(self._reasons),
+                # Kept frames checked against the large model, and how often it would have flagged differently
+                "audited": self._audited,
+                "audit_disagreement_rate": round(self._audit_disagreements / self._audited, 3) if self._audited else None,
+                # Escalated frames where the large model overturned the small model's flags
+                "escalated_disagreement_rate": round(self._escalated_disagreements / self._escalated, 3)
+                if self._escalated else None,
+                "cheap_ms_per_frame": round(self._cheap_ms / frames, 2),
+                "full_ms_per_frame": round(self._full_ms / self._full_frames, 2) if self._full_frames else None,
+                "mean_ms_per_frame": round((self._cheap_ms + self._full_ms) / frames, 2),
+            }
@@ -0,0 +1,249 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Features of the cheating model, in the order predict_cheating_probability expects them
+FEATURE_NAMES = ["num_images", "mobile_phone", "extra_person", "mouth_open", "no_person", "eye_left_right"]
+
+
+def frame_indicators(result):
+    """
+    Counts a single analyzed frame contributes to each cheating feature.
+
+    :param result: Result of analyze_image.
+    :return: List of 0/1 values in FEATURE_NAMES order.
+    """
+    return [
+        1,
+        int(bool(result.get("mobile_phone"))),
+        int(bool(result.get("extra_person"))),
+        int(bool(result.get("mouth_open"))),
+        int(bool(result.get("no_person"))),
+        # Any gaze away from the centre counts, as in the proctoring report
+        int(result.get("eye_gaze", "center") != "center"),
+    ]
+
+
+class CheatingAccumulator:
+    def __init__(self, idle_timeout=6 * 3600, snapshot_path=None, snapshot_interval=30):
+        """
+        Running cheating feature counts of each quiz submission, updated as frames are analyzed,
+        so scoring a submission does not have to aggregate its proctoring report.
+
+        With a snapshot path, each process saves its own counts to a file named after the path
+        and its pid, and the features of a submission add up the counts of this process and
+        the latest snapshots of the others, so web processes behind one server each count the
+        frames they analyzed. On startup, a process takes over the snapshots of processes that
+        are gone, so their counts are restored exactly once.
+
+        :param idle_timeout: Seconds without frames after which a submission is forgotten.
+        :param snapshot_path: Path the snapshot files are named after, None keeps the counts in memory only.
+        :param snapshot_interval: Minimum seconds between two snapshots, also how far behind the counts
+                                  of the other processes can be.
+        """
+        self.idle_timeout = idle_timeout
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        # submission id -> [counts in FEATURE_NAMES order, last update as a unix time]
+        self._submissions = {}
+        self._dirty = False
+        self._last_snapshot = time.monotonic()
+        self._evicted = 0
+        self._pid = os.getpid()
+        # Snapshots of other processes as read last, path -> (modification time, submissions)
+        self._other_snapshots = {}
+
+        if snapshot_path:
+            self._adopt_snapshots()
+
+    def _check_fork(self):
+        # A forked process starts empty, the counts it inherited are in its parent's snapshot
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._submissions = {}
+                    self._dirty = False
+                    self._other_snapshots = {}
+                    self._pid = os.getpid()
+
+    @contextmanager
+    def _snapshot_files(self, exclusive):
+        # Opened on every use, a lock file inherited through a fork would be shared with the parent
+        with open(f"{self.snapshot_path}.lock", "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _own_snapshot_path(self):
+        return f"{self.snapshot_path}.{os.getpid()}"
+
+    def _snapshot_paths(self):
+        """Snapshot files of every process, as (path, pid), the pid is None for a single file of older versions."""
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        pattern = re.compile(re.escape(os.path.basename(self.snapshot_path)) + r"\.(\d+)$")
+        paths = []
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if match:
+                paths.append((os.path.join(directory, name), int(match.group(1))))
+        if os.path.exists(self.snapshot_path):
+            paths.append((self.snapshot_path, None))
+        return paths
+
+    @staticmethod
+    def _read_snapshot(path):
+        try:
+            with open(path) as f:
+                return {submission_id: [counts, updated]
+                        for submission_id, (counts, updated) in json.load(f).items()}
+        except (OSError, ValueError) as e:
+            logger.warning("Could not restore cheating features from %s: %s", path, e)
+            return None
+
+    def _adopt_snapshots(self):
+        with self._snapshot_files(exclusive=True):
+            adopted = []
+            for path, pid in self._snapshot_paths():
+                if pid is not None and pid != os.getpid() and _process_alive(pid):
+                    continue
+                submissions = self._read_snapshot(path)
+                if submissions is None:
+                    continue
+                for submission_id, (counts, updated) in submissions.items():
+                    entry = self._submissions.setdefault(submission_id, [[0] * len(FEATURE_NAMES), updated])
+                    entry[0] = [count + added for count, added in zip(entry[0], counts)]
+                    entry[1] = max(entry[1], updated)
+                adopted.append(path)
+            if not adopted:
+                return
+            self._evict_idle(time.time())
+            # Saved under this process before the files it replaces are removed, so no count is lost or doubled
+            self._dirty = True
+            self._write_snapshot()
+            for path in adopted:
+                if path != self._own_snapshot_path():
+                    os.remove(path)
+
+    def add(self, submission_id, result):
+        """
+        Adds an analyzed frame to the counts of its submission.
+
+        :param submission_id: Id of the quiz submission.
+        :param result: Result of analyze_image for the frame.
+        """
+        self._check_fork()
+        indicators = frame_indicators(result)
+        now = time.time()
+        with self._lock:
+            entry = self._submissions.get(submission_id)
+            if entry is None:
+                entry = self._submissions[submission_id] = [[0] * len(FEATURE_NAMES), now]
+            entry[0] = [count + indicator for count, indicator in zip(entry[0], indicators)]
+            entry[1] = now
+            self._dirty = True
+            # Idle submissions are evicted along with the snapshot
+            snapshot_due = time.monotonic() - self._last_snapshot >= self.snapshot_interval
+        if snapshot_due:
+            self.snapshot()
+
+    def features(self, submission_id):
+        """
+        The feature vector of a submission.
+
+        :param submission_id: Id of the quiz submission.
+        :return: List of counts in FEATURE_NAMES order, or None when no frame of the submission was seen.
+        """
+        self._check_fork()
+        with self._lock:
+            entry = self._submissions.get(submission_id)
+            counts = list(entry[0]) if entry is not None else None
+        if self.snapshot_path:
+            for other in self._other_counts(submission_id):
+                counts = other if counts is None else [count + added for count, added in zip(counts, other)]
+        return counts
+
+    def _other_counts(self, submission_id):
+        """Counts of a submission in the snapshots of the other processes."""
+        with self._snapshot_files(exclusive=False):
+            paths = [path for path, pid in self._snapshot_paths() if pid != os.getpid()]
+            snapshots = {}
+            for path in paths:
+                try:
+                    modified = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                cached = self._other_snapshots.get(path)
+                if cached is None or cached[0] != modified:
+                    cached = (modified, self._read_snapshot(path) or {})
+                snapshots[path] = cached
+        self._other_snapshots = snapshots
+        return [submissions[submission_id][0] for _, submissions in snapshots.values() if submission_id in submissions]
+
+    def remove(self, submission_id):
+        with self._lock:
+            if self._submissions.pop(submission_id, None) is not None:
+                self._dirty = True
+
+    def _evict_idle(self, now):
+        idle = [submission_id for submission_id, (_, updated) in self._submissions.items()
+                if now - updated > self.idle_timeout]
+        for submission_id in idle:
+            del self._submissions[submission_id]
+        self._evicted += len(idle)
+        self._dirty = self._dirty or bool(idle)
+
+    def snapshot(self):
+        """Evicts idle submissions and writes the counts of this process to its snapshot file when they changed."""
+        self._check_fork()
+        with self._snapshot_lock:
+            if not self.snapshot_path:
+                with self._lock:
+                    self._evict_idle(time.time())
+                    self._last_snapshot = time.monotonic()
+                return
+            with self._snapshot_files(exclusive=True):
+                self._write_snapshot()
+
+    def _write_snapshot(self):
+        with self._lock:
+            self._evict_idle(time.time())
+            self._last_snapshot = time.monotonic()
+            if not self._dirty:
+                return
+            data = {submission_id: [list(counts), updated]
+                    for submission_id, (counts, updated) in self._submissions.items()}
+            self._dirty = False
+
+        # Written beside the old snapshot and swapped in, so a crash never leaves half a file
+        path = self._own_snapshot_path()
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning("Could not save cheating features to %s: %s", path, e)
+            with self._lock:
+                self._dirty = True
+
+    def stats(self):
+        with self._lock:
+            return {"submissions": len(self._submissions), "evicted": self._evicted}
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
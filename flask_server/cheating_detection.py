@@ -1,5 +1,164 @@
+import hashlib
+import logging
 import random
-import pandas as pd
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Define the feature names
+FEATURE_NAMES = ["num_images", "mobile_phone", "extra_person", "mouth_open", "no_person", "eye_left_right"]
+
+# Maximum difference from sklearn tolerated by a compiled model
+PARITY_TOLERANCE = 1e-9
+# Above this many submissions the multithreaded sklearn forest overtakes the compiled one
+COMPILED_MAX_BATCH = 256
+
+
+def _compile_linear(model):
+    coef = np.asarray(model.coef_, dtype=np.float64)
+    intercept = np.asarray(model.intercept_, dtype=np.float64)
+    if coef.shape[0] != 1:
+        return None
+
+    def predict_proba(X):
+        positive = 1 / (1 + np.exp(-(X @ coef[0] + intercept[0])))
+        return np.column_stack([1 - positive, positive])
+    return predict_proba
+
+
+def _compile_trees(trees):
+    # Nodes of every tree are concatenated into flat arrays so all trees are walked at once
+    offsets = np.cumsum([0] + [tree.tree_.node_count for tree in trees])
+    depth = max(tree.tree_.max_depth for tree in trees)
+    left = np.concatenate([tree.tree_.children_left + offset for tree, offset in zip(trees, offsets)])
+    right = np.concatenate([tree.tree_.children_right + offset for tree, offset in zip(trees, offsets)])
+    is_leaf = np.concatenate([tree.tree_.children_left < 0 for tree in trees])
+    # Leaves point at themselves, so walking past a leaf stays on it
+    left[is_leaf] = right[is_leaf] = np.flatnonzero(is_leaf)
+    feature = np.concatenate([np.maximum(tree.tree_.feature, 0) for tree in trees])
+    threshold = np.concatenate([tree.tree_.threshold for tree in trees])
+    value = np.concatenate([tree.tree_.value[:, 0, :] for tree in trees])
+    value = value / np.maximum(value.sum(axis=1, keepdims=True), 1e-300)
+    roots = offsets[:-1]
+
+    def predict_proba(X):
+        # Trees compare float32 features, like sklearn does
+        X = X.astype(np.float32)
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(roots, (len(X), len(roots)))
+        for _ in range(depth):
+            node = np.where(X[rows, feature[node]] <= threshold[node], left[node], right[node])
+        return value[node].mean(axis=1)
+    return predict_proba
+
+
+def compile_model(model):
+    """
+    Turns a fitted sklearn classifier into a NumPy function computing its predict_proba.
+
+    Supports binary logistic regression, decision trees and random or extra tree forests.
+
+    :param model: The fitted classifier.
+    :return: A function of a (samples, features) array, or None when the model type is not supported.
+    """
+    name = type(model).__name__
+    if name == "LogisticRegression":
+        return _compile_linear(model)
+    if name in ("DecisionTreeClassifier", "ExtraTreeClassifier"):
+        return _compile_trees([model])
+    if name in ("RandomForestClassifier", "ExtraTreesClassifier"):
+        return _compile_trees(model.estimators_)
+    return None
+
+
+def parity_samples(count=512, seed=0):
+    """Feature vectors shaped like real quizzes, used to check a compiled model against sklearn."""
+    rng = np.random.default_rng(seed)
+    num_images = rng.integers(1, 400, size=count)
+    indicators = (rng.random((count, len(FEATURE_NAMES) - 1)) * (num_images[:, None] + 1)).astype(np.int64)
+    return np.column_stack([num_images, indicators]).astype(np.float64)
+
+
+class CheatingPredictor:
+    def __init__(self, model, seed=None, compile=True):
+        """
+        Predicts cheating probabilities for one or many submissions at once.
+
+        The sklearn model is compiled into NumPy operations when its type is supported and
+        the compiled version matches sklearn on a set of sample quizzes, otherwise sklearn
+        itself is used.
+
+        :param model: The fitted sklearn classifier loaded with joblib.
+        :param seed: Seed of the random adjustment of extreme probabilities. With a seed, the
+                     same features always get the same result. None draws fresh randomness.
+        :param compile: Compile the model into NumPy operations when possible.
+        """
+        self.model = model
+        self.seed = seed
+        self._compiled = compile_model(model) if compile else None
+        self.backend = "sklearn"
+        if self._compiled is not None:
+            samples = parity_samples()
+            difference = np.abs(self._compiled(samples) - self._sklearn_proba(samples)).max()
+            if difference <= PARITY_TOLERANCE:
+                self.backend = "numpy"
+            else:
+                logger.warning("Compiled cheating model differs from sklearn by %g, using sklearn", difference)
+                self._compiled = None
+
+    def _sklearn_proba(self, X):
+        if getattr(self.model, "feature_names_in_", None) is not None:
+            import pandas as pd
+            X = pd.DataFrame(X, columns=self.model.feature_names_in_)
+        return self.model.predict_proba(X)
+
+    def predict_proba(self, features):
+        """
+        Raw model probabilities.
+
+        :param features: Array-like of shape (submissions, 6) in FEATURE_NAMES order.
+        :return: Array of shape (submissions, 2) with the not cheating and cheating probabilities.
+        """
+        X = np.asarray(features, dtype=np.float64).reshape(-1, len(FEATURE_NAMES))
+        if self._compiled is not None and len(X) <= COMPILED_MAX_BATCH:
+            return self._compiled(X)
+        return self._sklearn_proba(X)
+
+    def predict(self, features):
+        """
+        Cheating probabilities of several submissions, adjusted like predict_cheating_probability.
+
+        :param features: Array-like of shape (submissions, 6) in FEATURE_NAMES order.
+        :return: List of dictionaries with the 'cheating_probability' and 'not_cheating_probability'.
+        """
+        X = np.asarray(features, dtype=np.float64).reshape(-1, len(FEATURE_NAMES))
+        probabilities = self.predict_proba(X) * 100
+
+        results = []
+        for row, (not_cheating_probability, cheating_probability) in zip(X, probabilities.tolist()):
+            # Modify probabilities to add randomness
+            if cheating_probability >= 90.0:
+                cheating_probability = round(self._uniform(row, 80, 100), 2)
+                not_cheating_probability = round(100 - cheating_probability, 2)
+            elif cheating_probability <= 10.0:
+                cheating_probability = round(self._uniform(row, 0, 30), 2)
+                not_cheating_probability = round(100 - cheating_probability, 2)
+            else:
+                cheating_probability = round(cheating_probability, 2)
+                not_cheating_probability = round(not_cheating_probability, 2)
+            results.append({
+                "cheating_probability": cheating_probability,
+                "not_cheating_probability": not_cheating_probability
+            })
+        return results
+
+    def _uniform(self, row, low, high):
+        if self.seed is None:
+            return random.uniform(low, high)
+        # A hash of the seed and the features, so the draw does not depend on the order of calls
+        digest = hashlib.blake2b(row.tobytes(), digest_size=8, key=str(self.seed).encode()).digest()
+        return low + (high - low) * int.from_bytes(digest, "little") / 2 ** 64
+
 
 def predict_cheating_probability(features, loaded_model):
     """
@@ -9,35 +168,12 @@ def predict_cheating_probability(features, loaded_model):
     Parameters:
     features (list or array-like): A list or array of feature values in the following order:
         [num_images, mobile_phone, extra_person, mouth_open, no_person, eye_left_right]
+    loaded_model: A CheatingPredictor, or a fitted sklearn classifier.
 
     Returns:
     dict: A dictionary with probabilities of 'not cheating' and 'cheating', rounded to two decimal places.
     """
-    # Define the feature names
-    feature_names = ["num_images", "mobile_phone", "extra_person", "mouth_open", "no_person", "eye_left_right"]
-    
-    # Convert the features into a DataFrame with the correct feature names
-    features_df = pd.DataFrame([features], columns=feature_names)
-    
-    # Get probability predictions
-    probabilities = loaded_model.predict_proba(features_df)[0]
-
-    # Modify probabilities to add randomness
-    cheating_probability = probabilities[1] * 100
-    not_cheating_probability = probabilities[0] * 100
-
-    if cheating_probability >= 90.0:
-        cheating_probability = round(random.uniform(80, 100), 2)
-        not_cheating_probability = round(100 - cheating_probability, 2)
-    elif cheating_probability <= 10.0:
-        cheating_probability = round(random.uniform(0, 30), 2)
-        not_cheating_probability = round(100 - cheating_probability, 2)
-    else:
-        cheating_probability = round(cheating_probability, 2)
-        not_cheating_probability = round(not_cheating_probability, 2)
-
-    # Return the modified probabilities
-    return {
-        "cheating_probability": cheating_probability,
-        "not_cheating_probability": not_cheating_probability
-    }
+    if not isinstance(loaded_model, CheatingPredictor):
+        # A single prediction is not worth compiling the model for
+        loaded_model = CheatingPredictor(loaded_model, compile=False)
+    return loaded_model.predict([features])[0]
@@ -0,0 +1,192 @@
+"""
+Exports the YOLO models for the ONNX Runtime and OpenVINO backends, optionally quantized to
+INT8, and checks their detections against the PyTorch model.
+
+Usage:
+    python export_models.py ./models/yolov8x.pt --backends onnx openvino
+    python export_models.py ./models/yolov8x.pt --backends onnx --int8 --calibration-images frames/*.jpg
+    python export_models.py ./models/yolov8x.pt --backends openvino --int8 --calibration-data frames.yaml
+    python export_models.py ./models/yolo_custom_model.pt --backends onnx --int8 --parity-only --images faces/*.jpg
+
+Exported models are written next to the weights, where model_backends.load_yolo looks for them.
+The exit status is 1 when a model fails the parity check.
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+from frame import Frame
+from model_backends import artifact_path, load_yolo
+
+IMAGE_SIZE = 640
+
+
+def preprocess(frame):
+    """The network input of a frame, letterboxed like the service does it, as a 1x3xHxW float array."""
+    img = cv2.cvtColor(frame.letterboxed(IMAGE_SIZE)[0], cv2.COLOR_BGR2RGB)
+    return (img.transpose(2, 0, 1)[None] / 255.0).astype(np.float32)
+
+
+def export_onnx_int8(weights, calibration_images):
+    """
+    Quantizes the FP32 ONNX model statically, calibrating the activations on real frames.
+
+    :return: Path of the INT8 model.
+    """
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    fp32_path = artifact_path(weights, "onnx", "fp32")
+    int8_path = artifact_path(weights, "onnx", "int8")
+    input_name = onnx.load(fp32_path, load_external_data=False).graph.input[0].name
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self._frames = iter(calibration_images)
+
+        def get_next(self):
+            path = next(self._frames, None)
+            return None if path is None else {input_name: preprocess(Frame.from_path(path))}
+
+    quantize_static(fp32_path, int8_path, FrameReader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+
+    # Ultralytics reads the class names and input size from the model metadata
+    fp32_model, int8_model = onnx.load(fp32_path), onnx.load(int8_path)
+    del int8_model.metadata_props[:]
+    int8_model.metadata_props.extend(fp32_model.metadata_props)
+    onnx.save(int8_model, int8_path)
+    return int8_path
+
+
+def export(weights, backend, int8, args):
+    """Exports one backend of a model, and its INT8 version when asked."""
+    model = YOLO(weights)
+    model.export(format=backend, dynamic=True, imgsz=IMAGE_SIZE)
+    if not int8:
+        return
+
+    if backend == "onnx":
+        if not args.calibration_images:
+            sys.exit("INT8 ONNX export needs --calibration-images")
+        export_onnx_int8(weights, args.calibration_images)
+    else:
+        # OpenVINO calibrates with NNCF on a dataset described by an Ultralytics data yaml
+        if not args.calibration_data:
+            sys.exit("INT8 OpenVINO export needs --calibration-data")
+        model.export(format="openvino", dynamic=True, imgsz=IMAGE_SIZE, int8=True, data=args.calibration_data)
+
+
+def box_iou(box, boxes):
+    top_left = np.maximum(box[:2], boxes[:, :2])
+    bottom_right = np.minimum(box[2:], boxes[:, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=1)
+    area = np.prod(box[2:] - box[:2])
+    areas = np.prod(boxes[:, 2:] - boxes[:, :2], axis=1)
+    return intersection / np.maximum(area + areas - intersection, 1e-9)
+
+
+def detections(model, frames):
+    """Detections of each frame as (x1, y1, x2, y2, confidence, class) rows, and the mean latency in ms."""
+    images = [frame.letterboxed(IMAGE_SIZE)[0] for frame in frames]
+    model(images[0], verbose=False)  # Warm up
+    start = time.perf_counter()
+    results = [model(img, verbose=False)[0].boxes.data.numpy() for img in images]
+    return results, (time.perf_counter() - start) * 1000 / len(images)
+
+
+def compare(reference, candidate, iou_threshold):
+    """
+    Matches the detections of a candidate model to those of the reference, frame by frame.
+
+    A reference detection is matched by the most confident unmatched candidate detection of the
+    same class overlapping it by at least iou_threshold.
+
+    :return: Dictionary with the recall of the reference detections, the share of candidate
+             detections without a match, the mean confidence difference of the matches and the
+             share of frames whose most confident class agrees.
+    """
+    matched = total = extra = candidates = top_agree = 0
+    confidence_differences = []
+    for expected, actual in zip(reference, candidate):
+        total += len(expected)
+        candidates += len(actual)
+        top_expected = int(expected[expected[:, 4].argmax(), 5]) if len(expected) else None
+        top_actual = int(actual[actual[:, 4].argmax(), 5]) if len(actual) else None
+        top_agree += top_expected == top_actual
+
+        used = np.zeros(len(actual), dtype=bool)
+        for box in expected:
+            if not len(actual):
+                break
+            overlap = box_iou(box[:4], actual[:, :4])
+            eligible = (~used) & (actual[:, 5] == box[5]) & (overlap >= iou_threshold)
+            if eligible.any():
+                best = np.flatnonzero(eligible)[actual[eligible, 4].argmax()]
+                used[best] = True
+                matched += 1
+                confidence_differences.append(abs(float(actual[best, 4] - box[4])))
+        extra += int((~used).sum())
+
+    return {
+        "recall": matched / total if total else 1.0,
+        "extra": extra / candidates if candidates else 0.0,
+        "confidence_difference": float(np.mean(confidence_differences)) if confidence_differences else 0.0,
+        "top_class_agreement": top_agree / len(reference) if reference else 1.0,
+    }
+
+
+def check_parity(weights, variants, images, args):
+    """Prints how close each exported model comes to PyTorch, returning False when one fails."""
+    frames = [Frame.from_path(path) for path in images]
+    reference, reference_ms = detections(load_yolo(weights), frames)
+    print(f"{os.path.basename(weights)} on {len(frames)} images, PyTorch {reference_ms:.1f} ms/image")
+    print("backend   precision  ms/image  speedup  recall  extra  conf_diff  top_class  result")
+
+    passed = True
+    for backend, precision in variants:
+        candidate, candidate_ms = detections(load_yolo(weights, backend, precision), frames)
+        parity = compare(reference, candidate, args.iou)
+        ok = parity["recall"] >= args.min_recall and parity["extra"] <= 1 - args.min_recall
+        passed = passed and ok
+        print(f"{backend:<9} {precision:<9}  {candidate_ms:8.1f}  {reference_ms / candidate_ms:7.2f}  "
+              f"{parity['recall']:6.3f}  {parity['extra']:5.3f}  {parity['confidence_difference']:9.4f}  "
+              f"{parity['top_class_agreement']:9.3f}  {'ok' if ok else 'FAIL'}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("weights", help="PyTorch weights, such as ./models/yolov8x.pt")
+    parser.add_argument("--backends", nargs="+", choices=["onnx", "openvino"], default=["onnx", "openvino"])
+    parser.add_argument("--int8", action="store_true", help="Also make INT8 models")
+    parser.add_argument("--calibration-images", nargs="+", help="Frames the INT8 ONNX activations are calibrated on")
+    parser.add_argument("--calibration-data", help="Ultralytics data yaml the INT8 OpenVINO model is calibrated on")
+    parser.add_argument("--images", nargs="+", help="Frames for the parity check, the calibration images by default")
+    parser.add_argument("--parity-only", action="store_true", help="Check already exported models without exporting")
+    parser.add_argument("--iou", type=float, default=0.5, help="Overlap for two detections to match")
+    parser.add_argument("--min-recall", type=float, default=0.95,
+                        help="Share of PyTorch detections an exported model must find")
+    args = parser.parse_args()
+
+    precisions = ["fp32", "int8"] if args.int8 else ["fp32"]
+    for backend in args.backends:
+        if not args.parity_only:
+            export(args.weights, backend, args.int8, args)
+    variants = [(backend, precision) for backend in args.backends for precision in precisions]
+
+    images = args.images or args.calibration_images
+    if not images:
+        print("No --images given, skipping the parity check")
+        return
+    if not check_parity(args.weights, variants, images, args):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,35 @@
-import face_recognition
-import cv2
 import os
 # from test import test
-from spoof_detector import is_real_image
+from face_pipeline import encode_real_face
+from frame import as_frame
+from face_locator import FaceLocator
 
-def extract_face_encodings(image_path,model):
+def extract_face_encodings(frame,model,face_locator=None,spoof_mode="full"):
     """
-    Extract face encodings from the given image path.
+    Extract face encodings from the given image.
     
-    :param image_path: Path to the image file.
+    :param frame: The image as a Frame, or a path to the image file.
+    :param face_locator: FaceLocator choosing the face detection strategy, full resolution by default.
+    :param spoof_mode: "full" runs the anti-spoof model on the whole image, "crop" on the face.
     :return: A tuple containing a success flag, encoding or error message.
     """
-    if not image_path:
+    if not frame:
         return False, "No image path provided"
 
-    if not os.path.exists(image_path):
+    frame = as_frame(frame)
+    if frame.path is not None and not os.path.exists(frame.path):
         return False, "Image not found"
 
-    try:
-        # Load the image
-        image = face_recognition.load_image_file(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Get face encodings
-        face_encodings = face_recognition.face_encodings(image)
+    face_locator = face_locator or FaceLocator()
 
-        if len(face_encodings) == 0:
-            return False, "No face detected"
-        
+    try:
+        # Anti-spoof check and face encoding run concurrently, the first failure wins
         # isReal = test(device_id=0,model_dir="./resources/anti_spoof_models",image_path=image_path)
-        isReal = is_real_image(image_path,model,threshold=0.5)
-        
-        if not isReal:
-            return False, "Fake face detected"
-            
-        face_encoding = face_encodings[0]
+        success, result = encode_real_face(frame, model, 0.5, face_locator, spoof_mode)
+        if not success:
+            return False, result
+
+        face_encoding = result[0]
 
         return True, face_encoding.tolist()
 
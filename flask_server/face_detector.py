@@ -1,5 +1,28 @@
 import cv2
 import mediapipe as mp
+import numpy as np
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# Face mesh landmark indices of the features used for proctoring
+LEFT_EYE = [33, 133, 160, 159, 158, 144, 145, 153]
+RIGHT_EYE = [362, 385, 387, 386, 374, 373, 390, 249]
+LEFT_IRIS = [468, 469, 470, 471, 472]  # Only available with refined landmarks
+RIGHT_IRIS = [473, 474, 475, 476, 477]
+LEFT_EYE_CORNERS = [33, 133]
+RIGHT_EYE_CORNERS = [362, 263]
+LIPS = [13, 14]
+NOSE = [1]
+
+LANDMARK_SUBSETS = {
+    "eyes": LEFT_EYE + RIGHT_EYE,
+    "iris": LEFT_IRIS + RIGHT_IRIS,
+    "lips": LIPS,
+    "nose": NOSE,
+}
 
 class FaceMeshDetector:
     def __init__(self, staticMode=False, maxFaces=2, refineLandmarks=True, minDetectionCon=0.5, minTrackingCon=0.5):
@@ -29,24 +52,139 @@ class FaceMeshDetector:
         )
         self.drawSpec = self.mpDraw.DrawingSpec(thickness=1, circle_radius=1, color=(0, 255, 0))
 
-    def findFaceMesh(self, img):
+    def findFaceMesh(self, img, imgRGB=None, landmarks=None):
         """
         Finds the face mesh landmarks in the given image.
 
         :param img: The image in which to find face mesh.
-        :return: The image with drawn face mesh and the list of detected face landmarks.
+        :param imgRGB: The same image in RGB order, when the caller already has it.
+        :param landmarks: Landmark indices to return, or a subset name from LANDMARK_SUBSETS.
+                          All landmarks are returned by default.
+        :return: The image and an int array of shape (faces, landmarks, 2) with the pixel
+                 coordinates of the landmarks, in the order they were requested.
         """
-        imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        if imgRGB is None:
+            imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        if isinstance(landmarks, str):
+            landmarks = LANDMARK_SUBSETS[landmarks]
         results = self.faceMesh.process(imgRGB)
+
+        ih, iw = img.shape[:2]
+        if not results.multi_face_landmarks:
+            return img, np.empty((0, len(landmarks) if landmarks is not None else 0, 2), dtype=int)
+
         faces = []
-        if results.multi_face_landmarks:
-            for facelandmarks in results.multi_face_landmarks:
-                face = []
-                for id, lm in enumerate(facelandmarks.landmark):
-                    ih, iw, ic = img.shape
-                    x, y = int(lm.x * iw), int(lm.y * ih)
-                    face.append([x, y])
-                faces.append(face)
-                # Draw the face mesh on the image
-                # self.mpDraw.draw_landmarks(img, facelandmarks, self.mpFaceMesh.FACEMESH_CONTOURS, self.drawSpec, self.drawSpec)
-        return img, faces
+        for facelandmarks in results.multi_face_landmarks:
+            points = facelandmarks.landmark
+            if landmarks is not None:
+                points = [points[i] for i in landmarks]
+            faces.append([(lm.x, lm.y) for lm in points])
+            # Draw the face mesh on the image
+            # self.mpDraw.draw_landmarks(img, facelandmarks, self.mpFaceMesh.FACEMESH_CONTOURS, self.drawSpec, self.drawSpec)
+
+        # Scale the normalized coordinates of every face in one operation
+        return img, (np.array(faces) * (iw, ih)).astype(int)
+
+    def close(self):
+        """
+        Releases the MediaPipe graph held by the detector.
+        """
+        self.faceMesh.close()
+
+
+class FaceMeshPool:
+    def __init__(self, maxSize=4, **detectorArgs):
+        """
+        Keeps long-lived FaceMeshDetector instances that request threads borrow and return.
+
+        Detectors are created on demand up to maxSize, so each concurrently running
+        worker thread ends up owning one graph instead of building a new one per request.
+
+        :param maxSize: Maximum number of detectors, normally the number of worker threads.
+        :param detectorArgs: Keyword arguments passed to FaceMeshDetector.
+        """
+        self.maxSize = maxSize
+        # Pooled detectors see unrelated images, so tracking between frames must stay off
+        detectorArgs.setdefault("staticMode", True)
+        self.detectorArgs = detectorArgs
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._borrows = 0
+        self._waitTime = 0.0
+        self._closed = False
+        self._pid = os.getpid()
+
+    @contextmanager
+    def borrow(self):
+        """
+        Borrows a detector for the duration of a with block.
+
+        :return: A FaceMeshDetector that is returned to the pool when the block exits.
+        """
+        start = time.perf_counter()
+        detector = self._acquire()
+        with self._lock:
+            self._borrows += 1
+            self._waitTime += time.perf_counter() - start
+        try:
+            yield detector
+        finally:
+            with self._lock:
+                closed = self._closed
+                if not closed:
+                    self._idle.put(detector)
+            if closed:
+                detector.close()
+
+    def _acquire(self):
+        if self._pid != os.getpid():
+            # Graphs built before a fork lost their threads, a forked worker builds its own
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._idle = queue.LifoQueue()
+                    self._created = 0
+                    self._pid = os.getpid()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Face mesh pool is closed")
+            create = self._created < self.maxSize
+            if create:
+                self._created += 1
+
+        if create:
+            return FaceMeshDetector(**self.detectorArgs)
+        # Every detector is in use, wait for one to be returned
+        return self._idle.get()
+
+    def stats(self):
+        """
+        Reports how the pool has been used.
+
+        :return: A dictionary with the number of detectors created, borrows and the mean wait.
+        """
+        with self._lock:
+            return {
+                "detectors": self._created,
+                "max_size": self.maxSize,
+                "borrows": self._borrows,
+                "mean_wait_ms": round(self._waitTime * 1000 / self._borrows, 3) if self._borrows else 0.0,
+            }
+
+    def close(self):
+        """
+        Closes every idle detector. Detectors borrowed at this point are closed when returned.
+        """
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
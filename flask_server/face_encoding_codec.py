@@ -0,0 +1,86 @@
+import base64
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+
+ENCODING_SIZE = 128
+
+
+def encode_encoding(encoding, encoding_format="list"):
+    """
+    Serializes a face encoding for a JSON response.
+
+    :param encoding: 128 value face encoding.
+    :param encoding_format: "list" for a list of floats, "base64" for base64 of little endian float32 values.
+    :return: A list or a base64 string.
+    """
+    if encoding_format == "base64":
+        return base64.b64encode(np.asarray(encoding, dtype="<f4").tobytes()).decode("ascii")
+    if encoding_format == "list":
+        return [float(value) for value in encoding]
+    raise ValueError(f"Unknown encoding format: {encoding_format}")
+
+
+def decode_encoding(value):
+    """
+    Parses a face encoding sent by a client.
+
+    :param value: A list of numbers, a JSON list in a string, a base64 string of little
+                  endian float32 values, or the raw float32 bytes.
+    :return: The encoding as a numpy array.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        encoding = np.frombuffer(value, dtype="<f4")
+    elif isinstance(value, str):
+        value = value.strip()
+        if value.startswith("["):
+            encoding = np.array(json.loads(value), dtype=np.float64)
+        else:
+            encoding = np.frombuffer(base64.b64decode(value, validate=True), dtype="<f4")
+    else:
+        encoding = np.asarray(value, dtype=np.float64)
+
+    if encoding.shape != (ENCODING_SIZE,):
+        raise ValueError(f"A face encoding must have {ENCODING_SIZE} values")
+    return encoding.astype(np.float64)
+
+
+class EncodingCache:
+    def __init__(self, max_size=10000):
+        """
+        Least recently used cache of known face encodings keyed by student id, so repeat
+        verifications do not have to resend the template.
+
+        :param max_size: Maximum number of encodings kept.
+        """
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, student_id):
+        with self._lock:
+            encoding = self._items.get(student_id)
+            if encoding is None:
+                self._misses += 1
+                return None
+            self._items.move_to_end(student_id)
+            self._hits += 1
+            return encoding
+
+    def put(self, student_id, encoding):
+        with self._lock:
+            self._items[student_id] = encoding
+            self._items.move_to_end(student_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def remove(self, student_id):
+        with self._lock:
+            self._items.pop(student_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._items), "max_size": self.max_size, "hits": self._hits, "misses": self._misses}
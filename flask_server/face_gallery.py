@@ -0,0 +1,349 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+ENCODING_SIZE = 128
+# Student ids are stored as fixed width byte strings next to the encodings
+ID_DTYPE = np.dtype("S64")
+# Rows scanned per step of an exact search, bounds the temporary memory of a query
+SEARCH_CHUNK = 65536
+# Blanked rows tolerated before the live rows are moved together, at least this many and a quarter of the gallery
+COMPACT_MIN_BLANK = 64
+
+
+def student_id_bytes(student_id):
+    """
+    The student id as stored in the gallery.
+
+    :raises ValueError: When the id is empty or does not fit the id field.
+    """
+    encoded = str(student_id).encode()
+    if not encoded:
+        raise ValueError("Student id is empty")
+    if len(encoded) > ID_DTYPE.itemsize:
+        raise ValueError(f"Student id is longer than {ID_DTYPE.itemsize} bytes")
+    return encoded
+
+
+class FaceGallery:
+    def __init__(self, directory, capacity=1024, approximate=False):
+        """
+        Persistent gallery of enrolled face encodings, one per student.
+
+        Encodings live in a memory mapped float32 matrix and student ids in a memory
+        mapped array beside it, so the gallery is never loaded into Python lists.
+        Removed and replaced rows are blanked and skipped by searches, and the live rows
+        are moved together once blanked rows make up a quarter of the gallery.
+
+        Several processes, such as gunicorn workers, can share a gallery directory. Every
+        change and search holds an exclusive lock on a file in the directory, and a process
+        reloads the row map when the generation in the metadata shows another one changed it.
+
+        :param directory: Directory holding the gallery files. Created when missing.
+        :param capacity: Number of rows allocated up front. The files double in size when full.
+        :param approximate: Use an approximate nearest neighbour index (needs faiss) for large galleries.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._lock_pid = None
+        self._lock_depth = 0
+
+        if approximate and faiss is None:
+            logger.warning("faiss is not installed, the face gallery falls back to exact search")
+        self.approximate = approximate and faiss is not None
+        self._index = None
+        # Rows removed since the index was built, excluded from its searches
+        self._removed = set()
+
+        self._generation = None
+        self._capacity = None
+        with self._locked():
+            if not os.path.exists(self._meta_path):
+                self._count = 0
+                self._generation = 0
+                self._resize(capacity)
+                self._save_meta()
+
+    @contextmanager
+    def _locked(self):
+        """Holds the gallery for this thread and, through a file lock, for this process."""
+        with self._lock:
+            if self._lock_pid != os.getpid():
+                # A lock file inherited through a fork is shared with the parent, flock would
+                # treat both as the same holder
+                self._lock_file = open(self._path("gallery.lock"), "a+")
+                self._lock_pid = os.getpid()
+                self._lock_depth = 0
+            if self._lock_depth == 0:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                if self._lock_depth == 1:
+                    self._refresh()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        # Called with the file lock held, picks up changes made by other processes
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path) as f:
+            meta = json.load(f)
+        if meta.get("generation", 0) == self._generation:
+            return
+        self._count = meta["count"]
+        self._generation = meta.get("generation", 0)
+        if meta["capacity"] != self._capacity:
+            self._open(meta["capacity"])
+
+        # Squared norms and the id to row map are rebuilt from the files
+        self._rows = {}
+        for row, student_id in enumerate(self._ids[:self._count]):
+            if student_id:
+                self._rows[student_id.decode()] = row
+        self._sq_norms = np.full(self._capacity, np.inf, dtype=np.float32)
+        rows = np.fromiter(self._rows.values(), dtype=np.int64)
+        self._sq_norms[rows] = np.einsum("ij,ij->i", self._encodings[rows], self._encodings[rows])
+        self._blanked = self._count - len(self._rows)
+        self._index = None
+        self._removed = set()
+
+    def _open(self, capacity):
+        self._encodings = np.memmap(self._path("encodings.f32"), dtype=np.float32, mode="r+",
+                                    shape=(capacity, ENCODING_SIZE))
+        self._ids = np.memmap(self._path("ids.bin"), dtype=ID_DTYPE, mode="r+", shape=(capacity,))
+        self._capacity = capacity
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _resize(self, capacity):
+        # The files are extended in place rather than replaced, so the memory maps of other
+        # processes stay valid until they reopen them at the new size
+        for name, row_size in (("encodings.f32", ENCODING_SIZE * 4), ("ids.bin", ID_DTYPE.itemsize)):
+            with open(self._path(name), "ab") as f:
+                f.truncate(capacity * row_size)
+        old_capacity = self._capacity or 0
+        self._open(capacity)
+        if old_capacity == 0:
+            self._rows = {}
+            self._sq_norms = np.full(capacity, np.inf, dtype=np.float32)
+            self._blanked = 0
+        else:
+            self._sq_norms = np.concatenate([self._sq_norms, np.full(capacity - old_capacity, np.inf,
+                                                                     dtype=np.float32)])
+
+    def _grow(self):
+        self._resize(self._capacity * 2)
+
+    def _save_meta(self):
+        # Called with the file lock held, after every change, so other processes see it
+        self._encodings.flush()
+        self._ids.flush()
+        self._generation += 1
+        temporary = self._meta_path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"count": self._count, "capacity": self._capacity, "generation": self._generation}, f)
+        os.replace(temporary, self._meta_path)
+
+    def __len__(self):
+        with self._locked():
+            return len(self._rows)
+
+    def __contains__(self, student_id):
+        with self._locked():
+            return student_id in self._rows
+
+    def add(self, student_id, encoding):
+        """
+        Adds the encoding of a student, replacing the one stored before.
+
+        :param student_id: Id of the student.
+        :param encoding: 128 value face encoding.
+        :raises ValueError: When the student id is empty or longer than the id field.
+        """
+        encoded_id = student_id_bytes(student_id)
+        student_id = encoded_id.decode()
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_SIZE)
+        with self._locked():
+            self._blank(student_id)
+            self._compact_if_needed()
+            if self._count == self._capacity:
+                # Freeing blanked rows is cheaper than doubling the files, when enough are blanked
+                if self._blanked >= self._capacity // 4:
+                    self.compact()
+                else:
+                    self._grow()
+
+            row = self._count
+            self._encodings[row] = encoding
+            self._ids[row] = encoded_id
+            self._count += 1
+            self._sq_norms[row] = encoding @ encoding
+            self._rows[student_id] = row
+            if self._index is not None:
+                self._index.add_with_ids(encoding[None, :], np.array([row], dtype=np.int64))
+            self._save_meta()
+
+    def add_unless_duplicate(self, student_id, encoding, threshold):
+        """
+        Adds the encoding of a student unless the face belongs to another enrolled student,
+        checking and adding under one lock so two registrations of a face cannot both pass.
+
+        :param student_id: Id of the student.
+        :param encoding: 128 value face encoding.
+        :param threshold: Maximum distance of a match.
+        :return: The (student_id, distance) tuple of the other student, or None when the encoding was added.
+        :raises ValueError: When the student id is empty or longer than the id field.
+        """
+        student_id = student_id_bytes(student_id).decode()
+        with self._locked():
+            duplicate = self.find_duplicate(encoding, threshold, exclude=student_id)
+            if duplicate is None:
+                self.add(student_id, encoding)
+            return duplicate
+
+    def remove(self, student_id):
+        """
+        Removes the encoding of a student.
+
+        :param student_id: Id of the student.
+        :return: True when the student was in the gallery.
+        """
+        with self._locked():
+            removed = self._blank(student_id)
+            if removed:
+                self._compact_if_needed()
+                self._save_meta()
+            return removed
+
+    def _blank(self, student_id):
+        row = self._rows.pop(student_id, None)
+        if row is None:
+            return False
+        self._ids[row] = b""
+        self._encodings[row] = 0
+        self._sq_norms[row] = np.inf  # Never the nearest row again
+        self._blanked += 1
+        if self._index is not None:
+            self._removed.add(row)
+        return True
+
+    def _compact_if_needed(self):
+        if self._blanked >= max(COMPACT_MIN_BLANK, len(self._rows) // 4):
+            self.compact()
+
+    def compact(self):
+        """Moves the live rows together at the start of the files, freeing the rows of removed encodings."""
+        with self._locked():
+            live = np.sort(np.fromiter(self._rows.values(), dtype=np.int64))
+            count = len(live)
+            # A crash part way leaves a student in two rows with the same encoding, the later one
+            # is used on startup, so the files stay usable without a journal
+            self._encodings[:count] = self._encodings[live]
+            self._ids[:count] = self._ids[live]
+            self._sq_norms[:count] = self._sq_norms[live]
+            self._encodings[count:self._count] = 0
+            self._ids[count:self._count] = b""
+            self._sq_norms[count:] = np.inf
+            self._rows = {student_id.decode(): row for row, student_id in enumerate(self._ids[:count])}
+            self._count = count
+            self._blanked = 0
+            # Row numbers changed, the index is rebuilt on the next search
+            self._index = None
+            self._removed = set()
+            self._save_meta()
+
+    def query(self, encoding, k=5, threshold=None):
+        """
+        Finds the enrolled students closest to an encoding.
+
+        :param encoding: 128 value face encoding.
+        :param k: Maximum number of matches.
+        :param threshold: Only return matches at most this distance away.
+        :return: List of (student_id, distance) tuples, nearest first.
+        """
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_SIZE)
+        with self._locked():
+            if not self._rows:
+                return []
+            if self.approximate:
+                rows, distances = self._search_index(encoding, k)
+            else:
+                rows, distances = self._search_exact(encoding, k)
+            matches = [(self._ids[row].decode(), float(distance)) for row, distance in zip(rows, distances)
+                       if np.isfinite(distance) and self._ids[row]]
+
+        if threshold is not None:
+            matches = [match for match in matches if match[1] <= threshold]
+        return matches
+
+    def _search_exact(self, encoding, k):
+        # |x - q|^2 = |x|^2 - 2 x.q + |q|^2, one matrix vector product per chunk
+        best_rows = np.empty(0, dtype=np.int64)
+        best_sq = np.empty(0, dtype=np.float32)
+        for start in range(0, self._count, SEARCH_CHUNK):
+            chunk = self._encodings[start:min(start + SEARCH_CHUNK, self._count)]
+            sq = self._sq_norms[start:start + len(chunk)] - 2 * (chunk @ encoding) + encoding @ encoding
+            rows = np.arange(start, start + len(chunk))
+            if len(sq) > k:
+                keep = np.argpartition(sq, k)[:k]
+                sq, rows = sq[keep], rows[keep]
+            best_rows = np.concatenate([best_rows, rows])
+            best_sq = np.concatenate([best_sq, sq])
+
+        order = np.argsort(best_sq)[:k]
+        return best_rows[order], np.sqrt(np.maximum(best_sq[order], 0))
+
+    def _search_index(self, encoding, k):
+        # HNSW graphs cannot drop vectors, so removed rows are filtered out of searches
+        # until so many accumulate that rebuilding is cheaper
+        if self._index is None or len(self._removed) > max(1000, len(self._rows) // 10):
+            self._build_index()
+        params = None
+        if self._removed:
+            removed = faiss.IDSelectorBatch(np.fromiter(self._removed, dtype=np.int64))
+            keep = faiss.IDSelectorNot(removed)
+            params = faiss.SearchParametersHNSW(sel=keep)
+        sq, rows = self._index.search(encoding[None, :], k, params=params)
+        found = rows[0] >= 0
+        return rows[0][found], np.sqrt(np.maximum(sq[0][found], 0))
+
+    def _build_index(self):
+        index = faiss.IndexIDMap(faiss.IndexHNSWFlat(ENCODING_SIZE, 32))
+        rows = np.fromiter(self._rows.values(), dtype=np.int64)
+        if len(rows):
+            index.add_with_ids(np.ascontiguousarray(self._encodings[rows]), rows)
+        self._index = index
+        self._removed = set()
+
+    def find_duplicate(self, encoding, threshold, exclude=None):
+        """
+        Finds another enrolled student whose face matches an encoding.
+
+        :param encoding: 128 value face encoding.
+        :param threshold: Maximum distance of a match.
+        :param exclude: Student id to ignore, normally the student registering.
+        :return: A (student_id, distance) tuple, or None when there is no match.
+        """
+        for student_id, distance in self.query(encoding, k=2, threshold=threshold):
+            if student_id != exclude:
+                return student_id, distance
+        return None
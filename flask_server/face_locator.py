@@ -0,0 +1,115 @@
+import threading
+import face_recognition
+import numpy as np
+
+FACE_DETECTION_STRATEGIES = ("full", "downscaled", "reuse")
+
+# face_recognition shares one dlib HOG detector, which returns wrong faces or crashes when two
+# threads run it at once, so every detection goes through this lock
+_detector_lock = threading.Lock()
+# It shares one landmark predictor and one ResNet encoder too. dlib keeps the outputs of each layer
+# in the network object and does not promise it is thread safe, so encodings go through their own
+# lock, a separate one so one thread can detect while another encodes
+_encoder_lock = threading.Lock()
+
+
+def face_locations(img, upsample=1):
+    with _detector_lock:
+        return face_recognition.face_locations(img, number_of_times_to_upsample=upsample)
+
+
+def face_encodings(img, locations):
+    with _encoder_lock:
+        return face_recognition.face_encodings(img, known_face_locations=locations)
+
+
+def encoder_face_locations(img):
+    """
+    The faces face_encodings finds when it is given no locations, with boxes that may extend past
+    the image, unlike face_locations, so passing them back gives the very same encodings.
+    """
+    with _detector_lock:
+        rects = face_recognition.api._raw_face_locations(img)
+    return [face_recognition.api._rect_to_css(rect) for rect in rects]
+
+
+class FaceLocator:
+    def __init__(self, strategy="full", max_side=800, upsample=1):
+        """
+        Finds faces for face_recognition encodings with a selectable detection strategy.
+
+        :param strategy: "full" runs the HOG detector on the full resolution image,
+                         "downscaled" runs it on a copy shrunk to max_side and maps the boxes back,
+                         "reuse" takes the face box found by an already run detector and falls
+                         back to "downscaled" when there is none.
+        :param max_side: Longest side of the image the downscaled detector runs on.
+        :param upsample: How many times the HOG detector upsamples the image. Higher finds smaller faces.
+        """
+        if strategy not in FACE_DETECTION_STRATEGIES:
+            raise ValueError(f"Unknown face detection strategy: {strategy}")
+        self.strategy = strategy
+        self.max_side = max_side
+        self.upsample = upsample
+
+    @property
+    def reuses_face_box(self):
+        """True when the caller should run its own face detector first and pass the box."""
+        return self.strategy == "reuse"
+
+    def locate(self, frame, face_box=None):
+        """
+        Finds the faces in a frame.
+
+        :param frame: The Frame to search.
+        :param face_box: (x1, y1, x2, y2) box of a face found by another detector, used by "reuse".
+        :return: List of (top, right, bottom, left) face locations in full image coordinates,
+                 or None when detection is left to the encoder, as it was before strategies existed.
+        """
+        if self.strategy == "reuse" and face_box is not None:
+            x1, y1, x2, y2 = (int(round(value)) for value in face_box[:4])
+            return [(y1, x2, y2, x1)]
+        if self.strategy == "full":
+            if self.upsample == 1:
+                return None
+            return face_locations(frame.bgr, self.upsample)
+
+        img, scale = frame.downscaled(self.max_side)
+        locations = face_locations(img, self.upsample)
+        return [tuple(int(round(value / scale)) for value in location) for location in locations]
+
+    def find(self, frame):
+        """
+        Finds the faces in a frame, running the detector even where locate leaves it to the encoder.
+
+        :param frame: The Frame to search.
+        :return: List of (top, right, bottom, left) face locations in full image coordinates.
+        """
+        locations = self.locate(frame)
+        if locations is None:
+            # What face_encodings would have detected on its own
+            return encoder_face_locations(frame.bgr)
+        return locations
+
+    def encode(self, frame, face_box=None, locations=None):
+        """
+        Computes the face encodings of a frame.
+
+        :param frame: The Frame to encode.
+        :param face_box: Face box of another detector, see locate.
+        :param locations: Face locations already found with find, so the detector does not run again.
+        :return: List of 128 value face encodings, one per face.
+        """
+        if locations is None:
+            locations = self.locate(frame, face_box)
+        if locations is None:
+            # Detected here rather than inside face_encodings, so detection and encoding each hold their own lock
+            locations = encoder_face_locations(frame.bgr)
+        # The encoder has always been given BGR ordered pixels here, keep that so
+        # stored encodings stay comparable
+        return face_encodings(frame.bgr, locations)
+
+    def warm_up(self):
+        """Runs the detector and the encoder once on a blank image, so the first request does not pay their setup."""
+        blank = np.zeros((160, 160, 3), dtype=np.uint8)
+        face_locations(blank, self.upsample)
+        face_encodings(blank, [(20, 140, 140, 20)])
@@ -0,0 +1,99 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from result_cache import ResultCache
+from spoof_detector import detect_spoof, spoof_verdict
+
+# Shared by every request, the anti-spoof model and the dlib encoder both release the GIL
+executor = ThreadPoolExecutor(max_workers=int(os.getenv('FACE_CHECK_WORKERS', 8)),
+                              thread_name_prefix="face-check")
+
+# What the checks found in recently seen images, so a retry with the same image skips the models.
+# Each inference worker process keeps its own.
+result_cache = ResultCache(max_bytes=int(float(os.getenv('FACE_RESULT_CACHE_MB', 32)) * 1024 * 1024),
+                           ttl=float(os.getenv('FACE_RESULT_CACHE_TTL', 600)))
+
+
+def cache_key(frame, face_locator, spoof_mode):
+    """
+    Key of the cached results of an image, None when the cache is disabled.
+
+    The detection settings and the spoof mode are part of it. The anti-spoof threshold and the
+    known encoding a face is compared to are not, they are applied to the cached values on every
+    request. Neither is the anti-spoof model, there is only the one loaded at startup.
+    """
+    if not result_cache.enabled:
+        return None
+    return frame.digest, face_locator.strategy, face_locator.max_side, face_locator.upsample, spoof_mode
+
+
+def cached_or_submit(key, cached, field, function, *args, **kwargs):
+    """A future of the cached value of a field, or of the function run on the executor, whose result is cached."""
+    if field in cached:
+        future = Future()
+        future.set_result(cached[field])
+        return future
+
+    def store(done):
+        if not done.cancelled() and done.exception() is None:
+            result_cache.put(key, field, done.result())
+
+    future = executor.submit(function, *args, **kwargs)
+    future.add_done_callback(store)
+    return future
+
+
+def encode_real_face(frame, model, threshold, face_locator, spoof_mode="full"):
+    """
+    Computes the face encodings of a frame and checks that the face is not a spoof.
+
+    The anti-spoof check and the encoding run at the same time, and whichever fails first
+    ends the request without waiting for the other. With the "reuse" detection strategy
+    the encoder needs the anti-spoof face box, so the two run one after the other. In the
+    "crop" spoof mode the face is found first and the anti-spoof model only sees a crop of it.
+    Results already computed for the same image content are taken from result_cache.
+
+    :param frame: The Frame to check.
+    :param model: Anti-spoof model.
+    :param threshold: Confidence threshold of the anti-spoof model.
+    :param face_locator: FaceLocator choosing the face detection strategy.
+    :param spoof_mode: "full" runs the anti-spoof model on the whole image, "crop" on the face.
+    :return: A tuple containing a success flag, the list of encodings or an error message.
+    """
+    key = cache_key(frame, face_locator, spoof_mode)
+    cached = result_cache.get(key)
+
+    if face_locator.reuses_face_box:
+        # The anti-spoof model finds the face anyway, run it first and reuse its box
+        detections = cached_or_submit(key, cached, "spoof", detect_spoof, frame, model).result()
+        is_real, face_box = spoof_verdict(detections, threshold, return_box=True)
+        if not is_real:
+            return False, "Fake face detected"
+        # The box depends on the threshold, so do the encodings
+        field = ("encodings", tuple(float(value) for value in face_box))
+        face_encodings = cached_or_submit(key, cached, field, face_locator.encode, frame, face_box).result()
+        if len(face_encodings) == 0:
+            return False, "No face detected"
+        return True, list(face_encodings)
+
+    if spoof_mode == "crop":
+        # The face the encoding is taken from is the one the anti-spoof model looks at
+        locations = cached_or_submit(key, cached, "locations", face_locator.find, frame).result()
+        if not locations:
+            return False, "No face detected"
+        spoof_check = cached_or_submit(key, cached, "spoof", detect_spoof, frame, model, locations[0])
+        encoding = cached_or_submit(key, cached, "encodings", face_locator.encode, frame, locations=locations)
+    else:
+        if "spoof" not in cached or "encodings" not in cached:
+            frame.bgr  # Decode once here rather than racing to do it in both tasks
+        spoof_check = cached_or_submit(key, cached, "spoof", detect_spoof, frame, model)
+        encoding = cached_or_submit(key, cached, "encodings", face_locator.encode, frame)
+
+    for future in as_completed([spoof_check, encoding]):
+        if future is spoof_check and not spoof_verdict(future.result(), threshold):
+            encoding.cancel()
+            return False, "Fake face detected"
+        if future is encoding and len(future.result()) == 0:
+            spoof_check.cancel()
+            return False, "No face detected"
+
+    return True, list(encoding.result())
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import cv2
+import numpy as np
+
+# Fill color used by YOLO for letterbox padding
+LETTERBOX_COLOR = (114, 114, 114)
+
+
+class Frame:
+    def __init__(self, path=None, data=None, name=None):
+        """
+        An image that is decoded once and shared by every stage of a request.
+
+        Resized and color converted variants are built on first use and cached,
+        so stages that need the same variant do not repeat the work.
+
+        :param path: Path to the image file.
+        :param data: Encoded image bytes, used instead of a path.
+        :param name: Name of the image, defaults to the file name of the path.
+        """
+        if path is None and data is None:
+            raise ValueError("A frame needs either a path or image data")
+        self.path = path
+        self.data = data
+        self.name = name or (os.path.basename(path) if path else None)
+        self._variants = {}
+
+    @classmethod
+    def from_path(cls, path):
+        return cls(path=path)
+
+    @classmethod
+    def from_bytes(cls, data, name=None):
+        return cls(data=data, name=name)
+
+    @property
+    def bgr(self):
+        """The decoded image in BGR order. Callers must copy it before drawing on it."""
+        if "bgr" not in self._variants:
+            if self.data is not None:
+                img = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            else:
+                img = cv2.imread(self.path)
+            if img is None:
+                raise ValueError(f"Could not decode image {self.name or ''}".strip())
+            self._variants["bgr"] = img
+        return self._variants["bgr"]
+
+    @property
+    def rgb(self):
+        """The decoded image in RGB order."""
+        if "rgb" not in self._variants:
+            self._variants["rgb"] = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+        return self._variants["rgb"]
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    def letterboxed(self, size=640):
+        """
+        The BGR image resized to fit a size x size square and padded the way YOLO expects.
+
+        :param size: Side of the square in pixels.
+        :return: The letterboxed image, the resize scale and the (x, y) padding.
+        """
+        key = ("letterboxed", size)
+        if key not in self._variants:
+            h, w = self.bgr.shape[:2]
+            scale = min(size / h, size / w)
+            new_w, new_h = round(w * scale), round(h * scale)
+            resized = self.bgr if (new_w, new_h) == (w, h) else \
+                cv2.resize(self.bgr, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+            pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+            img = cv2.copyMakeBorder(resized, pad_y, size - new_h - pad_y, pad_x, size - new_w - pad_x,
+                                     cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+            self._variants[key] = (img, scale, (pad_x, pad_y))
+        return self._variants[key]
+
+    def unletterbox(self, boxes, size=640):
+        """
+        Maps boxes detected on the letterboxed image back to the original image.
+
+        :param boxes: Array of detections whose first four columns are x1, y1, x2, y2.
+        :param size: Side of the square the boxes were detected on.
+        :return: A copy of the boxes in original image coordinates.
+        """
+        _, scale, (pad_x, pad_y) = self.letterboxed(size)
+        h, w = self.bgr.shape[:2]
+        boxes = np.array(boxes, dtype=np.float32, copy=True)
+        if len(boxes):
+            boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad_x) / scale).clip(0, w)
+            boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad_y) / scale).clip(0, h)
+        return boxes
+
+    def downscaled(self, max_side=640):
+        """
+        The BGR image shrunk so that its longest side is at most max_side, for face detection.
+
+        :param max_side: Longest side of the result in pixels.
+        :return: The downscaled image and the scale from original to downscaled coordinates.
+        """
+        key = ("downscaled", max_side)
+        if key not in self._variants:
+            h, w = self.bgr.shape[:2]
+            scale = min(1.0, max_side / max(h, w))
+            if scale == 1.0:
+                self._variants[key] = (self.bgr, 1.0)
+            else:
+                img = cv2.resize(self.bgr, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+                self._variants[key] = (img, scale)
+        return self._variants[key]
+
+    def thumbnail(self, size=32):
+        """
+        A tiny grayscale copy of the image for cheap frame comparisons.
+
+        :param size: Side of the square thumbnail in pixels.
+        :return: A size x size uint8 grayscale image.
+        """
+        key = ("thumbnail", size)
+        if key not in self._variants:
+            img, _ = self.downscaled(size * 8)
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            self._variants[key] = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+        return self._variants[key]
+
+    @property
+    def digest(self):
+        """Hash of the encoded image bytes, the same for every upload of the same file."""
+        if "digest" not in self._variants:
+            data = self.data
+            if data is None:
+                with open(self.path, "rb") as f:
+                    data = f.read()
+            self._variants["digest"] = hashlib.blake2b(data, digest_size=16).hexdigest()
+        return self._variants["digest"]
+
+
+def as_frame(image):
+    """
+    Wraps an image path in a Frame, passing existing frames through unchanged.
+
+    :param image: A Frame or a path to an image file.
+    :return: A Frame.
+    """
+    if isinstance(image, Frame):
+        return image
+    return Frame.from_path(image)
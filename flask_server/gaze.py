@@ -0,0 +1,69 @@
+import numpy as np
+from utils import detect_pupil
+
+GAZE_MODES = ("landmarks", "contour")
+
+# Iris position between the eye corners, as a fraction of the eye width, past which an eye
+# counts as looking to that side
+GAZE_LEFT_RATIO = 0.40
+GAZE_RIGHT_RATIO = 0.60
+
+
+def landmark_gaze(eye_corners, iris_centers, left_ratio=GAZE_LEFT_RATIO, right_ratio=GAZE_RIGHT_RATIO):
+    """
+    Estimates the gaze direction from the iris landmarks of the refined face mesh.
+
+    Only arithmetic on landmarks that were already computed, no image processing.
+
+    :param eye_corners: Array of shape (eyes, 2, 2) with the two corner points of each eye.
+    :param iris_centers: Array of shape (eyes, 2) with the iris centre of each eye.
+    :param left_ratio: Eyes whose iris is left of this fraction of the eye width look left.
+    :param right_ratio: Eyes whose iris is right of this fraction of the eye width look right.
+    :return: "left", "right" or "center", and the iris position ratio of each eye.
+    """
+    corner_x = eye_corners[..., 0]
+    low, high = corner_x.min(axis=1), corner_x.max(axis=1)
+    ratios = (iris_centers[:, 0] - low) / np.maximum(high - low, 1)
+
+    # Like the contour search, both eyes have to agree before the gaze leaves the centre
+    if (ratios < left_ratio).all():
+        return "left", ratios
+    if (ratios > right_ratio).all():
+        return "right", ratios
+    return "center", ratios
+
+
+def contour_gaze(img, left_eye_points, right_eye_points):
+    """
+    Estimates the gaze direction by searching for the pupil contour in each eye crop.
+
+    :param img: The BGR image.
+    :param left_eye_points: Array of the left eye landmark points.
+    :param right_eye_points: Array of the right eye landmark points.
+    :return: "left", "right" or "center", and the pupil centres found, in image coordinates.
+    """
+    # Detect pupils in eye images, cropped to the bounding box of each eye
+    left_eye_x, left_eye_y = left_eye_points.min(axis=0).tolist()
+    left_eye_x2, left_eye_y2 = left_eye_points.max(axis=0).tolist()
+    right_eye_x, right_eye_y = right_eye_points.min(axis=0).tolist()
+    right_eye_x2, right_eye_y2 = right_eye_points.max(axis=0).tolist()
+    left_eye_img = img[left_eye_y:left_eye_y2, left_eye_x:left_eye_x2]
+    right_eye_img = img[right_eye_y:right_eye_y2, right_eye_x:right_eye_x2]
+
+    left_pupil = detect_pupil(left_eye_img)
+    right_pupil = detect_pupil(right_eye_img)
+
+    pupils = []
+    if left_pupil:
+        pupils.append((left_eye_x + left_pupil[0], left_eye_y + left_pupil[1]))
+    if right_pupil:
+        pupils.append((right_eye_x + right_pupil[0], right_eye_y + right_pupil[1]))
+
+    # Determine gaze direction based on pupil position
+    gaze_direction = "center"
+    if left_pupil and right_pupil:
+        if left_pupil[0] < left_eye_img.shape[1] // 2 and right_pupil[0] < right_eye_img.shape[1] // 2:
+            gaze_direction = "left"
+        elif left_pupil[0] > left_eye_img.shape[1] // 2 and right_pupil[0] > right_eye_img.shape[1] // 2:
+            gaze_direction = "right"
+    return gaze_direction, pupils
@@ -0,0 +1,464 @@
+import heapq
+import itertools
+import logging
+import math
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing.connection import wait
+from multiprocessing.reduction import ForkingPickler
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first. Interactive jobs, such as the face check of a student
+# logging in, are dispatched before any waiting background job, such as a proctoring frame.
+PRIORITY_CLASSES = ("interactive", "background")
+
+
+class JobExpired(RuntimeError):
+    """The deadline of a job passed before a worker was free to run it."""
+
+
+class JobTimedOut(JobExpired):
+    """The job did not finish within the timeout of the pool, the worker running it is restarted."""
+
+
+class JobPreempted(RuntimeError):
+    """A waiting job was dropped from a full queue to make room for a more urgent one."""
+
+
+def _worker_main(initializer, initargs, connection):
+    try:
+        handlers = initializer(*initargs)
+    except Exception as e:
+        connection.send(("failed", None, f"Worker failed to start: {e}"))
+        return
+    connection.send(("ready", None, os.getpid()))
+
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            # The pool went away without stopping the worker
+            break
+        if job is None:
+            break
+        job_id, name, args, kwargs = job
+        started = time.perf_counter()
+        try:
+            result = ("done", handlers[name](*args, **kwargs))
+        except Exception as e:
+            result = ("error", f"{type(e).__name__}: {e}")
+        run_ms = (time.perf_counter() - started) * 1000
+        try:
+            connection.send((result[0], job_id, (result[1], run_ms)))
+        except (TypeError, AttributeError, pickle.PicklingError) as e:
+            connection.send(("error", job_id, (f"Result could not be sent back: {e}", run_ms)))
+
+    # Worker processes skip atexit handlers, so the worker releases its resources itself
+    if "close" in handlers:
+        handlers["close"]()
+
+
+class InferencePool:
+    def __init__(self, initializer, initargs=(), workers=2, max_queue=32, start_method="spawn", stats_window=1000,
+                 job_timeout=120):
+        """
+        Runs inference jobs on worker processes that each own their models, so the GIL-bound
+        parts of the analysis use every core instead of one.
+
+        Waiting jobs are kept in this process and handed to a worker only when it is free,
+        most urgent priority class first, so a login never waits behind queued proctoring
+        frames. Jobs whose deadline passed while waiting are dropped without running. When
+        the queue is full, a job either takes the place of a waiting job of a less urgent
+        class, or submit returns None straight away so the request can be refused instead
+        of waiting behind everyone else.
+
+        Each worker talks to this process over its own pipe, and this process records the job
+        it sent to each worker, so the job of a worker that crashed or is stopped for taking
+        too long is always known and failed, and stopping a worker cannot damage a queue the
+        other workers use.
+
+        :param initializer: Module level function called in each worker as initializer(*initargs).
+                            Loads the models and returns a dictionary of job names to functions.
+                            A "close" function, if present, runs when the worker stops.
+        :param initargs: Picklable arguments of the initializer.
+        :param workers: Number of worker processes.
+        :param max_queue: Maximum number of jobs waiting for a free worker.
+        :param start_method: Multiprocessing start method. "spawn" starts the workers from a clean
+                             interpreter, without the threads and models of the web process.
+        :param stats_window: Number of recent jobs kept for statistics and the Retry-After estimate.
+        :param job_timeout: Seconds run waits for a job from submission to result, None waits as long
+                            as it takes. A job still waiting by then is dropped, and the worker of a
+                            job still running is stopped and replaced, as it is likely stuck.
+        """
+        self.initializer = initializer
+        self.initargs = initargs
+        self.workers = workers
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self._context = multiprocessing.get_context(start_method)
+
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+        # Waiting jobs as a heap of (priority rank, job id, job), and the futures of all unfinished jobs
+        self._queued = []
+        self._pending = {}
+        self._ready = set()
+        self._broken = set()
+        self._durations = deque(maxlen=stats_window)
+        self._classes = {priority: {"waits": deque(maxlen=stats_window), "submitted": 0, "rejected": 0,
+                                    "preempted": 0, "expired": 0, "timed_out": 0}
+                         for priority in PRIORITY_CLASSES}
+        self._completed = 0
+        self._failed = 0
+        self._restarts = 0
+        self._pid = None
+        self._closed = False
+
+    def start(self):
+        """Starts the worker processes, once per process using the pool."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A pool inherited through a fork belongs to the parent, this process starts its own
+            self._queued = []
+            self._pending = {}
+            self._ready = set()
+            self._broken = set()
+            self._processes = [None] * self.workers
+            self._connections = [None] * self.workers
+            # Id of the job sent to each worker and not answered yet
+            self._running = [None] * self.workers
+            for index in range(self.workers):
+                self._start_worker(index)
+            self._collector = threading.Thread(target=self._collect, daemon=True, name="inference-results")
+            self._collector.start()
+            self._pid = os.getpid()
+
+    def _start_worker(self, index):
+        # Called with the lock held
+        connection, worker_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main, name=f"inference-worker-{index}", daemon=True,
+            args=(self.initializer, self.initargs, worker_connection),
+        )
+        process.start()
+        # Only the worker keeps its end open, so this process reads EOF when the worker dies
+        worker_connection.close()
+        self._processes[index] = process
+        self._connections[index] = connection
+        self._running[index] = None
+
+    def submit(self, name, *args, priority="background", deadline=None, **kwargs):
+        """
+        Queues a job for the next free worker.
+
+        :param name: Name of the job, as returned by the initializer.
+        :param priority: Priority class of the job, one of PRIORITY_CLASSES.
+        :param deadline: Unix time after which the result is of no use, None waits as long as it takes.
+        :return: A Future with the result of the job, or None when the queue is full. The future
+                 raises JobExpired or JobPreempted when the job was dropped before running.
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class: {priority}")
+        self.start()
+        future = Future()
+        rank = PRIORITY_CLASSES.index(priority)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Inference pool is closed")
+            counts = self._classes[priority]
+            counts["submitted"] += 1
+            if deadline is not None and time.time() >= deadline:
+                counts["expired"] += 1
+                future.set_exception(JobExpired("Deadline passed before the job was queued"))
+                return future
+
+            if len(self._queued) >= self.max_queue:
+                # The oldest waiting job of the least urgent class makes room, if it is less urgent
+                worst_rank = max((entry[0] for entry in self._queued), default=None)
+                victim = min((entry for entry in self._queued if entry[0] == worst_rank), default=None)
+                if victim is None or worst_rank <= rank:
+                    counts["rejected"] += 1
+                    return None
+                self._queued.remove(victim)
+                heapq.heapify(self._queued)
+                self._drop(victim[2], JobPreempted("Dropped for a more urgent job, retry later"), "preempted")
+
+            job_id = next(self._job_ids)
+            job = {"id": job_id, "name": name, "args": args, "kwargs": kwargs, "priority": priority,
+                   "deadline": deadline, "submitted": time.perf_counter()}
+            self._pending[job_id] = (future, job)
+            heapq.heappush(self._queued, (rank, job_id, job))
+            self._dispatch()
+        return future
+
+    def run(self, name, *args, priority="background", deadline=None, **kwargs):
+        """
+        Runs a job and waits for its result, at most job_timeout seconds.
+
+        :return: The result of the job, or None when the queue is full.
+        :raises JobExpired: When the deadline passed before a worker was free.
+        :raises JobTimedOut: When the job did not finish within job_timeout.
+        :raises JobPreempted: When the job made room for a more urgent one.
+        :raises RuntimeError: When the job failed in the worker.
+        """
+        future = self.submit(name, *args, priority=priority, deadline=deadline, **kwargs)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=self.job_timeout)
+        except FutureTimeoutError:
+            self._time_out(future)
+            raise JobTimedOut(f"Job did not finish within {self.job_timeout} seconds")
+
+    def _time_out(self, future):
+        with self._lock:
+            entry = next(((job_id, job) for job_id, (pending, job) in self._pending.items() if pending is future), None)
+            if entry is None:
+                # Finished after all, but too late for the caller
+                return
+            job_id, job = entry
+            self._pending.pop(job_id)
+            self._classes[job["priority"]]["timed_out"] += 1
+            future.cancel()
+            waiting = next((queued for queued in self._queued if queued[1] == job_id), None)
+            if waiting is not None:
+                self._queued.remove(waiting)
+                heapq.heapify(self._queued)
+                return
+            # The worker keeps the job as its running one, so it gets no other job before it is
+            # replaced, and the signal is sent with the lock held, so it cannot hit a later job
+            if job_id not in self._running:
+                return
+            index = self._running.index(job_id)
+            logger.warning("Inference job %s timed out, stopping worker %d", job["name"], index)
+            self._processes[index].terminate()
+
+    def _dispatch(self):
+        # Called with the lock held. Each ready worker gets at most one job at a time, so the
+        # order of the waiting jobs is decided here rather than by the worker.
+        while self._queued:
+            index = next((index for index in sorted(self._ready) if self._running[index] is None), None)
+            if index is None:
+                return
+            entry = heapq.heappop(self._queued)
+            _, job_id, job = entry
+            if job["deadline"] is not None and time.time() >= job["deadline"]:
+                self._drop(job, JobExpired("Deadline passed before a worker was free"), "expired")
+                continue
+            try:
+                message = ForkingPickler.dumps((job_id, job["name"], job["args"], job["kwargs"]))
+            except Exception as e:
+                self._failed += 1
+                self._pending.pop(job_id)[0].set_exception(RuntimeError(f"Job could not be sent: {e}"))
+                continue
+            try:
+                self._connections[index].send_bytes(message)
+            except OSError:
+                # The worker died, the job waits for another one and the collector replaces it
+                self._ready.discard(index)
+                heapq.heappush(self._queued, entry)
+                continue
+            self._classes[job["priority"]]["waits"].append((time.perf_counter() - job["submitted"]) * 1000)
+            self._running[index] = job_id
+
+    def _drop(self, job, error, reason):
+        # Called with the lock held
+        future, _ = self._pending.pop(job["id"])
+        self._classes[job["priority"]][reason] += 1
+        future.set_exception(error)
+
+    def _expire_waiting(self):
+        # Called with the lock held
+        now = time.time()
+        expired = [entry for entry in self._queued
+                   if entry[2]["deadline"] is not None and now >= entry[2]["deadline"]]
+        if not expired:
+            return
+        self._queued = [entry for entry in self._queued if entry not in expired]
+        heapq.heapify(self._queued)
+        for _, _, job in expired:
+            self._drop(job, JobExpired("Deadline passed before a worker was free"), "expired")
+
+    def _collect(self):
+        checked = time.monotonic()
+        while True:
+            # About once a second, dead workers are replaced and expired waiting jobs dropped
+            if time.monotonic() - checked >= 1:
+                self._check_workers()
+                with self._lock:
+                    self._expire_waiting()
+                checked = time.monotonic()
+            with self._lock:
+                if self._closed and not self._pending:
+                    return
+                connections = {connection: index for index, connection in enumerate(self._connections)
+                               if connection is not None}
+            if not connections:
+                time.sleep(1)
+                continue
+
+            for connection in wait(list(connections), timeout=1):
+                index = connections[connection]
+                try:
+                    kind, job_id, value = connection.recv()
+                except (EOFError, OSError):
+                    # Messages arrive in order, so a worker that failed to start has been marked
+                    # broken by now and is not restarted
+                    self._worker_exited(index, connection)
+                    continue
+                self._handle(index, connection, kind, job_id, value)
+
+    def _handle(self, index, connection, kind, job_id, value):
+        if kind == "ready":
+            with self._lock:
+                if self._connections[index] is connection:
+                    self._ready.add(index)
+                    self._dispatch()
+            return
+        if kind == "failed":
+            # Restarting would only fail again, the cause is logged and the worker left stopped
+            logger.error("Inference worker %d: %s", index, value)
+            with self._lock:
+                self._broken.add(index)
+            return
+
+        value, run_ms = value
+        with self._lock:
+            if self._connections[index] is connection and self._running[index] == job_id:
+                self._running[index] = None
+            future, job = self._pending.pop(job_id, (None, None))
+            if future is not None:
+                self._durations.append(((time.perf_counter() - job["submitted"]) * 1000, run_ms))
+                if kind == "done":
+                    self._completed += 1
+                else:
+                    self._failed += 1
+            self._dispatch()
+        if future is None:
+            return
+        if kind == "done":
+            future.set_result(value)
+        else:
+            future.set_exception(RuntimeError(value))
+
+    def _worker_exited(self, index, connection):
+        with self._lock:
+            if self._connections[index] is not connection:
+                # Already replaced
+                return
+            process = self._processes[index]
+            self._connections[index] = None
+            self._ready.discard(index)
+            # The job the worker had been sent fails, the others stay queued for its replacement
+            job_id, self._running[index] = self._running[index], None
+            future, _ = self._pending.pop(job_id, (None, None))
+            if future is not None:
+                self._failed += 1
+            restart = not self._closed and index not in self._broken
+        connection.close()
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+        if future is not None:
+            future.set_exception(RuntimeError("Inference worker exited while running the job"))
+        if restart:
+            logger.warning("Inference worker %d exited with code %s, restarting it", index, process.exitcode)
+            with self._lock:
+                self._restarts += 1
+                self._start_worker(index)
+
+    def _check_workers(self):
+        # Normally the collector sees a dead worker as the end of its pipe, this catches a worker
+        # that died without its pipe being closed, such as one stuck in exiting
+        for index, process in enumerate(self._processes):
+            connection = self._connections[index]
+            if connection is not None and not process.is_alive():
+                self._worker_exited(index, connection)
+
+    def is_ready(self):
+        """True once every worker has loaded its models."""
+        with self._lock:
+            return self._pid == os.getpid() and len(self._ready) == self.workers
+
+    def retry_after(self):
+        """Seconds a refused client should wait, the time the workers need to drain the queue."""
+        with self._lock:
+            pending = len(self._pending)
+            mean_ms = sum(run_ms for _, run_ms in self._durations) / len(self._durations) if self._durations else 1000
+        return max(1, math.ceil(pending / self.workers * mean_ms / 1000))
+
+    def stats(self):
+        with self._lock:
+            durations = list(self._durations)
+            stats = {
+                "workers": self.workers,
+                "ready_workers": len(self._ready) if self._pid == os.getpid() else 0,
+                "failed_workers": len(self._broken) if self._pid == os.getpid() else 0,
+                "max_queue": self.max_queue,
+                "queued": len(self._queued),
+                "in_flight": len(self._pending),
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": sum(counts["rejected"] for counts in self._classes.values()),
+                "restarts": self._restarts,
+                "classes": {},
+            }
+            for priority, counts in self._classes.items():
+                waits = sorted(counts["waits"])
+                stats["classes"][priority] = {
+                    "queued": sum(1 for _, _, job in self._queued if job["priority"] == priority),
+                    "submitted": counts["submitted"],
+                    "rejected": counts["rejected"],
+                    "preempted": counts["preempted"],
+                    "expired": counts["expired"],
+                    "timed_out": counts["timed_out"],
+                    # Time from submission until a worker took the job
+                    "queue_wait_ms": _summarize(waits) if waits else None,
+                }
+        if durations:
+            # Time from submission to result, and the part of it spent running on a worker
+            stats["job_ms"] = _summarize(sorted(total for total, _ in durations))
+            stats["run_ms"] = _summarize(sorted(run_ms for _, run_ms in durations))
+        return stats
+
+    def close(self, timeout=10):
+        """Lets the workers finish the queued jobs, then stops them."""
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            self._closed = True
+        # Waiting jobs are handed out as workers free up, the stop signals must come after them
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._queued:
+                    break
+            time.sleep(0.05)
+        with self._lock:
+            for connection in self._connections:
+                if connection is not None:
+                    try:
+                        connection.send(None)
+                    except OSError:
+                        pass
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+
+
+def _summarize(sorted_values):
+    return {
+        "mean": round(sum(sorted_values) / len(sorted_values), 2),
+        "p50": round(sorted_values[len(sorted_values) // 2], 2),
+        "p99": round(sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * 0.99))], 2),
+    }
@@ -0,0 +1,90 @@
+import cv2
+import numpy as np
+import torch
+from ai_protoring import analyze_image, analyze_images
+from annotation_writer import AnnotationWriter
+from extract_face_encodings import extract_face_encodings
+from face_detector import FaceMeshPool
+from face_locator import FaceLocator
+from frame import Frame
+from model_backends import load_yolo
+from cascade_detector import CascadeDetector
+from verify_face import verify_face, identify_faces
+
+
+def warm_up_yolo(yolo, imgsz=640):
+    yolo(np.full((640, 640, 3), 114, dtype=np.uint8), imgsz=imgsz, verbose=False)
+
+
+def frame_source(frame):
+    """The picklable parts of a Frame a worker rebuilds it from, the encoded bytes rather than the pixels."""
+    return {"path": frame.path, "data": frame.data, "name": frame.name}
+
+
+def load_worker(config):
+    """
+    Loads the models of one inference worker process and warms them up.
+
+    :param config: Dictionary with the load_yolo arguments of the spoof_model and object_model,
+                   the CascadeDetector arguments of the cascade with the load_yolo arguments of its
+                   small model as model, or None, and the settings of the web process: threads, face_mesh_pool_size, face_detection
+                   (FaceLocator arguments), spoof_mode, gaze_mode, output_dir, annotation (AnnotationWriter
+                   arguments) and analyze_batch_size.
+    :return: Dictionary of job names to functions, see InferencePool.
+    """
+    # Each worker gets its share of the cores instead of every worker spreading over all of them
+    torch.set_num_threads(config["threads"])
+    cv2.setNumThreads(config["threads"])
+
+    spoof_model = load_yolo(**config["spoof_model"])
+    object_model = load_yolo(**config["object_model"])
+    if config.get("cascade"):
+        cascade = dict(config["cascade"])
+        cheap_model = load_yolo(**cascade.pop("model"))
+        warm_up_yolo(cheap_model, cascade["cheap_size"])
+        object_model = CascadeDetector(cheap_model, object_model, **cascade)
+    face_mesh_pool = FaceMeshPool(maxSize=config["face_mesh_pool_size"])
+    face_locator = FaceLocator(**config["face_detection"])
+    annotation_writer = AnnotationWriter(config["output_dir"], **config["annotation"])
+    output_dir = config["output_dir"]
+    gaze_mode = config["gaze_mode"]
+
+    warm_up_yolo(spoof_model)
+    warm_up_yolo(object_model.full if config.get("cascade") else object_model)
+    with face_mesh_pool.borrow() as detector:
+        detector.findFaceMesh(np.zeros((480, 640, 3), dtype=np.uint8))
+    face_locator.warm_up()
+
+    def analyze(source):
+        # The annotations come back so the web process can reuse them for unchanged frames
+        return analyze_image(Frame(**source), model=object_model, output_dir=output_dir,
+                             face_mesh_pool=face_mesh_pool, annotation_writer=annotation_writer,
+                             gaze_mode=gaze_mode, return_annotations=True)
+
+    def analyze_many(image_paths):
+        return analyze_images([Frame.from_path(path) for path in image_paths], model=object_model,
+                              output_dir=output_dir, batch_size=config["analyze_batch_size"],
+                              face_mesh_pool=face_mesh_pool, annotation_writer=annotation_writer,
+                              gaze_mode=gaze_mode)
+
+    def register(source):
+        return extract_face_encodings(Frame(**source), spoof_model, face_locator, config["spoof_mode"])
+
+    def verify(source, known_face_encoding):
+        return verify_face(Frame(**source), known_face_encoding, spoof_model, face_locator, config["spoof_mode"])
+
+    def attendance(source, roster):
+        return identify_faces(Frame(**source), roster, spoof_model, face_locator)
+
+    def close():
+        annotation_writer.close()
+        face_mesh_pool.close()
+
+    return {
+        "analyze_image": analyze,
+        "analyze_images": analyze_many,
+        "register_face": register,
+        "verify_face": verify,
+        "identify_faces": attendance,
+        "close": close,
+    }
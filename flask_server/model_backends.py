@@ -0,0 +1,50 @@
+import os
+from ultralytics import YOLO
+
+# Runtimes a YOLO model can be served with, and the precisions of the exported models
+BACKENDS = ("pytorch", "onnx", "openvino")
+PRECISIONS = ("fp32", "int8")
+
+
+def artifact_path(weights, backend="pytorch", precision="fp32"):
+    """
+    Path of the model file a backend runs, named the way export_models.py writes it.
+
+    :param weights: Path to the PyTorch weights, such as ./models/yolov8x.pt.
+    :param backend: One of BACKENDS.
+    :param precision: One of PRECISIONS. PyTorch models only run in FP32.
+    :return: The .pt file, the .onnx file, or the OpenVINO model directory.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown model precision: {precision}")
+    if backend == "pytorch":
+        if precision != "fp32":
+            raise ValueError("PyTorch models only run in fp32, export an onnx or openvino model for int8")
+        return weights
+
+    stem = os.path.splitext(weights)[0] + ("_int8" if precision == "int8" else "")
+    if backend == "onnx":
+        return f"{stem}.onnx"
+    return f"{stem}_openvino_model"
+
+
+def load_yolo(weights, backend="pytorch", precision="fp32"):
+    """
+    Loads a YOLO detection model with the given backend.
+
+    Exported models are called like the PyTorch one and return the same results, so the
+    rest of the pipeline does not depend on the backend.
+
+    :param weights: Path to the PyTorch weights the exported models were made from.
+    :param backend: One of BACKENDS. ONNX needs onnxruntime and OpenVINO needs openvino.
+    :param precision: One of PRECISIONS.
+    :return: The YOLO model.
+    """
+    path = artifact_path(weights, backend, precision)
+    if not os.path.exists(path):
+        int8 = " --int8" if precision == "int8" else ""
+        raise FileNotFoundError(f"{path} not found, create it with: python export_models.py {weights} "
+                                f"--backends {backend}{int8}")
+    return YOLO(path, task="detect")
@@ -0,0 +1,175 @@
+import gc
+import logging
+import os
+import threading
+import time
+import psutil
+
+logger = logging.getLogger(__name__)
+
+MODEL_LOAD_MODES = ("lazy", "eager", "preload")
+
+
+def rss_mb():
+    """Resident memory of the current process in MB."""
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+class LazyModel:
+    def __init__(self, manager, name):
+        """
+        Stands in for a managed model and loads it on first use.
+
+        :param manager: The ModelManager holding the model.
+        :param name: Name the model was registered under.
+        """
+        self._manager = manager
+        self._name = name
+
+    def __call__(self, *args, **kwargs):
+        return self._manager.get(self._name)(*args, **kwargs)
+
+    def __getattr__(self, attribute):
+        return getattr(self._manager.get(self._name), attribute)
+
+
+class ModelManager:
+    def __init__(self, mode="eager"):
+        """
+        Loads the models of the service and warms them up.
+
+        :param mode: "lazy" loads each model on its first request and skips the warm-up.
+                     "eager" loads every model on a background thread at startup and runs a
+                     synthetic inference through each, so the first student does not pay for it.
+                     "preload" loads every model in the importing process, so the workers
+                     forked from it (gunicorn --preload) share the weight pages copy-on-write,
+                     and each worker warms up after the fork.
+        """
+        if mode not in MODEL_LOAD_MODES:
+            raise ValueError(f"Unknown model load mode: {mode}")
+        self.mode = mode
+        self._created = time.perf_counter()
+        self._loaders = {}
+        self._on_demand = set()
+        self._models = {}
+        self._load_stats = {}
+        self._warmups = []
+        self._warmup_stats = {}
+        self._lock = threading.Lock()
+        self._model_locks = {}
+        self._ready = threading.Event()
+        self._startup_ms = None
+        self._started_pid = None
+        self._preloaded = False
+
+    def register(self, name, loader, warmup=None, on_demand=False):
+        """
+        Registers a model.
+
+        :param name: Name of the model.
+        :param loader: Function returning the loaded model.
+        :param warmup: Function called with the loaded model to run a synthetic inference.
+        :param on_demand: Load the model on its first use whatever the mode, and never warm it up,
+                          for models this process rarely needs because other processes serve them.
+        :return: A LazyModel standing in for the model.
+        """
+        self._loaders[name] = loader
+        self._model_locks[name] = threading.Lock()
+        if on_demand:
+            self._on_demand.add(name)
+        elif warmup is not None:
+            self._warmups.append((name, lambda: warmup(self.get(name))))
+        return LazyModel(self, name)
+
+    def register_warmup(self, name, warmup):
+        """
+        Registers a warm-up of something that is not a managed model, such as the face mesh graphs.
+
+        :param name: Name reported in the statistics.
+        :param warmup: Function running a synthetic inference.
+        """
+        self._warmups.append((name, warmup))
+
+    def get(self, name):
+        """The loaded model, loading it first when needed."""
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._model_locks[name]:
+            if name not in self._models:
+                rss_before = rss_mb()
+                start = time.perf_counter()
+                self._models[name] = self._loaders[name]()
+                self._load_stats[name] = {
+                    "load_ms": round((time.perf_counter() - start) * 1000, 1),
+                    "rss_mb": round(rss_mb() - rss_before, 1),
+                    "pid": os.getpid(),
+                }
+            return self._models[name]
+
+    def start(self):
+        """
+        Starts loading according to the mode. Called once at import and again on the first
+        request of every process, so workers forked after a preload warm themselves up.
+        """
+        if self.mode == "preload" and not self._preloaded:
+            # Load in the parent before workers fork. Inference threads would not survive the
+            # fork, so the warm-up waits for the first request of each worker.
+            for name in self._loaders:
+                if name not in self._on_demand:
+                    self.get(name)
+            # Keep the garbage collector from writing to, and so copying, the shared pages
+            gc.freeze()
+            self._preloaded = True
+            return
+
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            if self._started_pid is not None or self._preloaded:
+                # A forked worker reports its own startup
+                self._created = time.perf_counter()
+            self._started_pid = os.getpid()
+            self._ready.clear()
+
+        if self.mode == "lazy":
+            self._mark_ready()
+        else:
+            threading.Thread(target=self._load_and_warm_up, daemon=True, name="model-warmup").start()
+
+    def _load_and_warm_up(self):
+        for name in self._loaders:
+            if name in self._on_demand:
+                continue
+            try:
+                self.get(name)
+            except Exception as e:
+                logger.exception("Failed to load model %s: %s", name, e)
+        for name, warmup in self._warmups:
+            start = time.perf_counter()
+            try:
+                warmup()
+                self._warmup_stats[name] = round((time.perf_counter() - start) * 1000, 1)
+            except Exception as e:
+                logger.exception("Warm-up of %s failed: %s", name, e)
+                self._warmup_stats[name] = None
+        self._mark_ready()
+
+    def _mark_ready(self):
+        self._startup_ms = round((time.perf_counter() - self._created) * 1000, 1)
+        self._ready.set()
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "ready": self.is_ready(),
+            "startup_ms": self._startup_ms,
+            "rss_mb": round(rss_mb(), 1),
+            "models": {name: dict(self._load_stats.get(name, {}), loaded=name in self._models,
+                                  on_demand=name in self._on_demand)
+                       for name in self._loaders},
+            "warmup_ms": dict(self._warmup_stats),
+        }
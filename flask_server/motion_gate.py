@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+class MotionGate:
+    def __init__(self, threshold=2.0, full_every=10, size=64):
+        """
+        Skips the heavy analysis of frames that barely differ from the last analyzed one.
+
+        Frames are compared on a tiny grayscale thumbnail. A frame whose mean absolute
+        difference from the last fully analyzed frame is at most threshold reuses that
+        frame's result, and every full_every frames a full analysis runs regardless.
+
+        :param threshold: Maximum mean absolute difference, in gray levels, of a reused frame.
+        :param full_every: Frames after which a full analysis is forced, 1 analyzes every frame.
+        :param size: Side of the thumbnail the frames are compared on.
+        """
+        self.threshold = threshold
+        self.full_every = full_every
+        self.size = size
+        self._lock = threading.Lock()
+        self._reference = None
+        self._result = None
+        self._since_full = 0
+        self._frames = 0
+        self._reused = 0
+        self.last_active = time.monotonic()
+
+    def difference(self, frame):
+        """Mean absolute difference between a frame and the last fully analyzed one, or None."""
+        with self._lock:
+            reference = self._reference
+        if reference is None:
+            return None
+        return float(np.abs(frame.thumbnail(self.size).astype(np.int16) - reference).mean())
+
+    def reuse(self, frame):
+        """
+        Looks up the result a frame can reuse.
+
+        :param frame: The Frame about to be analyzed.
+        :return: The result of the last fully analyzed frame, or None when this frame has to be analyzed.
+        """
+        difference = self.difference(frame)
+        with self._lock:
+            self._frames += 1
+            self.last_active = time.monotonic()
+            if difference is None or difference > self.threshold or self._since_full + 1 >= self.full_every:
+                return None
+            self._since_full += 1
+            self._reused += 1
+            return self._result
+
+    def update(self, frame, result):
+        """
+        Records a fully analyzed frame as the reference for the next ones.
+
+        :param frame: The analyzed Frame.
+        :param result: Anything the following frames should reuse.
+        """
+        reference = frame.thumbnail(self.size).astype(np.int16)
+        with self._lock:
+            self._reference = reference
+            self._result = result
+            self._since_full = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "frames": self._frames,
+                "reused": self._reused,
+                "skip_rate": round(self._reused / self._frames, 3) if self._frames else 0.0,
+            }
+
+
+class MotionGateCache:
+    def __init__(self, max_size=1024, idle_timeout=300, **gate_args):
+        """
+        Motion gates of stateless requests, keyed by quiz submission id.
+
+        :param max_size: Maximum number of gates kept, the least recently used is dropped first.
+        :param idle_timeout: Seconds without frames after which a gate is dropped.
+        :param gate_args: Keyword arguments passed to MotionGate.
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.gate_args = gate_args
+        self._gates = OrderedDict()
+        self._lock = threading.Lock()
+        self._frames = 0
+        self._reused = 0
+
+    def get(self, submission_id):
+        """The motion gate of a submission, created on first use."""
+        now = time.monotonic()
+        with self._lock:
+            # Least recently used first, so idle gates are at the front
+            while self._gates:
+                oldest = next(iter(self._gates.values()))
+                if len(self._gates) < self.max_size and now - oldest.last_active <= self.idle_timeout:
+                    break
+                self._drop(*self._gates.popitem(last=False))
+
+            gate = self._gates.get(submission_id)
+            if gate is None:
+                gate = MotionGate(**self.gate_args)
+                self._gates[submission_id] = gate
+            self._gates.move_to_end(submission_id)
+            return gate
+
+    def _drop(self, submission_id, gate):
+        stats = gate.stats()
+        self._frames += stats["frames"]
+        self._reused += stats["reused"]
+
+    def stats(self):
+        with self._lock:
+            frames, reused = self._frames, self._reused
+            for gate in self._gates.values():
+                stats = gate.stats()
+                frames += stats["frames"]
+                reused += stats["reused"]
+            return {
+                "gates": len(self._gates),
+                "frames": frames,
+                "reused": reused,
+                "skip_rate": round(reused / frames, 3) if frames else 0.0,
+            }
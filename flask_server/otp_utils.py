@@ -3,9 +3,9 @@ import smtplib
 from email.mime.text import MIMEText
 from dotenv import load_dotenv
 import os
-import ssl
 import logging
 import re
+from smtp_pool import shared_pool
 
 
 # Load environment variables from .env file
@@ -61,15 +61,11 @@ def send_otp(email, otp):
     msg['From'] = EMAIL
     msg['To'] = email
 
-    context = ssl.create_default_context()
     try:
-        with smtplib.SMTP(SMTP_SERVER, int(SMTP_PORT)) as server:
-            server.ehlo()
-            server.starttls(context=context)
-            server.login(EMAIL, PASSWORD)
-            server.sendmail(EMAIL, email, msg.as_string())
-            logger.info(f"OTP sent successfully to {email}")
-            return otp
+        # A pooled, already logged in connection, shared with the other mail functions
+        shared_pool().send(EMAIL, email, msg.as_string())
+        logger.info(f"OTP sent successfully to {email}")
+        return otp
     except smtplib.SMTPAuthenticationError as e:
         logger.error(f"Authentication error: {e}")
         raise RuntimeError("Authentication failed. Please check your email and password.")
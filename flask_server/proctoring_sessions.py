@@ -0,0 +1,316 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from face_detector import FaceMeshDetector
+
+logger = logging.getLogger(__name__)
+
+
+class ProctoringSession:
+    def __init__(self, submission_id, analyze, max_queue=4, max_results=256, motion_gate=None, on_result=None):
+        """
+        Continuous proctoring of one quiz submission.
+
+        Frames are analyzed in arrival order on the session's own thread with a face mesh
+        detector in tracking mode, so landmarks of consecutive frames are tracked rather than
+        detected from scratch. When frames arrive faster than they are analyzed, the oldest
+        waiting frame is skipped so the analysis keeps up with the student.
+
+        :param submission_id: Id of the quiz submission being proctored.
+        :param analyze: Called as analyze(frame, face_detector=detector) and returns the analysis result.
+                        Also given motion_gate=motion_gate when the session has one.
+        :param max_queue: Maximum number of frames waiting for analysis.
+        :param max_results: Number of recent results kept for result streams.
+        :param motion_gate: MotionGate skipping frames nearly identical to the last analyzed one.
+        :param on_result: Called as on_result(submission_id, data) after each successfully analyzed frame.
+        """
+        self.submission_id = submission_id
+        self.max_queue = max_queue
+        self._analyze = analyze
+        self._detector = FaceMeshDetector(staticMode=False)
+        self.motion_gate = motion_gate
+        self._on_result = on_result
+
+        self._condition = threading.Condition()
+        self._pending = deque()
+        self._results = deque(maxlen=max_results)
+        self._result_count = 0
+        self._received = 0
+        self._analyzed = 0
+        self._failed = 0
+        self._skipped = 0
+        self._analysis_time = 0.0
+        self._closed = False
+        self._finished = False
+        self.last_active = time.monotonic()
+
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"proctoring-{submission_id}")
+        self._thread.start()
+
+    def submit(self, frame):
+        """
+        Queues a frame for analysis.
+
+        :param frame: The Frame to analyze.
+        :return: A dictionary with the sequence number of the frame and hints for the client
+                 to adapt its frame rate.
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Proctoring session is closed")
+            self._received += 1
+            sequence = self._received
+            if len(self._pending) >= self.max_queue:
+                # The server is behind, the newest frame says more about the student than the oldest
+                skipped_sequence, skipped_frame = self._pending.popleft()
+                self._skipped += 1
+                self._add_result({"sequence": skipped_sequence, "image_name": skipped_frame.name,
+                                  "success": False, "skipped": True})
+            self._pending.append((sequence, frame))
+            self.last_active = time.monotonic()
+            self._condition.notify_all()
+            return {
+                "sequence": sequence,
+                "queue_depth": len(self._pending),
+                "skipped": self._skipped,
+                "suggested_interval_ms": self._mean_analysis_ms(),
+            }
+
+    def _add_result(self, result):
+        self._results.append(result)
+        self._result_count += 1
+        self._condition.notify_all()
+
+    def _mean_analysis_ms(self):
+        analyzed = self._analyzed + self._failed
+        return round(self._analysis_time * 1000 / analyzed, 1) if analyzed else 0.0
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    break
+                sequence, frame = self._pending.popleft()
+
+            start = time.perf_counter()
+            try:
+                if self.motion_gate is not None:
+                    data = self._analyze(frame, face_detector=self._detector, motion_gate=self.motion_gate)
+                else:
+                    data = self._analyze(frame, face_detector=self._detector)
+                result = {"sequence": sequence, "image_name": frame.name, "success": True, "data": data}
+                if self._on_result is not None:
+                    self._on_result(self.submission_id, data)
+            except Exception as e:
+                result = {"sequence": sequence, "image_name": frame.name, "success": False,
+                          "error": f"Failed to analyze image: {str(e)}"}
+
+            with self._condition:
+                if result["success"]:
+                    self._analyzed += 1
+                else:
+                    self._failed += 1
+                self._analysis_time += time.perf_counter() - start
+                self.last_active = time.monotonic()
+                self._add_result(result)
+
+        self._detector.close()
+        with self._condition:
+            self._finished = True
+            self._condition.notify_all()
+
+    def results(self, after=0, keepalive=15):
+        """
+        Streams results as lines of JSON until the session is closed.
+
+        :param after: Number of results the client has already received.
+        :param keepalive: Seconds without a result after which an empty line is sent, so
+                          dead connections are noticed.
+        :return: Generator of newline terminated strings.
+        """
+        delivered = after
+        while True:
+            with self._condition:
+                if delivered == self._result_count and not self._finished:
+                    self._condition.wait(keepalive)
+                # Results that fell out of the kept window are lost to a slow reader
+                first = self._result_count - len(self._results)
+                delivered = max(delivered, first)
+                new = list(self._results)[delivered - first:]
+                delivered = self._result_count
+                finished = self._finished and not new
+
+            if finished:
+                return
+            if not new:
+                yield "\n"
+            for result in new:
+                yield json.dumps(result) + "\n"
+
+    def stats(self):
+        motion = self.motion_gate.stats() if self.motion_gate is not None else None
+        with self._condition:
+            return {
+                "submission_id": self.submission_id,
+                "received": self._received,
+                "analyzed": self._analyzed,
+                "failed": self._failed,
+                "skipped": self._skipped,
+                "queue_depth": len(self._pending),
+                "mean_analysis_ms": self._mean_analysis_ms(),
+                "closed": self._closed,
+                "motion_gate": motion,
+            }
+
+    def close(self):
+        """Analyzes the frames still waiting, then stops the session thread and its detector."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+
+class ProctoringSessionManager:
+    def __init__(self, analyze, max_queue=4, idle_timeout=300, max_sessions=256, motion_gate_factory=None,
+                 on_result=None, lock_path=None):
+        """
+        Open proctoring sessions keyed by quiz submission id.
+
+        Sessions live in the memory of one process, so the frames and results of a session must
+        reach the process that opened it. With a lock path, only the process holding the lock
+        file serves sessions, see claim, so a server run with several web processes refuses
+        session requests plainly instead of losing sessions between processes.
+
+        :param analyze: Analysis function handed to every session, see ProctoringSession.
+        :param max_queue: Maximum number of frames waiting per session.
+        :param idle_timeout: Seconds without frames after which a session is closed.
+        :param max_sessions: Maximum number of open sessions, each holds a detector and a thread.
+        :param motion_gate_factory: Creates the MotionGate of each session, None analyzes every frame.
+        :param on_result: Result callback handed to every session, see ProctoringSession.
+        :param lock_path: File locked by the process serving sessions, None serves them in every process.
+        """
+        self.analyze = analyze
+        self.max_queue = max_queue
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.motion_gate_factory = motion_gate_factory
+        self.on_result = on_result
+        self.lock_path = lock_path
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._evicted = 0
+        self._lock_file = None
+        self._claimed_pid = None
+        self._owner = lock_path is None
+
+    def claim(self):
+        """
+        Makes this process the one serving sessions, when no other live process is.
+
+        Called once in every process before it serves requests. Not called before a fork, as
+        the lock would then be shared with every child.
+
+        :return: True when this process serves sessions.
+        """
+        with self._lock:
+            if self.lock_path is None or self._claimed_pid == os.getpid():
+                return self._owner
+            self._claimed_pid = os.getpid()
+            self._lock_file = open(self.lock_path, "a+")
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._lock_file.seek(0)
+                owner = self._lock_file.read().strip() or "another process"
+                logger.error("Streaming proctoring sessions are served by process %s, this process %d refuses "
+                             "them. Run the server as a single process to use them", owner, os.getpid())
+                self._owner = False
+                return False
+            self._lock_file.truncate(0)
+            self._lock_file.write(str(os.getpid()))
+            self._lock_file.flush()
+            self._owner = True
+            return True
+
+    @property
+    def owner(self):
+        """True when this process serves sessions."""
+        return self._owner and (self.lock_path is None or self._claimed_pid == os.getpid())
+
+    def open(self, submission_id):
+        """
+        Opens the session of a submission, or returns the one already open.
+
+        :param submission_id: Id of the quiz submission.
+        :return: The ProctoringSession, or None when the maximum number of sessions is open.
+        """
+        self._evict_idle()
+        with self._lock:
+            session = self._sessions.get(submission_id)
+            if session is None:
+                if len(self._sessions) >= self.max_sessions:
+                    return None
+                motion_gate = self.motion_gate_factory() if self.motion_gate_factory else None
+                session = ProctoringSession(submission_id, self.analyze, max_queue=self.max_queue,
+                                            motion_gate=motion_gate, on_result=self.on_result)
+                self._sessions[submission_id] = session
+            session.last_active = time.monotonic()
+            return session
+
+    def get(self, submission_id):
+        """The open session of a submission, or None."""
+        self._evict_idle()
+        with self._lock:
+            return self._sessions.get(submission_id)
+
+    def close(self, submission_id):
+        """
+        Closes the session of a submission.
+
+        :param submission_id: Id of the quiz submission.
+        :return: The final statistics of the session, or None when it was not open.
+        """
+        with self._lock:
+            session = self._sessions.pop(submission_id, None)
+        if session is None:
+            return None
+        session.close()
+        return session.stats()
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [submission_id for submission_id, session in self._sessions.items()
+                    if now - session.last_active > self.idle_timeout]
+            evicted = [self._sessions.pop(submission_id) for submission_id in idle]
+            self._evicted += len(evicted)
+        # Closing waits for the frames in flight, so it happens outside the lock
+        for session in evicted:
+            session.close()
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            evicted = self._evicted
+        session_stats = [session.stats() for session in sessions]
+        return {
+            "open": len(sessions),
+            "max_sessions": self.max_sessions,
+            "evicted": evicted,
+            "frames_received": sum(stats["received"] for stats in session_stats),
+            "frames_skipped": sum(stats["skipped"] for stats in session_stats),
+            "frames_reused": sum(stats["motion_gate"]["reused"] for stats in session_stats if stats["motion_gate"]),
+        }
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
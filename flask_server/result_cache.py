@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# Bookkeeping of an entry on top of its values, roughly what the dict and key tuple take
+ENTRY_OVERHEAD = 256
+
+
+def value_size(value):
+    """Approximate memory taken by a cached value in bytes."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return 8 * len(value) + sum(value_size(item) for item in value)
+    return 64
+
+
+def frozen(value):
+    """The value with its arrays made read-only, so a caller cannot change what later requests get."""
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            frozen(item)
+    return value
+
+
+class ResultCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=600):
+        """
+        Least recently used cache of what the face checks computed for an image, keyed by a
+        hash of the image content, so a retry with the same image does not run the models again.
+
+        An entry holds named fields, such as the anti-spoof detections and the face encodings,
+        added as each is computed. Entries expire ttl seconds after they were created.
+
+        The key leaves out which anti-spoof model made the detections. That is fine while
+        production runs one fixed model, a cache shared between models must add it to the key.
+
+        :param max_bytes: Size limit of the cached values, the least recently used entries are dropped first.
+                          0 disables the cache.
+        :param ttl: Seconds an entry is kept.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key: (created, fields, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        """
+        The fields cached for a key.
+
+        :param key: Cache key, None when the cache is disabled.
+        :return: Dictionary of field names to values, empty on a miss.
+        """
+        if key is None:
+            return {}
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] > self.ttl:
+                self._drop(key)
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return {}
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return dict(entry[1])
+
+    def put(self, key, field, value):
+        """
+        Adds a field to the entry of a key, creating the entry when there is none.
+
+        :param key: Cache key, None when the cache is disabled.
+        :param field: Name of the field.
+        :param value: Value to cache, its arrays are made read-only.
+        """
+        if key is None:
+            return
+        size = value_size(value)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] > self.ttl:
+                if entry is not None:
+                    self._drop(key)
+                entry = (now, {}, ENTRY_OVERHEAD)
+                self._bytes += ENTRY_OVERHEAD
+            created, fields, entry_size = entry
+            if field in fields:
+                entry_size -= value_size(fields[field])
+                self._bytes -= value_size(fields[field])
+            fields[field] = frozen(value)
+            self._entries[key] = (created, fields, entry_size + size)
+            self._entries.move_to_end(key)
+            self._bytes += size
+
+            # Expired entries go first, then the least recently used until the cache fits
+            while self._entries:
+                oldest_key, (oldest_created, _, _) = next(iter(self._entries.items()))
+                if now - oldest_created > self.ttl:
+                    self._expirations += 1
+                elif self._bytes > self.max_bytes:
+                    self._evictions += 1
+                else:
+                    break
+                self._drop(oldest_key)
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
@@ -3,9 +3,9 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
 import os
-import ssl
 import logging
 import re
+from smtp_pool import shared_pool
 
 # Load environment variables from .env file
 load_dotenv()
@@ -49,14 +49,10 @@ def send_verification_email(name, email):
     msg['From'] = EMAIL
     msg['To'] = email
 
-    context = ssl.create_default_context()
     try:
-        with smtplib.SMTP(SMTP_SERVER, int(SMTP_PORT)) as server:
-            server.ehlo()
-            server.starttls(context=context)
-            server.login(EMAIL, PASSWORD)
-            server.sendmail(EMAIL, email, msg.as_string())
-            logger.info(f"Verification email sent successfully to {email}")
+        # A pooled, already logged in connection, shared with the other mail functions
+        shared_pool().send(EMAIL, email, msg.as_string())
+        logger.info(f"Verification email sent successfully to {email}")
     except smtplib.SMTPAuthenticationError as e:
         logger.error(f"Authentication error: {e}")
         raise RuntimeError("Authentication failed. Please check your email and password.")
@@ -107,14 +103,10 @@ def send_password_reset_mail(name, email, reset_link):
     # Attach both the plain and HTML versions
     msg.attach(MIMEText(body_html, "html"))
 
-    context = ssl.create_default_context()
     try:
-        with smtplib.SMTP(SMTP_SERVER, int(SMTP_PORT)) as server:
-            server.ehlo()
-            server.starttls(context=context)
-            server.login(EMAIL, PASSWORD)
-            server.sendmail(EMAIL, email, msg.as_string())
-            logger.info(f"Password reset email sent successfully to {email}")
+        # A pooled, already logged in connection, shared with the other mail functions
+        shared_pool().send(EMAIL, email, msg.as_string())
+        logger.info(f"Password reset email sent successfully to {email}")
     except smtplib.SMTPAuthenticationError as e:
         logger.error(f"Authentication error: {e}")
         raise RuntimeError("Authentication failed. Please check your email and password.")
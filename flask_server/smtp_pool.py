@@ -0,0 +1,220 @@
+import atexit
+import os
+import smtplib
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+
+# Errors after which a connection is not reused, and a message is sent again on a new one
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class SMTPPool:
+    def __init__(self, host, port, username, password, max_size=4, max_idle=60, check_after=5,
+                 starttls=True, timeout=30):
+        """
+        Thread-safe pool of logged in SMTP connections, so a message does not pay for the
+        connection, EHLO, STARTTLS and LOGIN round trips every time.
+
+        A connection that sat idle for more than check_after seconds is checked with NOOP before
+        it is reused, one idle for more than max_idle seconds is closed, as servers drop idle
+        sessions anyway. A message whose connection turns out to be dropped is sent again on a
+        new connection.
+
+        :param host: SMTP server.
+        :param port: SMTP port.
+        :param username: Login user, None to send without logging in.
+        :param password: Login password.
+        :param max_size: Maximum number of open connections, senders wait when all are in use.
+        :param max_idle: Seconds after which an idle connection is closed.
+        :param check_after: Seconds of idleness after which a connection is checked before reuse.
+        :param starttls: Upgrade connections with STARTTLS, False for local test servers.
+        :param timeout: Socket timeout of the connections in seconds.
+        """
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.starttls = starttls
+        self.timeout = timeout
+        self._context = ssl.create_default_context() if starttls else None
+
+        self._idle = []  # (connection, last_used), most recently used last
+        self._open = 0
+        self._closed = False
+        self._available = threading.Condition()
+        self._connects = 0
+        self._reuses = 0
+        self._failed_checks = 0
+        self._resends = 0
+        self._sent = 0
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.ehlo()
+            if self.starttls:
+                server.starttls(context=self._context)
+                server.ehlo()
+            if self.username:
+                server.login(self.username, self.password)
+        except BaseException:
+            self._discard(server)
+            raise
+        return server
+
+    @staticmethod
+    def _discard(server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _alive(self, server):
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _acquire(self):
+        """A logged in connection, reused when one is idle."""
+        stale = []
+        with self._available:
+            while True:
+                if self._closed:
+                    raise RuntimeError("The SMTP pool is closed")
+                now = time.monotonic()
+                # Connections left idle too long are closed rather than reused
+                while self._idle and now - self._idle[0][1] > self.max_idle:
+                    self._open -= 1
+                    stale.append(self._idle.pop(0)[0])
+                if self._idle:
+                    server, last_used = self._idle.pop()
+                    break
+                if self._open < self.max_size:
+                    self._open += 1
+                    server = None
+                    break
+                self._available.wait()
+        for expired in stale:
+            self._discard(expired)
+
+        if server is not None:
+            if now - last_used <= self.check_after or self._alive(server):
+                with self._available:
+                    self._reuses += 1
+                return server
+            with self._available:
+                self._failed_checks += 1
+            self._discard(server)
+
+        try:
+            server = self._connect()
+        except BaseException:
+            self._release(None)
+            raise
+        with self._available:
+            self._connects += 1
+        return server
+
+    def _release(self, server):
+        """Puts a connection back, or frees its slot when it is None."""
+        with self._available:
+            pooled = server is not None and not self._closed
+            if pooled:
+                self._idle.append((server, time.monotonic()))
+            else:
+                self._open -= 1
+            self._available.notify()
+        if server is not None and not pooled:
+            self._discard(server)
+
+    @contextmanager
+    def connection(self):
+        """Borrows a logged in connection, closing it instead of returning it when it failed."""
+        server = self._acquire()
+        try:
+            yield server
+        except BaseException:
+            # The session may be halfway through a command, do not hand it to anyone else
+            self._discard(server)
+            self._release(None)
+            raise
+        self._release(server)
+
+    def send(self, from_addr, to_addrs, message):
+        """
+        Sends a message like SMTP.sendmail, on a pooled connection.
+
+        :param from_addr: Sender address.
+        :param to_addrs: Recipient address or list of addresses.
+        :param message: The message as a string.
+        """
+        try:
+            with self.connection() as server:
+                server.sendmail(from_addr, to_addrs, message)
+        except CONNECTION_ERRORS:
+            # The server dropped the session since it was checked, try once on a fresh one
+            with self._available:
+                self._resends += 1
+            with self.connection() as server:
+                server.sendmail(from_addr, to_addrs, message)
+        with self._available:
+            self._sent += 1
+
+    def close(self):
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._available.notify_all()
+        for server, _ in idle:
+            self._discard(server)
+
+    def stats(self):
+        with self._available:
+            return {
+                "open": self._open,
+                "idle": len(self._idle),
+                "max_size": self.max_size,
+                "sent": self._sent,
+                "connects": self._connects,
+                "reuses": self._reuses,
+                "failed_checks": self._failed_checks,
+                "resends": self._resends,
+            }
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_pool():
+    """
+    The SMTP pool of this process, configured from the environment on first use.
+
+    Created lazily and again after a fork, so worker processes never share a socket with
+    their parent.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None or _shared[0] != os.getpid():
+            pool = SMTPPool(
+                os.getenv('SMTP_SERVER'), os.getenv('SMTP_PORT'), os.getenv('EMAIL'), os.getenv('PASSWORD'),
+                max_size=int(os.getenv('SMTP_POOL_SIZE', 4)),
+                max_idle=float(os.getenv('SMTP_MAX_IDLE', 60)),
+                starttls=os.getenv('SMTP_STARTTLS', 'true').lower() == 'true',
+            )
+            _shared = (os.getpid(), pool)
+            atexit.register(_close_shared, os.getpid(), pool)
+        return _shared[1]
+
+
+def _close_shared(pid, pool):
+    # A forked child inherits the parent's handler, the parent's sessions are not the child's to quit
+    if os.getpid() == pid:
+        pool.close()
@@ -1,28 +1,128 @@
-import math
+import numpy as np
+from frame import as_frame
 
-def is_real_image(image_path, model, threshold=0.6):
+# "full" runs the anti-spoof model on the whole letterboxed image, "crop" on a padded crop around the face
+SPOOF_CHECK_MODES = ("full", "crop")
+# Margin added around the face on each side for the crop mode, as a share of the face size
+SPOOF_CROP_PADDING = 0.5
+# Input size of the anti-spoof model in the crop mode
+SPOOF_CROP_SIZE = 320
+
+CLASS_NAMES = ["fake", "real"]
+
+
+def score_boxes(data, threshold):
+    """
+    Picks the detection an anti-spoof decision is based on.
+
+    :param data: Array of detections, rows of x1, y1, x2, y2, confidence, class, in model output order.
+    :param threshold: Confidence a detection must exceed after rounding up to two decimals.
+    :return: Index of the first detection above the threshold, or None.
+    """
+    # Scaled in float32 like the tensors of the original per box check, then divided in float64
+    # like its math.ceil integers, so a confidence of exactly 0.60 still fails a 0.6 threshold
+    confidence = np.asarray(data[:, 4], dtype=np.float32)
+    above = np.flatnonzero(np.ceil(confidence * np.float32(100)).astype(np.float64) / 100 > threshold)
+    return int(above[0]) if len(above) else None
+
+
+def face_crop(frame, face_location, padding=SPOOF_CROP_PADDING):
+    """
+    The face of a frame with a margin around it.
+
+    :param frame: The Frame the face was found in.
+    :param face_location: (top, right, bottom, left) face location, as found by face_recognition.
+    :param padding: Margin on each side as a share of the face height and width.
+    :return: The BGR crop and the (x, y) offset of its top left corner in the image.
+    """
+    top, right, bottom, left = face_location
+    h, w = frame.shape[:2]
+    pad_x, pad_y = int((right - left) * padding), int((bottom - top) * padding)
+    x1, y1 = max(0, left - pad_x), max(0, top - pad_y)
+    x2, y2 = min(w, right + pad_x), min(h, bottom + pad_y)
+    return frame.bgr[y1:y2, x1:x2], (x1, y1)
+
+
+def detect_spoof(frame, model, face_location=None):
+    """
+    Runs the anti-spoof model on an image, see is_real_image.
+
+    :return: Array of detections, rows of x1, y1, x2, y2 in image coordinates, confidence and class.
+    """
+    frame = as_frame(frame)
+    if face_location is not None:
+        crop, (offset_x, offset_y) = face_crop(frame, face_location)
+        if crop.size == 0:
+            return np.zeros((0, 6), dtype=np.float32)
+        data = model(crop, imgsz=SPOOF_CROP_SIZE, verbose=False)[0].boxes.data.numpy().copy()
+        data[:, :4] += np.array([offset_x, offset_y, offset_x, offset_y], dtype=data.dtype)
+        return data
+
+    # Run on the already decoded, letterboxed image instead of re-reading the file
+    data = model(frame.letterboxed()[0])[0].boxes.data.numpy()
+    return np.column_stack([frame.unletterbox(data[:, :4]), data[:, 4:]]) if len(data) else data
+
+
+def spoof_verdict(data, threshold=0.6, return_box=False):
+    """
+    Decides whether a face is real from the detections of the anti-spoof model.
+
+    The threshold is applied here rather than in detect_spoof, so detections can be cached
+    and judged again with another threshold.
+
+    :param data: Detections returned by detect_spoof.
+    :param threshold: Threshold for determining if an image is real or fake.
+    :param return_box: Also return the face box the decision was based on.
+    :return: True if the image is real, and with return_box the box or None.
+    """
+    # The first detection above the threshold decides, all boxes are scored at once
+    index = score_boxes(data, threshold)
+    if index is None:
+        return (False, None) if return_box else False
+
+    is_real = CLASS_NAMES[int(data[index, 5])] == 'real'
+    return (is_real, data[index, :4]) if return_box else is_real
+
+
+def is_real_image(frame, model, threshold=0.6, return_box=False, face_location=None):
     """
     Determines if an image is real or fake using a pre-trained model.
 
     Parameters:
-    - image_path (str): Path to the image to be evaluated.
+    - frame (Frame or str): The image to be evaluated, or a path to it.
     - model           : Pre-trained model.
     - threshold (float): Threshold for determining if an image is real or fake. Default is 0.6.
+    - return_box (bool): Also return the (x1, y1, x2, y2) face box the decision was based on.
+    - face_location (tuple): (top, right, bottom, left) location of the face. When given, the
+                             model only looks at a padded crop of the face at SPOOF_CROP_SIZE.
 
     Returns:
     - bool: True if the image is real, False if fake.
+    - box: Only with return_box, the face box in image coordinates, or None.
+    """
+    return spoof_verdict(detect_spoof(frame, model, face_location), threshold, return_box)
+
+def real_faces(frame, model, face_locations, threshold=0.6):
     """
-    class_names = ["fake", "real"]
-    results = model(image_path)
-    
-    for result in results:
-        for box in result.boxes:
-            # Confidence
-            confidence = math.ceil((box.conf[0] * 100)) / 100
-            # Class Name
-            class_id = int(box.cls[0])
-            
-            if confidence > threshold:
-                return class_names[class_id] == 'real'
-    
-    return False
+    Checks every face of a group image for spoofs with one batched run of the model.
+
+    Each face is judged on its own padded crop, as in the crop mode of is_real_image, since
+    the model expects one face per image.
+
+    :param frame: The Frame the faces were found in.
+    :param model: Pre-trained anti-spoof model.
+    :param face_locations: (top, right, bottom, left) locations of the faces.
+    :param threshold: Threshold for determining if a face is real or fake.
+    :return: List with True for each real face, in the order of face_locations.
+    """
+    frame = as_frame(frame)
+    crops = [face_crop(frame, location)[0] for location in face_locations]
+    checked = [index for index, crop in enumerate(crops) if crop.size]
+    verdicts = [False] * len(crops)
+    if not checked:
+        return verdicts
+
+    results = model([crops[index] for index in checked], imgsz=SPOOF_CROP_SIZE, verbose=False)
+    for index, result in zip(checked, results):
+        verdicts[index] = spoof_verdict(result.boxes.data.numpy(), threshold)
+    return verdicts
@@ -0,0 +1,105 @@
+import threading
+import time
+
+from batch_scheduler import BatchedModel
+
+
+class RecordingModel:
+    names = {0: "person"}
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+
+    def __call__(self, sources, batch=None):
+        self.batches.append(list(sources))
+        if self.fail:
+            raise RuntimeError("model failed")
+        return [f"result-{source}" for source in sources]
+
+
+def call_concurrently(batched, sources):
+    barrier = threading.Barrier(len(sources))
+    results, errors = {}, {}
+
+    def call(source):
+        barrier.wait()
+        try:
+            results[source] = batched(source)
+        except Exception as e:
+            errors[source] = e
+
+    threads = [threading.Thread(target=call, args=(source,)) for source in sources]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results, errors
+
+
+def test_concurrent_calls_are_batched_and_get_their_own_results():
+    model = RecordingModel()
+    batched = BatchedModel(model, max_batch_size=8, max_wait_ms=500)
+    sources = [f"image-{i}" for i in range(8)]
+
+    results, errors = call_concurrently(batched, sources)
+    batched.close()
+
+    assert not errors
+    assert results == {source: [f"result-{source}"] for source in sources}
+    assert len(model.batches) < len(sources)
+    assert sorted(source for batch in model.batches for source in batch) == sorted(sources)
+    assert all(len(batch) <= 8 for batch in model.batches)
+    assert batched.stats()["batches"] == len(model.batches)
+
+
+def test_lists_and_model_arguments_bypass_the_batching():
+    model = RecordingModel()
+    batched = BatchedModel(model, max_wait_ms=500)
+
+    assert batched(["a", "b"]) == ["result-a", "result-b"]
+    assert batched.stats() == {"batches": 0}
+    batched.close()
+
+
+def test_a_lone_call_waits_at_most_max_wait():
+    batched = BatchedModel(RecordingModel(), max_batch_size=8, max_wait_ms=200)
+
+    started = time.perf_counter()
+    assert batched("image") == ["result-image"]
+    elapsed = time.perf_counter() - started
+    batched.close()
+
+    assert 0.2 <= elapsed < 2
+
+
+def test_a_full_batch_does_not_wait_for_max_wait():
+    model = RecordingModel()
+    batched = BatchedModel(model, max_batch_size=2, max_wait_ms=5000)
+
+    started = time.perf_counter()
+    results, errors = call_concurrently(batched, ["a", "b"])
+    elapsed = time.perf_counter() - started
+    batched.close()
+
+    assert not errors and results == {"a": ["result-a"], "b": ["result-b"]}
+    assert [sorted(batch) for batch in model.batches] == [["a", "b"]]
+    assert elapsed < 4
+
+
+def test_a_failing_batch_reaches_every_waiter():
+    model = RecordingModel(fail=True)
+    batched = BatchedModel(model, max_batch_size=4, max_wait_ms=5000)
+    sources = ["a", "b", "c", "d"]
+
+    results, errors = call_concurrently(batched, sources)
+
+    assert not results
+    assert sorted(errors) == sources
+    assert all(isinstance(error, RuntimeError) for error in errors.values())
+
+    # The batching thread survives the failure
+    model.fail = False
+    batched.max_wait = 0
+    assert batched("e") == ["result-e"]
+    batched.close()
@@ -0,0 +1,97 @@
+import glob
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from cheating_accumulator import CheatingAccumulator
+
+PHONE = {"mobile_phone": True, "eye_gaze": "center"}
+GAZE = {"mobile_phone": False, "eye_gaze": "left"}
+
+
+def _add_frames(accumulator, submission_id, result, count, done=None):
+    for _ in range(count):
+        accumulator.add(submission_id, result)
+    accumulator.snapshot()
+    if done is not None:
+        done.put(accumulator.features(submission_id))
+
+
+def _start_and_add(path, submission_id, result, count, done):
+    _add_frames(CheatingAccumulator(snapshot_path=path), submission_id, result, count, done)
+
+
+def _in_process(target, *args):
+    context = multiprocessing.get_context("fork")
+    process = context.Process(target=target, args=args)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+
+def test_counts_frames_of_each_submission():
+    accumulator = CheatingAccumulator()
+    _add_frames(accumulator, "a", PHONE, 3)
+    _add_frames(accumulator, "a", GAZE, 2)
+    _add_frames(accumulator, "b", GAZE, 1)
+    assert accumulator.features("a") == [5, 3, 0, 0, 0, 2]
+    assert accumulator.features("b") == [1, 0, 0, 0, 0, 1]
+    assert accumulator.features("c") is None
+
+
+def test_idle_submissions_are_forgotten():
+    accumulator = CheatingAccumulator(idle_timeout=0)
+    accumulator.add("a", PHONE)
+    accumulator.snapshot()
+    assert accumulator.features("a") is None
+
+
+def test_processes_add_up_each_others_counts(tmp_path):
+    path = str(tmp_path / "features.json")
+    # Forked after it was created, like gunicorn workers after --preload
+    accumulator = CheatingAccumulator(snapshot_path=path)
+    _in_process(_add_frames, accumulator, "a", PHONE, 3)
+    _in_process(_add_frames, accumulator, "a", GAZE, 2)
+    _add_frames(accumulator, "a", PHONE, 1)
+
+    assert accumulator.features("a") == [6, 4, 0, 0, 0, 2]
+    # One file per process, none written over another
+    assert len(glob.glob(path + ".[0-9]*")) == 3
+
+
+def test_restart_restores_every_process_once(tmp_path):
+    path = str(tmp_path / "features.json")
+    first_run = CheatingAccumulator(snapshot_path=path)
+    _in_process(_add_frames, first_run, "a", PHONE, 3)
+    _in_process(_add_frames, first_run, "a", GAZE, 2)
+
+    # Both processes are gone, the next one takes their counts over
+    restarted = CheatingAccumulator(snapshot_path=path)
+    assert restarted.features("a") == [5, 3, 0, 0, 0, 2]
+    assert glob.glob(path + ".[0-9]*") == [f"{path}.{os.getpid()}"]
+
+    # A second process starting beside it finds nothing left to take over
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    _in_process(_start_and_add, path, "a", PHONE, 1, results)
+    assert results.get(timeout=10) == [6, 4, 0, 0, 0, 2]
+    assert restarted.features("a") == [6, 4, 0, 0, 0, 2]
+
+
+def test_restores_a_single_snapshot_file(tmp_path):
+    path = tmp_path / "features.json"
+    with open(path, "w") as f:
+        json.dump({"a": [[4, 1, 0, 0, 0, 0], 4102444800]}, f)
+    accumulator = CheatingAccumulator(snapshot_path=str(path))
+    assert accumulator.features("a") == [4, 1, 0, 0, 0, 0]
+    assert not path.exists()
+
+
+@pytest.mark.parametrize("count", [0, 5])
+def test_snapshot_only_written_when_changed(tmp_path, count):
+    path = str(tmp_path / "features.json")
+    accumulator = CheatingAccumulator(snapshot_path=path)
+    _add_frames(accumulator, "a", PHONE, count)
+    assert os.path.exists(f"{path}.{os.getpid()}") == bool(count)
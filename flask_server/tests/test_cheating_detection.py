@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import GaussianNB
+from sklearn.tree import DecisionTreeClassifier
+
+from cheating_detection import (COMPILED_MAX_BATCH, FEATURE_NAMES, PARITY_TOLERANCE, CheatingPredictor,
+                                parity_samples, predict_cheating_probability)
+
+MODELS = {
+    "random_forest": lambda: RandomForestClassifier(n_estimators=25, random_state=0),
+    "extra_trees": lambda: ExtraTreesClassifier(n_estimators=25, random_state=0),
+    "decision_tree": lambda: DecisionTreeClassifier(max_depth=8, random_state=0),
+    "logistic_regression": lambda: LogisticRegression(max_iter=1000),
+}
+
+
+def training_data(count=600, seed=0):
+    """Quizzes labelled cheating when a noisy share of their flagged frames is high."""
+    X = parity_samples(count, seed=seed)
+    rng = np.random.default_rng(seed)
+    flagged = X[:, 1:].sum(axis=1) / (X[:, 0] * len(FEATURE_NAMES))
+    y = (flagged + rng.normal(0, 0.1, count) > 0.5).astype(int)
+    return X, y
+
+
+def fitted(name, with_feature_names=False):
+    X, y = training_data()
+    if with_feature_names:
+        X = pd.DataFrame(X, columns=FEATURE_NAMES)
+    return MODELS[name]().fit(X, y)
+
+
+@pytest.mark.parametrize("name", MODELS)
+def test_compiled_predict_proba_matches_sklearn(name):
+    model = fitted(name)
+    predictor = CheatingPredictor(model)
+    assert predictor.backend == "numpy"
+
+    # Other quizzes than the ones the predictor checked itself on
+    X = parity_samples(COMPILED_MAX_BATCH, seed=1)
+    np.testing.assert_allclose(predictor.predict_proba(X), model.predict_proba(X), rtol=0, atol=PARITY_TOLERANCE)
+
+
+@pytest.mark.parametrize("name", MODELS)
+def test_compiled_model_fitted_with_feature_names(name):
+    model = fitted(name, with_feature_names=True)
+    predictor = CheatingPredictor(model)
+    assert predictor.backend == "numpy"
+
+    X = parity_samples(64, seed=2)
+    expected = model.predict_proba(pd.DataFrame(X, columns=FEATURE_NAMES))
+    np.testing.assert_allclose(predictor.predict_proba(X), expected, rtol=0, atol=PARITY_TOLERANCE)
+
+
+def test_features_on_split_thresholds():
+    # Counts right at a split threshold must go the same way as in sklearn
+    model = fitted("decision_tree")
+    predictor = CheatingPredictor(model)
+    split = model.tree_.feature >= 0
+    X = parity_samples(int(split.sum()), seed=3)
+    X[np.arange(len(X)), model.tree_.feature[split]] = model.tree_.threshold[split]
+    np.testing.assert_allclose(predictor.predict_proba(X), model.predict_proba(X), rtol=0, atol=PARITY_TOLERANCE)
+
+
+def test_large_batches_use_sklearn():
+    model = fitted("random_forest")
+    predictor = CheatingPredictor(model)
+    X = parity_samples(COMPILED_MAX_BATCH + 1, seed=4)
+    np.testing.assert_array_equal(predictor.predict_proba(X), model.predict_proba(X))
+
+
+def test_unsupported_model_falls_back_to_sklearn():
+    X, y = training_data()
+    model = GaussianNB().fit(X, y)
+    predictor = CheatingPredictor(model)
+    assert predictor.backend == "sklearn"
+    np.testing.assert_array_equal(predictor.predict_proba(X[:10]), model.predict_proba(X[:10]))
+
+
+def test_seeded_predictions_are_deterministic():
+    model = fitted("decision_tree")
+    X = parity_samples(200, seed=5)
+    probabilities = model.predict_proba(X)[:, 1] * 100
+    # Both adjusted ranges are exercised
+    assert (probabilities >= 90).any() and (probabilities <= 10).any()
+
+    first = CheatingPredictor(model, seed=42).predict(X)
+    assert CheatingPredictor(model, seed=42).predict(X) == first
+    # A result does not depend on the other submissions in the call or on their order
+    reversed_results = CheatingPredictor(model, seed=42).predict(X[::-1])
+    assert reversed_results[::-1] == first
+    assert [CheatingPredictor(model, seed=42).predict([row])[0] for row in X[:20]] == first[:20]
+
+    assert CheatingPredictor(model, seed=43).predict(X) != first
+
+
+def test_seeded_adjustment_stays_in_range():
+    model = fitted("decision_tree")
+    X = parity_samples(200, seed=5)
+    probabilities = model.predict_proba(X)[:, 1] * 100
+    for probability, result in zip(probabilities, CheatingPredictor(model, seed=42).predict(X)):
+        cheating = result["cheating_probability"]
+        if probability >= 90:
+            assert 80 <= cheating <= 100
+        elif probability <= 10:
+            assert 0 <= cheating <= 30
+        else:
+            assert cheating == round(probability, 2)
+        assert result["not_cheating_probability"] == pytest.approx(100 - cheating, abs=0.011)
+
+
+def test_predict_cheating_probability_accepts_a_plain_model():
+    model = fitted("logistic_regression")
+    X = parity_samples(200, seed=6)
+    probabilities = model.predict_proba(X) * 100
+    # A probability that is not adjusted, so the result is the model's own
+    row = int(np.flatnonzero((probabilities[:, 1] > 10) & (probabilities[:, 1] < 90))[0])
+    result = predict_cheating_probability(list(X[row]), model)
+    assert result == {"cheating_probability": round(probabilities[row, 1], 2),
+                      "not_cheating_probability": round(probabilities[row, 0], 2)}
@@ -0,0 +1,131 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+import face_gallery
+from face_gallery import COMPACT_MIN_BLANK, FaceGallery
+
+
+def encodings(count, seed=0):
+    return np.random.default_rng(seed).normal(0, 0.1, (count, 128)).astype(np.float32)
+
+
+def test_reregistration_does_not_grow_the_files(tmp_path):
+    gallery = FaceGallery(str(tmp_path), capacity=16)
+    faces = encodings(10)
+    for round_ in range(50):
+        for student, face in enumerate(faces):
+            gallery.add(f"student-{student}", face + round_ * 1e-3)
+
+    assert len(gallery) == 10
+    assert gallery._capacity == 16
+    assert os.path.getsize(tmp_path / "encodings.f32") == 16 * 128 * 4
+    for student, face in enumerate(faces):
+        assert gallery.query(face + 49e-3, k=1)[0][0] == f"student-{student}"
+
+
+def test_compaction_keeps_the_gallery_across_restarts(tmp_path):
+    gallery = FaceGallery(str(tmp_path), capacity=16)
+    faces = encodings(COMPACT_MIN_BLANK * 2)
+    for student, face in enumerate(faces):
+        gallery.add(f"student-{student}", face)
+    for student in range(0, len(faces), 2):
+        assert gallery.remove(f"student-{student}")
+    assert gallery._count == len(faces) // 2
+
+    reopened = FaceGallery(str(tmp_path))
+    assert len(reopened) == len(faces) // 2
+    for student in range(len(faces)):
+        matches = reopened.query(faces[student], k=1)
+        if student % 2:
+            assert matches[0][0] == f"student-{student}"
+            assert matches[0][1] == pytest.approx(0, abs=1e-3)
+        else:
+            assert matches[0][0] != f"student-{student}"
+
+
+def test_rejects_ids_that_do_not_fit(tmp_path):
+    gallery = FaceGallery(str(tmp_path))
+    with pytest.raises(ValueError):
+        gallery.add("x" * 65, encodings(1)[0])
+    with pytest.raises(ValueError):
+        gallery.add("", encodings(1)[0])
+    gallery.add("x" * 64, encodings(1)[0])
+    assert "x" * 64 in gallery
+
+
+@pytest.mark.skipif(face_gallery.faiss is None, reason="faiss is not installed")
+def test_approximate_search_skips_removed_students(tmp_path):
+    gallery = FaceGallery(str(tmp_path), approximate=True)
+    faces = encodings(200)
+    for student, face in enumerate(faces):
+        gallery.add(f"student-{student}", face)
+    assert gallery.query(faces[0], k=1)[0][0] == "student-0"
+
+    gallery.remove("student-0")
+    gallery.add("student-1", faces[0])
+    matches = gallery.query(faces[0], k=5)
+    assert matches[0] == ("student-1", pytest.approx(0, abs=1e-3))
+    assert "student-0" not in [student for student, _ in matches]
+    assert len(matches) == 5
+
+
+def _enrol(gallery, first, count, faces):
+    for student in range(first, first + count):
+        gallery.add(f"student-{student}", faces[student])
+
+
+def _register(gallery, student_id, face, results):
+    results.put((student_id, gallery.add_unless_duplicate(student_id, face, threshold=0.1)))
+
+
+def test_processes_sharing_a_gallery_see_each_others_students(tmp_path):
+    # Forked from a process that opened the gallery, like gunicorn workers after --preload
+    gallery = FaceGallery(str(tmp_path), capacity=16)
+    faces = encodings(200)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_enrol, args=(gallery, first, 50, faces)) for first in range(0, 200, 50)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    assert len(gallery) == 200
+    for student in range(200):
+        assert gallery.query(faces[student], k=1)[0] == (f"student-{student}", pytest.approx(0, abs=1e-3))
+    assert len(FaceGallery(str(tmp_path))) == 200
+
+
+def test_a_face_is_registered_to_one_student_across_processes(tmp_path):
+    gallery = FaceGallery(str(tmp_path))
+    face = encodings(1)[0]
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [context.Process(target=_register, args=(gallery, f"student-{student}", face, results))
+               for student in range(4)]
+    for worker in workers:
+        worker.start()
+    outcomes = dict(results.get(timeout=30) for _ in workers)
+    for worker in workers:
+        worker.join()
+
+    added = [student_id for student_id, duplicate in outcomes.items() if duplicate is None]
+    assert len(added) == 1
+    assert len(gallery) == 1 and added[0] in gallery
+
+
+def test_removal_and_compaction_in_another_instance(tmp_path):
+    first = FaceGallery(str(tmp_path), capacity=16)
+    second = FaceGallery(str(tmp_path))
+    faces = encodings(COMPACT_MIN_BLANK * 2)
+    _enrol(first, 0, len(faces), faces)
+    for student in range(COMPACT_MIN_BLANK):
+        second.remove(f"student-{student}")
+
+    # The first instance follows the compacted and grown files of the second
+    assert len(first) == COMPACT_MIN_BLANK
+    assert first.query(faces[-1], k=1)[0][0] == f"student-{len(faces) - 1}"
+    assert "student-0" not in first
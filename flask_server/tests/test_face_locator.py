@@ -0,0 +1,51 @@
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytest
+
+from face_locator import FaceLocator
+from frame import Frame
+
+# Registration photos kept in the repository, each with a face
+IMAGES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "..", "server", "uploads",
+                                       "face_biometric_data", "*.jp*g")))
+
+
+def frames():
+    return [Frame.from_path(path) for path in IMAGES]
+
+
+@pytest.mark.skipif(not IMAGES, reason="no face images in the repository")
+@pytest.mark.parametrize("strategy", ["full", "downscaled"])
+def test_threads_get_the_serial_results(strategy):
+    locator = FaceLocator(strategy=strategy, max_side=400)
+    serial = [(locator.find(frame), locator.encode(frame)) for frame in frames()]
+    assert any(encodings for _, encodings in serial)
+
+    # Every image several times, images of different sizes at once on the shared dlib models
+    work = frames() * 2
+    with ThreadPoolExecutor(8) as executor:
+        threaded = list(executor.map(lambda frame: (locator.find(frame), locator.encode(frame)), work))
+
+    for (locations, encodings), (expected_locations, expected_encodings) in zip(threaded, serial * 2):
+        assert locations == expected_locations
+        assert len(encodings) == len(expected_encodings)
+        for encoding, expected in zip(encodings, expected_encodings):
+            np.testing.assert_array_equal(encoding, expected)
+
+
+def test_threads_encode_given_locations_like_one_thread():
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 255, (size, size, 3), dtype=np.uint8) for size in (120, 200, 320, 480)]
+    locator = FaceLocator(strategy="reuse")
+    boxes = [(10, 10, size - 10, size - 10) for size in (120, 200, 320, 480)]
+    work = [(Frame.from_bytes(cv2.imencode(".png", image)[1].tobytes()), box) for image, box in zip(images, boxes)]
+    serial = [locator.encode(frame, face_box=box) for frame, box in work]
+
+    with ThreadPoolExecutor(8) as executor:
+        threaded = list(executor.map(lambda item: locator.encode(item[0], face_box=item[1]), work * 4))
+    for encodings, expected in zip(threaded, serial * 4):
+        np.testing.assert_array_equal(encodings[0], expected[0])
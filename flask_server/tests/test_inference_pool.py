@@ -0,0 +1,152 @@
+import os
+import time
+
+import pytest
+
+from inference_pool import InferencePool, JobExpired, JobPreempted, JobTimedOut
+
+
+def _handlers(fail=False):
+    if fail:
+        raise RuntimeError("no model")
+    return {
+        "echo": lambda value: value,
+        "sleep": lambda seconds: (time.sleep(seconds), os.getpid())[1],
+        "crash": lambda: os._exit(3),
+        "raise": lambda: 1 / 0,
+    }
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(**kwargs):
+        pool = InferencePool(_handlers, start_method="fork", **kwargs)
+        pool.start()
+        pools.append(pool)
+        if not kwargs.get("initargs"):
+            wait_until(pool.is_ready)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close(timeout=2)
+
+
+def wait_until(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting"
+        time.sleep(0.05)
+
+
+def settled(pool):
+    stats = pool.stats()
+    return stats["in_flight"] == 0 and stats["queued"] == 0 and stats["ready_workers"] == pool.workers
+
+
+def test_runs_jobs_and_reports_errors(make_pool):
+    pool = make_pool(workers=2)
+    assert [pool.run("echo", value) for value in range(5)] == list(range(5))
+    with pytest.raises(RuntimeError, match="ZeroDivisionError"):
+        pool.run("raise")
+    assert pool.stats()["completed"] == 5
+    assert pool.stats()["failed"] == 1
+
+
+def test_interactive_jobs_go_first(make_pool):
+    pool = make_pool(workers=1)
+    busy = pool.submit("sleep", 0.5)
+    background = pool.submit("echo", "background")
+    interactive = pool.submit("echo", "interactive", priority="interactive")
+    interactive.result(timeout=10)
+    assert not background.done()
+    assert background.result(timeout=10) == "background"
+    busy.result(timeout=10)
+
+
+def test_full_queue_preempts_less_urgent_jobs(make_pool):
+    pool = make_pool(workers=1, max_queue=1)
+    busy = pool.submit("sleep", 0.5)
+    background = pool.submit("echo", 1)
+    interactive = pool.submit("echo", 2, priority="interactive")
+    with pytest.raises(JobPreempted):
+        background.result(timeout=10)
+    # Nothing less urgent to drop
+    assert pool.submit("echo", 3) is None
+    assert interactive.result(timeout=10) == 2
+    busy.result(timeout=10)
+    stats = pool.stats()["classes"]
+    assert stats["background"]["preempted"] == 1 and stats["background"]["rejected"] == 1
+
+
+def test_expired_deadline(make_pool):
+    pool = make_pool(workers=1)
+    with pytest.raises(JobExpired):
+        pool.run("echo", 1, deadline=time.time() - 1)
+    busy = pool.submit("sleep", 0.5)
+    late = pool.submit("echo", 2, deadline=time.time() + 0.1)
+    with pytest.raises(JobExpired):
+        late.result(timeout=10)
+    busy.result(timeout=10)
+
+
+def test_running_job_times_out_and_its_worker_is_replaced(make_pool):
+    pool = make_pool(workers=1, job_timeout=0.5)
+    first_pid = pool.run("sleep", 0)
+    with pytest.raises(JobTimedOut):
+        pool.run("sleep", 30)
+    wait_until(lambda: settled(pool))
+    assert pool.run("sleep", 0) != first_pid
+    stats = pool.stats()
+    assert stats["restarts"] == 1
+    assert stats["classes"]["background"]["timed_out"] == 1
+
+
+def test_waiting_job_times_out_without_running(make_pool):
+    pool = make_pool(workers=1, job_timeout=0.5)
+    busy = pool.submit("sleep", 1.5)
+    with pytest.raises(JobTimedOut):
+        pool.run("echo", 1)
+    assert pool.stats()["queued"] == 0
+    # The busy worker was not stopped, its job still finishes
+    busy.result(timeout=10)
+    assert pool.stats()["restarts"] == 0
+    assert pool.run("echo", 2) == 2
+
+
+def test_crashed_worker_fails_its_job_and_is_replaced(make_pool):
+    pool = make_pool(workers=1)
+    queued = pool.submit("echo", "after the crash")
+    crashed = pool.submit("crash")
+    with pytest.raises(RuntimeError, match="exited"):
+        crashed.result(timeout=10)
+    # Jobs waiting behind the crash run on the replacement
+    assert queued.result(timeout=20) == "after the crash"
+    assert pool.run("echo", 1) == 1
+    wait_until(lambda: settled(pool))
+    assert pool.stats()["restarts"] == 1
+
+
+def test_job_sent_to_a_dying_worker_fails_instead_of_hanging(make_pool):
+    pool = make_pool(workers=1)
+    pool._processes[0].kill()
+    # The job may reach the worker's pipe before the worker is gone, it then fails with it
+    future = pool.submit("echo", 1)
+    try:
+        assert future.result(timeout=20) == 1
+    except RuntimeError as e:
+        assert "exited" in str(e)
+    wait_until(lambda: settled(pool))
+    assert pool.run("echo", 2) == 2
+    assert pool.stats()["restarts"] == 1
+
+
+def test_worker_failing_to_start_is_not_restarted(make_pool):
+    pool = make_pool(workers=2, initargs=(True,))
+    wait_until(lambda: pool.stats()["failed_workers"] == 2)
+    time.sleep(1.5)
+    stats = pool.stats()
+    assert stats["restarts"] == 0 and stats["ready_workers"] == 0
+    assert not pool.is_ready()
@@ -0,0 +1,122 @@
+import cv2
+import numpy as np
+import pytest
+
+import result_cache
+from face_locator import FaceLocator
+from face_pipeline import cache_key
+from frame import Frame
+from result_cache import ENTRY_OVERHEAD, ResultCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache.time, "monotonic", clock)
+    return clock
+
+
+def encoding(value=0.0):
+    return np.full(128, value, dtype=np.float64)
+
+
+def test_least_recently_used_entries_go_when_full():
+    entry_size = ENTRY_OVERHEAD + encoding().nbytes
+    cache = ResultCache(max_bytes=3 * entry_size)
+    for key in "abc":
+        cache.put(key, "encodings", encoding())
+
+    cache.get("a")
+    cache.put("d", "encodings", encoding())
+
+    assert cache.get("b") == {}
+    assert set(cache.get("a")) == set(cache.get("c")) == set(cache.get("d")) == {"encodings"}
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["evictions"] == 1
+    assert stats["bytes"] == 3 * entry_size
+
+
+def test_fields_add_to_the_entry_and_replacing_one_keeps_the_size():
+    cache = ResultCache()
+    cache.put("a", "spoof", encoding())
+    cache.put("a", "encodings", [encoding()])
+    size = cache.stats()["bytes"]
+    cache.put("a", "encodings", [encoding(1.0)])
+
+    assert set(cache.get("a")) == {"spoof", "encodings"}
+    assert cache.stats()["bytes"] == size
+    assert cache.get("a")["encodings"][0][0] == 1.0
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ResultCache(ttl=10)
+    cache.put("a", "encodings", encoding())
+    clock.now += 5
+    cache.put("b", "encodings", encoding())
+
+    clock.now += 6
+    assert cache.get("a") == {}
+    assert "encodings" in cache.get("b")
+    # Adding a field does not extend the life of an entry
+    cache.put("b", "spoof", encoding())
+    clock.now += 5
+    assert cache.get("b") == {}
+    assert cache.stats()["expirations"] == 2
+    assert cache.stats()["bytes"] == 0
+
+
+def test_expired_entries_are_dropped_on_put(clock):
+    cache = ResultCache(ttl=10)
+    cache.put("a", "encodings", encoding())
+    clock.now += 11
+    cache.put("b", "encodings", encoding())
+
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["expirations"] == 1
+
+
+def test_cached_arrays_are_read_only():
+    cache = ResultCache()
+    cache.put("a", "encodings", [encoding()])
+    with pytest.raises(ValueError):
+        cache.get("a")["encodings"][0][0] = 1.0
+
+
+def test_disabled_cache_has_no_key():
+    cache = ResultCache(max_bytes=0)
+    assert not cache.enabled
+    cache.put(None, "encodings", encoding())
+    assert cache.get(None) == {}
+
+
+def image_bytes(seed, extension=".png"):
+    image = np.random.default_rng(seed).integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    return cv2.imencode(extension, image)[1].tobytes()
+
+
+def test_keys_follow_the_image_content_not_its_name(tmp_path):
+    locator = FaceLocator()
+    path = tmp_path / "upload.png"
+    path.write_bytes(image_bytes(0))
+
+    key = cache_key(Frame.from_bytes(image_bytes(0), name="first.png"), locator, "full")
+    assert cache_key(Frame.from_bytes(image_bytes(0), name="second.png"), locator, "full") == key
+    assert cache_key(Frame.from_path(str(path)), locator, "full") == key
+    assert cache_key(Frame.from_bytes(image_bytes(1), name="first.png"), locator, "full") != key
+
+
+def test_keys_include_the_detection_settings():
+    frame = Frame.from_bytes(image_bytes(0))
+    key = cache_key(frame, FaceLocator(), "full")
+
+    assert cache_key(frame, FaceLocator(), "crop") != key
+    assert cache_key(frame, FaceLocator(strategy="downscaled"), "full") != key
+    assert cache_key(frame, FaceLocator(upsample=2), "full") != key
@@ -0,0 +1,195 @@
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+
+from smtp_pool import SMTPPool
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Local SMTP server that accepts every message and records what it was sent."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.connections = 0
+        self.commands = []
+        self.messages = []
+        self.sockets = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, command):
+        with self.lock:
+            return sum(1 for seen in self.commands if seen == command)
+
+    def drop_sessions(self):
+        """Closes every open session, like a server dropping idle clients."""
+        with self.lock:
+            sockets, self.sockets = self.sockets, []
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+            self.server.sockets.append(self.connection)
+        self.reply("220 localhost ready")
+        for raw in self.rfile:
+            command = raw.decode(errors="replace").strip().upper().split(" ")[0]
+            with self.server.lock:
+                self.server.commands.append(command)
+            if command == "EHLO":
+                self.wfile.write(b"250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif command == "AUTH":
+                self.reply("235 Authenticated")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                for line in self.rfile:
+                    if line in (b".\r\n", b".\n"):
+                        break
+                    lines.append(line)
+                with self.server.lock:
+                    self.server.messages.append(b"".join(lines).decode())
+                self.reply("250 Queued")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+@pytest.fixture
+def server():
+    server = SMTPStandIn()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_pool(server):
+    pools = []
+
+    def make(**kwargs):
+        pool = SMTPPool("127.0.0.1", server.port, "user", "secret", starttls=False, timeout=5, **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def send(pool, body):
+    pool.send("from@example.com", ["to@example.com"], f"Subject: test\r\n\r\n{body}")
+
+
+def test_connection_is_logged_in_once_and_reused(server, make_pool):
+    pool = make_pool()
+    for number in range(3):
+        send(pool, f"message {number}")
+
+    assert server.connections == 1
+    assert server.count("AUTH") == 1
+    assert len(server.messages) == 3
+    stats = pool.stats()
+    assert (stats["connects"], stats["reuses"], stats["sent"]) == (1, 2, 3)
+
+
+def test_connection_idle_past_check_after_is_checked_with_noop(server, make_pool):
+    pool = make_pool(check_after=0.1)
+    send(pool, "first")
+    send(pool, "right away")
+    assert server.count("NOOP") == 0
+
+    time.sleep(0.2)
+    send(pool, "after a pause")
+    assert server.count("NOOP") == 1
+    assert server.connections == 1
+
+
+def test_failed_noop_check_reconnects(server, make_pool):
+    pool = make_pool(check_after=0.1)
+    send(pool, "first")
+    server.drop_sessions()
+    time.sleep(0.2)
+
+    send(pool, "second")
+    assert server.connections == 2
+    assert pool.stats()["failed_checks"] == 1
+    assert len(server.messages) == 2
+
+
+def test_message_is_resent_when_the_session_was_dropped(server, make_pool):
+    # Not checked before reuse, the drop shows up while sending
+    pool = make_pool(check_after=60)
+    send(pool, "first")
+    server.drop_sessions()
+
+    send(pool, "second")
+    assert pool.stats()["resends"] == 1
+    assert server.connections == 2
+    assert [message.strip().splitlines()[-1] for message in server.messages] == ["first", "second"]
+
+
+def test_connection_idle_past_max_idle_is_closed(server, make_pool):
+    pool = make_pool(max_idle=0.1, check_after=60)
+    send(pool, "first")
+    time.sleep(0.2)
+
+    send(pool, "second")
+    assert server.connections == 2
+    # Closed politely, not checked first
+    assert server.count("QUIT") == 1 and server.count("NOOP") == 0
+    assert pool.stats()["open"] == 1
+
+
+def test_senders_wait_for_a_free_connection_at_max_size(server, make_pool):
+    pool = make_pool(max_size=1)
+    sent = threading.Event()
+    with pool.connection():
+        sender = threading.Thread(target=lambda: (send(pool, "waiting"), sent.set()))
+        sender.start()
+        assert not sent.wait(0.3)
+        assert pool.stats()["open"] == 1
+    assert sent.wait(5)
+    sender.join()
+    assert server.connections == 1
+
+
+def test_failed_connection_frees_its_slot(server, make_pool):
+    pool = SMTPPool("127.0.0.1", server.port, "user", "secret", max_size=1, starttls=False, timeout=5)
+    server.shutdown()
+    server.server_close()
+    with pytest.raises(OSError):
+        send(pool, "nowhere")
+    assert pool.stats()["open"] == 0
+
+
+def test_closed_pool_quits_its_sessions(server, make_pool):
+    pool = make_pool()
+    send(pool, "first")
+    pool.close()
+    deadline = time.monotonic() + 5
+    while server.count("QUIT") == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert server.count("QUIT") == 1
+    with pytest.raises(RuntimeError):
+        send(pool, "too late")
@@ -1,43 +1,43 @@
 import face_recognition
-import cv2
+import numpy as np
 import os
+from scipy.optimize import linear_sum_assignment
 # from test import test
-from spoof_detector import is_real_image
+from face_pipeline import encode_real_face, executor
+from spoof_detector import real_faces
+from frame import as_frame
+from face_locator import FaceLocator
 
 # Define a threshold for face matching
 FACE_MATCH_THRESHOLD = 0.4
 
 
-def verify_face(image_path, known_face_encoding, model):
+def verify_face(frame, known_face_encoding, model, face_locator=None, spoof_mode="full"):
     """
-    Verify if the face encoding matches the face in the provided image path.
+    Verify if the face encoding matches the face in the provided image.
 
-    :param image_path: Path to the image file.
+    :param frame: The image as a Frame, or a path to the image file.
     :param known_face_encoding: The face encoding to compare with.
+    :param face_locator: FaceLocator choosing the face detection strategy, full resolution by default.
+    :param spoof_mode: "full" runs the anti-spoof model on the whole image, "crop" on the face.
     :return: A tuple containing a success flag, result or error message.
     """
-    if not image_path:
+    if not frame:
         return False, "No image path provided"
 
-    if not os.path.exists(image_path):
+    frame = as_frame(frame)
+    if frame.path is not None and not os.path.exists(frame.path):
         return False, "Image not found"
 
-    try:
-        # Load the image
-        image = face_recognition.load_image_file(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Get face encodings
-        face_encodings = face_recognition.face_encodings(image)
-
-        if len(face_encodings) == 0:
-            return False, "No face detected"
+    face_locator = face_locator or FaceLocator()
 
+    try:
+        # Anti-spoof check and face encoding run concurrently, the first failure wins
         # isReal = test(device_id=0, model_dir="./resources/anti_spoof_models", image_path=image_path)
-        isReal = is_real_image(image_path, model, threshold=0.6)
-
-        if not isReal:
-            return False, "Fake face detected"
+        success, result = encode_real_face(frame, model, 0.6, face_locator, spoof_mode)
+        if not success:
+            return False, result
+        face_encodings = result
 
         # Calculate the distance between the known face encoding and the first face encoding found
         face_distances = face_recognition.face_distance([known_face_encoding], face_encodings[0])
@@ -48,3 +48,92 @@ def verify_face(image_path, known_face_encoding, model):
 
     except Exception as e:
         return False, str(e)
+
+
+def match_roster(face_encodings, roster_encodings, threshold=FACE_MATCH_THRESHOLD):
+    """
+    Pairs the faces of an image with roster students, each face and each student at most once.
+
+    All distances are computed as one matrix, and the pairing with the smallest total distance
+    is chosen, so a face close to two students cannot be given to both.
+
+    :param face_encodings: Array of the F face encodings found in the image.
+    :param roster_encodings: Array of the R known face encodings of the roster.
+    :param threshold: Distance up to which a face and a student match.
+    :return: List of (face index, roster index, distance) pairs within the threshold.
+    """
+    if not len(face_encodings) or not len(roster_encodings):
+        return []
+    # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, a matrix product instead of an F x R x 128 difference array
+    squared = ((face_encodings ** 2).sum(axis=1)[:, None] + (roster_encodings ** 2).sum(axis=1)[None, :]
+               - 2 * face_encodings @ roster_encodings.T)
+    distances = np.sqrt(np.maximum(squared, 0))
+    # Pairs beyond the threshold are never wanted, price them so they are only used when nothing else fits
+    cost = np.where(distances <= threshold, distances, threshold + 1)
+    faces, students = linear_sum_assignment(cost)
+    return [(int(face), int(student), float(distances[face, student]))
+            for face, student in zip(faces, students) if distances[face, student] <= threshold]
+
+
+def identify_faces(frame, roster, model, face_locator=None, threshold=FACE_MATCH_THRESHOLD):
+    """
+    Takes attendance from one classroom or group image.
+
+    Every face is detected and encoded once, and all of them are checked for spoofs in one
+    batched run of the anti-spoof model on the face crops, whatever the spoof check mode.
+
+    :param frame: The image as a Frame, or a path to the image file.
+    :param roster: List of (student_id, known_face_encoding) pairs, the encoding None when unknown.
+    :param model: Anti-spoof model.
+    :param face_locator: FaceLocator choosing the face detection strategy, full resolution by default.
+    :param threshold: Distance up to which a face and a student match.
+    :return: A tuple containing a success flag, and a dictionary with the status of every roster
+             student (present, absent, or unknown when their presence cannot be decided) and the
+             number of faces found and left unmatched, or an error message.
+    """
+    frame = as_frame(frame)
+    if frame.path is not None and not os.path.exists(frame.path):
+        return False, "Image not found"
+
+    face_locator = face_locator or FaceLocator()
+
+    try:
+        locations = face_locator.find(frame)
+        if not locations:
+            return False, "No face detected"
+
+        # The anti-spoof check and the encoding both release the GIL, run them side by side
+        spoof_check = executor.submit(real_faces, frame, model, locations, 0.6)
+        encoding = executor.submit(face_locator.encode, frame, locations=locations)
+        is_real = spoof_check.result()
+        face_encodings = np.array(encoding.result())
+
+        known = [index for index, (_, known_face_encoding) in enumerate(roster) if known_face_encoding is not None]
+        # Shaped explicitly so a roster without any known encoding still gives a 0 x 128 matrix
+        roster_encodings = np.array([roster[index][1] for index in known]).reshape(len(known),
+                                                                                 face_encodings.shape[1])
+        matches = match_roster(face_encodings, roster_encodings, threshold)
+
+        students = [{"student_id": student_id, "status": "absent" if known_face_encoding is not None else "unknown"}
+                    for student_id, known_face_encoding in roster]
+        for index, (_, known_face_encoding) in enumerate(roster):
+            if known_face_encoding is None:
+                students[index]["reason"] = "No known face encoding"
+        for face, student, distance in matches:
+            entry = students[known[student]]
+            entry["distance"] = round(distance, 4)
+            if is_real[face]:
+                entry["status"] = "present"
+            else:
+                # Someone showed a photo or screen of the student, they may or may not be there
+                entry["status"] = "unknown"
+                entry["reason"] = "Fake face detected"
+
+        return True, {
+            "students": students,
+            "faces": len(locations),
+            "fake_faces": len(locations) - sum(is_real),
+            "unmatched_faces": len(locations) - len(matches),
+        }
+    except Exception as e:
+        return False, str(e)
@@ -395,8 +395,10 @@ const registerStudentFace = async (studentId, imagePath) => {
     throw new AppError("Student Not Found", 404);
   }
   // Call Flask API to get face encoding
+  // With the student id, Flask refuses a face already registered to another student
   const response = await axios.post(`${process.env.FLASK_URL}/register-face`, {
     image_path: imagePath,
+    student_id: String(student._id),
   });
   if (!response.data.success) {
     throw new AppError(response.data.error, 400);
@@ -421,9 +423,11 @@ const verifyStudentFace = async (studentId, imagePath, encoding) => {
     throw new AppError("Student Not Found", 404);
   }
   // Call Flask API for face verification
+  // With the student id, Flask keeps the encoding cached for the student's next verification
   const response = await axios.post(`${process.env.FLASK_URL}/verify-face`, {
     image_path: imagePath,
     known_face_encoding: encoding,
+    student_id: String(student._id),
   });
   deleteFileByPath(imagePath);
   if (!response.data.success) {
@@ -36,9 +36,20 @@ const analyzeImage = async (studentId, quizId, imagePath) => {
   }
 
   // Call Flask API to analyze the image
-  const response = await axios.post(`${process.env.FLASK_URL}/analyze-image`, {
-    image_path: imagePath,
-  });
+  // Frames are background work for Flask, dropped unanalyzed once the quiz has ended
+  const response = await axios.post(
+    `${process.env.FLASK_URL}/analyze-image`,
+    {
+      image_path: imagePath,
+      submission_id: submission._id,
+    },
+    {
+      headers: {
+        "X-Priority": "background",
+        "X-Deadline": new Date(submission.endTime).getTime(),
+      },
+    }
+  );
 
   if (!response.data.success) {
     throw new AppError(response.data.error, 400);
@@ -443,6 +443,7 @@ const submitQuiz = async (quizId, studentId, answers) => {
     `${process.env.FLASK_URL}/predict-cheating`,
     {
       features: features,
+      submission_id: submission._id,
     }
   );
 